@@ -0,0 +1,184 @@
+from typing import Any, Dict, List
+from ..core.base_agent import BaseAgent
+from ..core.cache import cached_labels
+from ..core.filters import filter_query, investment_filters
+
+
+class AggregateAgent(BaseAgent):
+    """
+    Aggregate Agent: groupBy / sum / sort / rank (opérateur OP3).
+    Compile des demandes d'agrégation déclaratives en agrégations ES (size=0) :
+    seuls les buckets remontent, jamais les documents.
+    """
+    SUPPORTED = {"group_by", "top_terms", "histogram", "stats"}
+
+    METRIC_OPS = {"sum", "avg", "min", "max", "value_count", "cardinality", "stats"}
+    # Champs multi-valués pointant vers une autre entité : labels résolus en sortie
+    LABEL_INDEX = {"investors": "investor", "companies": "company"}
+    MAX_GROUPS = 10000
+    PAGE_SIZE = 1000
+
+    # ---------- helpers ----------
+    def _build_query(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params.get("es_query"):
+            return params["es_query"]
+        return filter_query(investment_filters(params))
+
+    def _build_metrics(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        # metrics: [{"op": "sum", "field": "raised_amount", "name": "total"}]
+        aggs: Dict[str, Any] = {}
+        for m in params.get("metrics") or []:
+            op, field = m.get("op"), m.get("field")
+            if op not in self.METRIC_OPS or not field:
+                raise ValueError(f"invalid metric {m} (ops: {sorted(self.METRIC_OPS)})")
+            aggs[m.get("name") or f"{op}_{field}"] = {op: {"field": field}}
+        return aggs
+
+    @staticmethod
+    def _metric_values(bucket: Dict[str, Any], names: List[str]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for n in names:
+            v = bucket.get(n) or {}
+            # stats renvoie un dict complet, les autres une valeur simple
+            out[n] = v.get("value") if "value" in v else {k: v.get(k) for k in ("count", "min", "max", "avg", "sum")}
+        return out
+
+    def _search(self, index: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        return self.es_post(f"/{index}/_search", json=body)
+
+    def _resolve_labels(self, field: str, ids: List[Any]) -> Dict[Any, Any]:
+        index = self.LABEL_INDEX.get(field)
+        if not index or not ids:
+            return {}
+        return cached_labels(self.es_post, index, ids)
+
+    def _sort_key(self, params: Dict[str, Any]):
+        sort_by = params.get("sort_by") or "doc_count"
+        def key(row: Dict[str, Any]):
+            v = row.get(sort_by, row.get("metrics", {}).get(sort_by))
+            return v if isinstance(v, (int, float)) else float("-inf")
+        return key
+
+    # ---------- tasks ----------
+    def group_by(self, index: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        # Composite : pagination exacte via after_key, même sur des groupes à forte cardinalité
+        fields: List[str] = params.get("group_by") or []
+        if isinstance(fields, str):
+            fields = [fields]
+        if not fields:
+            return {"error": "group_by needs group_by=[field,...]"}
+        metrics = self._build_metrics(params)
+        names = list(metrics.keys())
+        size = int(params.get("size", 10))
+        max_groups = min(int(params.get("max_groups", self.MAX_GROUPS)), self.MAX_GROUPS)
+        composite: Dict[str, Any] = {"size": self.PAGE_SIZE,
+                                     "sources": [{f: {"terms": {"field": f}}} for f in fields]}
+        agg: Dict[str, Any] = {"composite": composite}
+        if metrics:
+            agg["aggs"] = metrics
+        body: Dict[str, Any] = {"size": 0, "query": self._build_query(params), "aggs": {"groups": agg}}
+
+        rows: List[Dict[str, Any]] = []
+        truncated = False
+        while True:
+            res = self._search(index, body)
+            groups = res.get("aggregations", {}).get("groups", {})
+            for b in groups.get("buckets", []) or []:
+                rows.append({"key": b.get("key"), "doc_count": b.get("doc_count"),
+                             "metrics": self._metric_values(b, names)})
+            after = groups.get("after_key")
+            if not after or not groups.get("buckets"):
+                break
+            if len(rows) >= max_groups:
+                truncated = True
+                break
+            composite["after"] = after
+
+        rows.sort(key=self._sort_key(params), reverse=params.get("order", "desc") != "asc")
+        top = rows[:size]
+        if len(fields) == 1 and params.get("resolve_labels", True):
+            labels = self._resolve_labels(fields[0], [r["key"][fields[0]] for r in top])
+            if labels:
+                for r in top:
+                    r["label"] = labels.get(r["key"][fields[0]])
+        out = {"summary": f"{len(rows)} groupes par {fields} dans {index} (top {len(top)}).",
+               "groups": top}
+        if truncated:
+            out["note"] = f"arrêt après {len(rows)} groupes (max_groups)"
+        return out
+
+    def top_terms(self, index: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        # Classement poussé côté ES (terms agg ordonnée) : rapide, approximatif sur très forte cardinalité
+        field = params.get("field")
+        if not field:
+            return {"error": "top_terms needs field"}
+        metrics = self._build_metrics(params)
+        names = list(metrics.keys())
+        size = int(params.get("size", 10))
+        sort_by = params.get("sort_by") or "_count"
+        if sort_by == "doc_count":
+            sort_by = "_count"
+        if sort_by != "_count" and sort_by not in metrics:
+            return {"error": f"sort_by must be doc_count or a metric name {names}"}
+        if sort_by != "_count" and "stats" in metrics[sort_by]:
+            # Agrégation multi-valeurs : ES exige un chemin name.avg, on demande une métrique simple
+            return {"error": f"sort_by cannot be a stats metric ('{sort_by}'); use sum/avg/min/max"}
+        terms = {"field": field, "size": size, "shard_size": max(size * 5, 100),
+                 "order": {sort_by: params.get("order", "desc")}}
+        agg: Dict[str, Any] = {"terms": terms}
+        if metrics:
+            agg["aggs"] = metrics
+        res = self._search(index, {"size": 0, "query": self._build_query(params), "aggs": {"top": agg}})
+        buckets = res.get("aggregations", {}).get("top", {}).get("buckets", []) or []
+        labels = self._resolve_labels(field, [b.get("key") for b in buckets]) if params.get("resolve_labels", True) else {}
+        out = []
+        for b in buckets:
+            row = {"key": b.get("key"), "doc_count": b.get("doc_count"), "metrics": self._metric_values(b, names)}
+            if labels:
+                row["label"] = labels.get(b.get("key"))
+            out.append(row)
+        return {"summary": f"Top {len(out)} {field} dans {index}.", "buckets": out}
+
+    def histogram(self, index: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        field = params.get("field")
+        if not field:
+            return {"error": "histogram needs field (+ interval ou calendar_interval)"}
+        metrics = self._build_metrics(params)
+        names = list(metrics.keys())
+        if params.get("calendar_interval"):
+            hist = {"date_histogram": {"field": field, "calendar_interval": params["calendar_interval"],
+                                       "min_doc_count": 1}}
+        else:
+            hist = {"histogram": {"field": field, "interval": float(params.get("interval", 1)),
+                                  "min_doc_count": 1}}
+        if metrics:
+            hist["aggs"] = metrics
+        res = self._search(index, {"size": 0, "query": self._build_query(params), "aggs": {"hist": hist}})
+        buckets = res.get("aggregations", {}).get("hist", {}).get("buckets", []) or []
+        out = [{"key": b.get("key_as_string", b.get("key")), "doc_count": b.get("doc_count"),
+                "metrics": self._metric_values(b, names)} for b in buckets]
+        return {"summary": f"{len(out)} intervalles sur {field} dans {index}.", "buckets": out}
+
+    def stats(self, index: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        metrics = self._build_metrics(params)
+        if not metrics:
+            return {"error": "stats needs metrics=[{op, field}]"}
+        res = self._search(index, {"size": 0, "track_total_hits": True,
+                                   "query": self._build_query(params), "aggs": metrics})
+        total = res.get("hits", {}).get("total")
+        total_val = total.get("value", 0) if isinstance(total, dict) else 0
+        return {"summary": f"{total_val} documents agrégés dans {index}.",
+                "metrics": self._metric_values(res.get("aggregations", {}), list(metrics.keys()))}
+
+    def run(self, task: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if task not in self.SUPPORTED:
+            return {"error": f"unsupported task '{task}'", "supported": sorted(self.SUPPORTED)}
+        params = params or {}
+        index = params.get("index") or "investment"
+        try:
+            return getattr(self, task)(index, params)
+        except ValueError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            # Champ / métrique refusés par ES : l'erreur remonte au LLM pour qu'il corrige sa demande
+            return {"error": f"{task} failed: {getattr(e, 'detail', e)}"}
@@ -1,5 +1,6 @@
 from typing import Any, Dict
 from ..core.base_agent import BaseAgent
+from ..core.filters import filter_query, investment_filters
 
 
 class ForagingAgent(BaseAgent):
@@ -34,19 +35,7 @@ class ForagingAgent(BaseAgent):
         return {"match_all": {}}
 
     def _build_investment_query(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        q: Dict[str, Any] = {"bool": {"filter": []}}
-        if "min_amount" in params:
-            q["bool"]["filter"].append({"range": {"raised_amount": {"gte": float(params["min_amount"])}}})
-        if "currency_code" in params:
-            q["bool"]["filter"].append({"term": {"raised_currency_code": str(params["currency_code"])}})
-        if "year_min" in params or "year_max" in params:
-            yr: Dict[str, Any] = {}
-            if "year_min" in params: yr["gte"] = int(params["year_min"])
-            if "year_max" in params: yr["lte"] = int(params["year_max"])
-            q["bool"]["filter"].append({"range": {"funded_year": yr}})
-        if not q["bool"]["filter"]:
-            return {"match_all": {}}
-        return q
+        return filter_query(investment_filters(params))
 
     def run(self, task: str, params: Dict[str, Any]) -> Dict[str, Any]:
         if task not in self.SUPPORTED:
@@ -1,11 +1,58 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
 from ..core.base_agent import BaseAgent
+from ..core.anomaly import PATTERN_KINDS, InvestmentFrame, attach_labels, scan_investments
+from ..core.filters import investment_query
+
+
+def _name(label: Any, ident: Any) -> str:
+    return str(label or ident)
+
 
 class HypothesisAgent(BaseAgent):
     """
     Hypothesis Agent: Generate Alternatives (Step 11-13).
-    Responsible for generating potential explanations or scenarios.
+    Transforme les motifs détectés sur les investissements (tours aberrants, rafales d'activité,
+    co-investissements récurrents, participations croisées) en hypothèses classées à vérifier.
     """
+    SUPPORTED = {"generate_hypotheses"}
+    MAX_DOCS = 50_000
+
+    @staticmethod
+    def _statement(x: Dict[str, Any]) -> Dict[str, Any]:
+        kind = x["kind"]
+        if kind == "outlier_round":
+            text = (f"Tour de {x['raised_amount']:,.0f} {x['currency']} (médiane {x['currency_median']:,.0f}) : "
+                    "méga-tour réel, erreur d'unité/devise, ou montant agrégé ?")
+        elif kind == "company_burst":
+            text = (f"{_name(x.get('company_label'), x['company_id'])} : {x['count']} tours en {x['window_days']} jours "
+                    f"à partir du {x['window_start']} : tours échelonnés, doublons de saisie ou restructuration ?")
+        elif kind == "investor_burst":
+            text = (f"{_name(x.get('investor_label'), x['investor_id'])} : {x['count']} investissements en "
+                    f"{x['window_days']} jours à partir du {x['window_start']} : nouveau fonds, changement de stratégie ?")
+        elif kind == "shared_investors":
+            a, b = (_name(l, i) for l, i in zip(x.get("investor_labels") or [None, None], x["investor_ids"]))
+            text = (f"{a} et {b} co-investissent dans {x['shared_companies']} entreprises : "
+                    "syndicat récurrent, entités liées ou doublon d'investisseur ?")
+        else:
+            a, b = (_name(l, i) for l, i in zip(x.get("entity_labels") or [None, None], x["entity_ids"]))
+            text = f"{a} et {b} investissent l'un dans l'autre : participations croisées ou alias d'une même entité ?"
+        return {"hypothesis": text, **x}
+
     def run(self, task: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        # Logic to generate hypotheses
-        return {"status": "Hypotheses generated", "hypotheses": []}
+        if task not in self.SUPPORTED:
+            return {"error": f"unsupported task '{task}'", "supported": sorted(self.SUPPORTED)}
+        params = params or {}
+        size = int(params.get("size", 10))
+        limit = min(int(params.get("limit", self.MAX_DOCS)), self.MAX_DOCS)
+        kinds = set(params.get("kinds") or PATTERN_KINDS) & PATTERN_KINDS
+        try:
+            frame = InvestmentFrame.load(self.es_post, investment_query(params), limit)
+            findings = scan_investments(frame, params, kinds)
+        except (ValueError, TypeError) as e:
+            return {"error": str(e)}
+        hypotheses: List[Dict[str, Any]] = [self._statement(x) for x in attach_labels(self.es_post, findings[:size])]
+        out = {"summary": f"{len(findings)} motifs sur {frame.n} investissements, {len(hypotheses)} hypothèses retenues.",
+               "scanned": frame.n, "hypotheses": hypotheses}
+        if frame.truncated:
+            out["note"] = f"analyse limitée aux {frame.n} premiers investissements (limit)"
+        return out
@@ -1,13 +1,16 @@
 from typing import Any, Dict, List
 from ..core.base_agent import BaseAgent
+from ..core.join_planner import join_planner
 
 
 class RelationsAgent(BaseAgent):
     """
     Relations Agent: Search Relations (Step 6).
-    Implémente un join générique via Siren Federate + fallback simple.
+    Implémente un join générique (Federate ou lookup deux phases, choisi par le JoinPlanner) + fallback simple.
     """
     SUPPORTED = {"join"}
+    TERMS_MAX_CHILDREN = 1000
+    TERMS_MAX_KEYS = 1000
 
     def _fallback(self, parent_index: str, es_query: Dict[str, Any], size: int) -> Dict[str, Any]:
         # Lookup direct sans join, utile pour donner un minimum de signal.
@@ -37,23 +40,58 @@ class RelationsAgent(BaseAgent):
         if es_query:
             join["request"] = {"query": es_query}
 
-        try:
+        def via_federate():
             res = self.es_post(f"/siren/{parent_index}/_search",
                                json={"size": size, "query": {"join": join}})
-        except Exception as e:
-            return {"error": f"join failed: {e}"}
-
-        hits = res.get("hits", {}).get("hits", []) or []
-        total = res.get("hits", {}).get("total")
-        total_val = total.get("value", 0) if isinstance(total, dict) else 0
-
-        if total_val > 0:
+            hits = res.get("hits", {}).get("hits", []) or []
+            total = res.get("hits", {}).get("total")
+            total_val = total.get("value", 0) if isinstance(total, dict) else 0
             return {
                 "summary": f"{total_val} résultats (top {len(hits)}) via join {parent_index}<-{child_index} on {on}.",
                 "items": [h.get("_source", {}) for h in hits],
-            }
+            }, total_val
+
+        def via_terms():
+            # Lookup deux phases borné : clés child_key des TERMS_MAX_CHILDREN premiers enfants, puis terms
+            # sur parent_key. Tronqué au-delà des bornes : fallback seulement, total signalé comme minimum.
+            child_key, parent_key = on
+            res = self.es_post(f"/{child_index}/_search",
+                               json={"size": self.TERMS_MAX_CHILDREN, "_source": [child_key], "query": es_query})
+            child_hits = res.get("hits", {}).get("hits", []) or []
+            keys: List[Any] = []
+            for h in child_hits:
+                v = h.get("_source", {}).get(child_key)
+                keys.extend(v if isinstance(v, list) else [v] if v is not None else [])
+            keys = list(dict.fromkeys(keys))
+            truncated = len(child_hits) >= self.TERMS_MAX_CHILDREN or len(keys) > self.TERMS_MAX_KEYS
+            keys = keys[:self.TERMS_MAX_KEYS]
+            if not keys:
+                return {"summary": f"0 résultats via lookup {child_index} -> {parent_index}.", "items": []}, 0
+            res = self.es_post(f"/{parent_index}/_search",
+                               json={"size": size, "query": {"terms": {parent_key: keys}}})
+            hits = res.get("hits", {}).get("hits", []) or []
+            total = res.get("hits", {}).get("total")
+            total_val = total.get("value", 0) if isinstance(total, dict) else 0
+            count = f"au moins {total_val}" if truncated else f"{total_val}"
+            return {
+                "summary": f"{count} résultats (top {len(hits)}) via lookup {child_index} -> {parent_index} on {on}"
+                           + (f" (lookup borné à {self.TERMS_MAX_CHILDREN} enfants)." if truncated else "."),
+                "items": [h.get("_source", {}) for h in hits], "truncated": truncated,
+            }, total_val
+
+        try:
+            plan = join_planner.execute(join_planner.key(parent_index, child_index, on, es_query),
+                                        [("federate", via_federate)], fallbacks=[("terms", via_terms)])
+        except Exception as e:
+            return {"error": f"join failed: {e}"}
+
+        if plan["result"] and plan["result"].get("items"):
+            out = plan["result"]
+            out["strategy"] = plan["strategy"]
+            return out
 
         # Fallback si join vide
         fb = self._fallback(parent_index, es_query, size)
         fb["note"] = "join returned 0 results"
+        fb["strategy"] = "lookup"
         return fb
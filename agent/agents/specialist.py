@@ -6,6 +6,13 @@ from typing import Any, Dict, List, Set
 from dateutil import parser as dateparser
 
 from ..core.base_agent import BaseAgent
+from ..core.cache import cached_labels
+from ..core.filters import filter_query, investment_filters
+from ..core.join_planner import join_planner
+from ..core.profiling import span
+from ..core.summaries import COMPANY_SUMMARY_INDEX, INVESTOR_SUMMARY_INDEX
+from ..core.similarity import company_tokens, get_index
+from .aggregate import AggregateAgent
 
 class SpecialistAgent(BaseAgent):
     # Ce que sait faire l’agent aujourd’hui (lisible côté LLM/outil)
@@ -19,8 +26,17 @@ class SpecialistAgent(BaseAgent):
         "common_investors_between_companies": "Investisseurs communs entre 2 entreprises.",
         "co_invested_companies_for_company": "Entreprises partageant au moins 1 investisseur avec une cible.",
         "geo_near_companies": "Entreprises proches d’un point (km).",
-        "temporal_overlap_for_companies": "Investissements proches dans le temps entre 2 entreprises."
+        "temporal_overlap_for_companies": "Investissements proches dans le temps entre 2 entreprises.",
+        # lectures sur les résumés matérialisés (fallback agrégation ES)
+        "top_companies_by_raised": "Entreprises ayant levé le plus (devise, période optionnelle).",
+        "most_active_investors": "Investisseurs les plus actifs (nombre de tours).",
+        "similar_companies": "Entreprises similaires à une cible (index local label/ville/catégorie/investisseurs).",
+        # variantes batch (company_ids / company_labels) : coût proportionnel aux données, pas au nb d'entités
+        "company_investors_batch": "Investisseurs de plusieurs entreprises en une passe.",
+        "top_investments_for_companies": "Investissements de plusieurs entreprises en une passe.",
+        "common_investors_across_companies": "Investisseurs communs pour toutes les paires d'un ensemble d'entreprises."
     }
+    COMPOSITE_PAGE = 1000  # buckets par page des agrégations composite (pagination after_key)
 
     def __init__(self, es_get_func, es_post_func):
         super().__init__(es_get_func, es_post_func)
@@ -29,38 +45,113 @@ class SpecialistAgent(BaseAgent):
     def _find_company_id_by_label(self, label: str) -> str | None:
         # Essai exact sur label.raw, puis fallback sur label
         q = {"term": {"label.raw": label}}
-        res = self.es_post("/company/_search", json={"size": 1, "query": q})
+        res = self.es_post("/company/_search", json={"size": 1, "_source": ["id"], "query": q})
         hits = res.get("hits", {}).get("hits", [])
         if not hits:
             q = {"term": {"label": label}}
-            res = self.es_post("/company/_search", json={"size": 1, "query": q})
+            res = self.es_post("/company/_search", json={"size": 1, "_source": ["id"], "query": q})
             hits = res.get("hits", {}).get("hits", [])
             if not hits:
                 return None
         return hits[0].get("_source", {}).get("id")
 
+    def _find_company_ids_by_labels(self, labels: List[str]) -> Dict[str, str]:
+        # Résolution groupée label -> id en une requête : label.raw exact, sinon phrase sur le label analysé
+        # (multi-mots, casse ignorée) ; les requêtes nommées disent quel label a ramené quel document
+        labels = [l for l in dict.fromkeys(labels) if l]
+        if not labels:
+            return {}
+        should: List[Dict[str, Any]] = [{"terms": {"label.raw": labels}}]
+        should += [{"match_phrase": {"label": {"query": l, "_name": f"l{i}"}}} for i, l in enumerate(labels)]
+        res = self.es_post("/company/_search", json={"size": 10 * len(labels), "_source": ["id", "label"],
+                                                      "query": {"bool": {"should": should}}})
+        by_label: Dict[str, str] = {}
+        by_fold: Dict[str, str] = {}
+        by_phrase: Dict[str, str] = {}
+        for h in res.get("hits", {}).get("hits", []) or []:
+            src = h.get("_source", {})
+            if not (src.get("label") and src.get("id")):
+                continue
+            by_label.setdefault(src["label"], src["id"])
+            by_fold.setdefault(src["label"].casefold(), src["id"])
+            # Hits triés par score : le premier document d'une phrase est le meilleur candidat
+            for name in h.get("matched_queries") or []:
+                by_phrase.setdefault(name, src["id"])
+        out = {}
+        for i, l in enumerate(labels):
+            cid = by_label.get(l) or by_fold.get(l.casefold()) or by_phrase.get(f"l{i}")
+            if cid:
+                out[l] = cid
+        return out
+
+    def _company_ids_from_params(self, params: Dict[str, Any]) -> tuple[List[str], List[str]]:
+        # -> (ids résolus, labels introuvables)
+        ids = list(params.get("company_ids") or [])
+        labels = list(params.get("company_labels") or [])
+        found = self._find_company_ids_by_labels(labels)
+        ids.extend(found[l] for l in labels if l in found)
+        return list(dict.fromkeys(ids)), [l for l in labels if l not in found]
+
+    def _investor_sets(self, company_ids: List[str]) -> Dict[str, Dict[str, int]]:
+        # Composite companies x investors paginé via after_key : ensembles complets (pas de plafond par
+        # entreprise), avec le nombre de tours communs ; les autres entreprises des mêmes tours sont ignorées
+        composite: Dict[str, Any] = {"size": self.COMPOSITE_PAGE,
+                                     "sources": [{"company": {"terms": {"field": "companies"}}},
+                                                 {"investor": {"terms": {"field": "investors"}}}]}
+        body = {"size": 0, "query": {"terms": {"companies": company_ids}}, "aggs": {"pairs": {"composite": composite}}}
+        out: Dict[str, Dict[str, int]] = {cid: {} for cid in company_ids}
+        while True:
+            res = self.es_post("/investment/_search", json=body)
+            pairs = res.get("aggregations", {}).get("pairs", {})
+            for b in pairs.get("buckets", []) or []:
+                key = b.get("key", {})
+                if key.get("company") in out:
+                    out[key["company"]][key.get("investor")] = b.get("doc_count", 0)
+            after = pairs.get("after_key")
+            if not after or not pairs.get("buckets"):
+                return out
+            composite["after"] = after
+
     def _investors_for_company_id(self, company_id: str, size: int = 200) -> Set[str]:
         # recup des investissements de la company
         q = {"terms": {"companies": [company_id]}}
-        res = self.es_post("/investment/_search", json={"size": size, "query": q})
+        res = self.es_post("/investment/_search", json={"size": size, "_source": ["investors"], "query": q})
         inv_ids: Set[str] = set()
         for h in res.get("hits", {}).get("hits", []) or []:
             inv_ids.update(h.get("_source", {}).get("investors", []) or [])
         return inv_ids
 
     def _fetch_company_labels(self, ids: list[str]) -> dict:
+        return cached_labels(self.es_post, "company", ids)
+
+    def _fetch_company_docs(self, ids: list[str]) -> dict:
         if not ids:
             return {}
         res = self.es_post("/company/_search", json={"size": len(ids), "query": {"terms": {"id": ids}}})
-        return {h.get("_source", {}).get("id"): h.get("_source", {}).get("label")
+        return {h.get("_source", {}).get("id"): h.get("_source", {})
                 for h in res.get("hits", {}).get("hits", []) or []}
 
     def _fetch_investor_labels(self, ids: list[str]) -> dict:
-        if not ids:
-            return {}
-        res = self.es_post("/investor/_search", json={"size": len(ids), "query": {"terms": {"id": ids}}})
-        return {h.get("_source", {}).get("id"): h.get("_source", {}).get("label")
-                for h in res.get("hits", {}).get("hits", []) or []}
+        return cached_labels(self.es_post, "investor", ids)
+
+    def _summary_doc(self, index: str, entity_id: str) -> Dict[str, Any] | None:
+        # Résumé matérialisé (_id = id de l'entité) ; None si l'index n'existe pas encore
+        try:
+            res = self.es_post(f"/{index}/_search?ignore_unavailable=true",
+                               json={"size": 1, "query": {"ids": {"values": [entity_id]}}})
+        except Exception:
+            return None
+        hits = res.get("hits", {}).get("hits", []) or []
+        return hits[0].get("_source") if hits else None
+
+    def _top_summaries(self, index: str, sort_field: str, size: int) -> List[Dict[str, Any]]:
+        try:
+            res = self.es_post(f"/{index}/_search?ignore_unavailable=true",
+                               json={"size": size, "sort": [{sort_field: {"order": "desc", "unmapped_type": "double"}}],
+                                     "query": {"exists": {"field": sort_field}}})
+        except Exception:
+            return []
+        return [h.get("_source", {}) for h in res.get("hits", {}).get("hits", []) or []]
 
     # tasks
     def company_investors(self, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -75,74 +166,100 @@ class SpecialistAgent(BaseAgent):
                 return {"error": f"Company '{label}' not found."}
 
         es_query = {"terms": {"companies": [company_id]}}
-        join = {"indices": ["investment"], "on": ["investors", "id"], "request": {"query": es_query}}
-        res = self.es_post("/siren/investor/_search", json={"size": size, "query": {"join": join}})
-
-        out = []
-        for h in res.get("hits", {}).get("hits", []) or []:
-            s = h.get("_source", {})
-            out.append({"investor_label": s.get("label"), "investor_id": s.get("id")})
 
-        total = res.get("hits", {}).get("total")
-        total_val = total.get("value", 0) if isinstance(total, dict) else 0
-        if total_val > 0:
+        def via_summary():
+            # Index local : résumé matérialisé de l'entreprise
+            summary = self._summary_doc(COMPANY_SUMMARY_INDEX, company_id)
+            if not (summary and summary.get("investors")):
+                return None, 0
+            inv_ids = summary["investors"][:size]
+            labels = self._fetch_investor_labels(inv_ids)
+            out = [{"investor_label": labels.get(iid), "investor_id": iid} for iid in inv_ids]
+            n = summary.get("investor_count", len(summary["investors"]))
+            return {"summary": f"{n} investisseurs pour {company_id} (top {len(out)}, résumé matérialisé).",
+                    "company_id": company_id, "investors": out}, n
+
+        def via_federate():
+            join = {"indices": ["investment"], "on": ["investors", "id"], "request": {"query": es_query}}
+            res = self.es_post("/siren/investor/_search",
+                               json={"size": size, "_source": ["id", "label"], "query": {"join": join}})
+            out = [{"investor_label": h.get("_source", {}).get("label"), "investor_id": h.get("_source", {}).get("id")}
+                   for h in res.get("hits", {}).get("hits", []) or []]
+            total = res.get("hits", {}).get("total")
+            total_val = total.get("value", 0) if isinstance(total, dict) else 0
             return {"summary": f"{total_val} investisseurs pour {company_id} (top {len(out)}).",
-                    "company_id": company_id, "investors": out}
-
-        # Fallback si la jointure Federate ne ramène rien : lookup investissements puis investisseurs
-        inv_res = self.es_post("/investment/_search", json={"size": 300, "query": es_query})
-        inv_hits = inv_res.get("hits", {}).get("hits", []) or []
-        inv_ids = []
-        for h in inv_hits:
-            inv_ids.extend(h.get("_source", {}).get("investors", []) or [])
-        inv_ids = list(dict.fromkeys(inv_ids))[:200]
-        labels = self._fetch_investor_labels(inv_ids)
-        out_fb = [{"investor_id": iid, "investor_label": labels.get(iid)} for iid in inv_ids]
-        return {"summary": f"0 via join; fallback sur {len(out_fb)} investisseurs extraits des investissements.",
-                "company_id": company_id, "investors": out_fb}
+                    "company_id": company_id, "investors": out}, total_val
+
+        def via_terms():
+            # Lookup deux phases borné (300 investissements, 200 investisseurs) : fallback seulement
+            inv_res = self.es_post("/investment/_search", json={"size": 300, "_source": ["investors"], "query": es_query})
+            inv_hits = inv_res.get("hits", {}).get("hits", []) or []
+            inv_ids = []
+            for h in inv_hits:
+                inv_ids.extend(h.get("_source", {}).get("investors", []) or [])
+            inv_ids = list(dict.fromkeys(inv_ids))
+            truncated = len(inv_hits) >= 300 or len(inv_ids) > 200
+            inv_ids = inv_ids[:200]
+            labels = self._fetch_investor_labels(inv_ids)
+            out = [{"investor_id": iid, "investor_label": labels.get(iid)} for iid in inv_ids]
+            count = f"au moins {len(out)}" if truncated else f"{len(out)}"
+            return {"summary": f"{count} investisseurs extraits des investissements de {company_id}.",
+                    "company_id": company_id, "investors": out, "truncated": truncated}, len(out)
+
+        strategies = [("federate", via_federate)]
+        if params.get("use_summaries", True):
+            strategies.insert(0, ("summary", via_summary))
+        plan = join_planner.execute(join_planner.key("investor", "investment", ["investors", "id"], es_query),
+                                    strategies, fallbacks=[("terms", via_terms)])
+        res = plan["result"] or {"summary": f"Aucun investisseur pour {company_id}.",
+                                 "company_id": company_id, "investors": []}
+        res["strategy"] = plan["strategy"]
+        return res
 
     def investments_by_amount(self, params: Dict[str, Any]) -> Dict[str, Any]:
         size = int(params.get("size", 10))
-        q = {"bool": {"filter": []}}
-        if "min_amount" in params:
-            q["bool"]["filter"].append({"range": {"raised_amount": {"gte": float(params["min_amount"])}}})
-        if "currency_code" in params:
-            q["bool"]["filter"].append({"term": {"raised_currency_code": str(params["currency_code"])}})
-        yr = {}
-        if "year_min" in params: yr["gte"] = int(params["year_min"])
-        if "year_max" in params: yr["lte"] = int(params["year_max"])
-        if yr:
-            q["bool"]["filter"].append({"range": {"funded_year": yr}})
+        q = filter_query(investment_filters(params))
 
         inv = self.es_post("/investment/_search", json={"size": size, "query": q})
         hits = inv.get("hits", {}).get("hits", []) or []
 
+        total = inv.get("hits", {}).get("total")
+        inv_total = total.get("value", 0) if isinstance(total, dict) else len(hits)
         if params.get("join_company", True):
-            join = {"indices": ["investment"], "on": ["companies", "id"], "request": {"query": q}}
-            res = self.es_post("/siren/company/_search", json={"size": size, "query": {"join": join}})
-            chits = res.get("hits", {}).get("hits", []) or []
-            companies = [{"company_label": c.get("_source", {}).get("label"),
-                          "company_id": c.get("_source", {}).get("id")} for c in chits]
-            total = res.get("hits", {}).get("total")
-            total_val = total.get("value", 0) if isinstance(total, dict) else 0
-            if total_val > 0:
+            samples = [x.get("_source", {}) for x in hits[:min(3, len(hits))]]
+
+            def via_federate():
+                join = {"indices": ["investment"], "on": ["companies", "id"], "request": {"query": q}}
+                res = self.es_post("/siren/company/_search",
+                                   json={"size": size, "_source": ["id", "label"], "query": {"join": join}})
+                chits = res.get("hits", {}).get("hits", []) or []
+                companies = [{"company_label": c.get("_source", {}).get("label"),
+                              "company_id": c.get("_source", {}).get("id")} for c in chits]
+                total = res.get("hits", {}).get("total")
+                total_val = total.get("value", 0) if isinstance(total, dict) else 0
                 return {"summary": f"{total_val} entreprises liées (top {len(companies)}).",
-                        "filters": params, "companies": companies,
-                        "sample_investments": [x.get("_source", {}) for x in hits[:min(3, len(hits))]]}
-            # Fallback si jointure vide : enrichir via lookup direct sur company
-            comp_ids: list[str] = []
-            for h in hits:
-                comp_ids.extend(h.get("_source", {}).get("companies", []) or [])
-            comp_ids = list(dict.fromkeys(comp_ids))[:size]
-            labels = self._fetch_company_labels(comp_ids)
-            companies_fb = [{"company_label": labels.get(cid), "company_id": cid} for cid in comp_ids]
-            return {"summary": f"0 via join; fallback sur {len(companies_fb)} entreprises issues des investissements.",
-                    "filters": params, "companies": companies_fb,
-                    "sample_investments": [x.get("_source", {}) for x in hits[:min(3, len(hits))]]}
+                        "filters": params, "companies": companies, "sample_investments": samples}, total_val
+
+            def via_terms():
+                # Entreprises des seuls `size` investissements déjà récupérés : sous-ensemble, fallback seulement
+                comp_ids: list[str] = []
+                for h in hits:
+                    comp_ids.extend(h.get("_source", {}).get("companies", []) or [])
+                comp_ids = list(dict.fromkeys(comp_ids))[:size]
+                labels = self._fetch_company_labels(comp_ids)
+                companies = [{"company_label": labels.get(cid), "company_id": cid} for cid in comp_ids]
+                return {"summary": f"{len(companies)} entreprises issues des {len(hits)} premiers investissements "
+                                   f"(sur {inv_total}).",
+                        "filters": params, "companies": companies, "sample_investments": samples,
+                        "truncated": len(hits) < inv_total}, len(companies)
+
+            plan = join_planner.execute(join_planner.key("company", "investment", ["companies", "id"], q),
+                                        [("federate", via_federate)], fallbacks=[("terms", via_terms)])
+            res = plan["result"]
+            res["strategy"] = plan["strategy"]
+            return res
         else:
-            total = inv.get("hits", {}).get("total")
-            total_val = total.get("value", 0) if isinstance(total, dict) else 0
-            return {"summary": f"{total_val} investissements (top {len(hits)}).",
+            return {"summary": f"{inv_total} investissements (top {len(hits)}).",
                     "filters": params, "investments": [x.get("_source", {}) for x in hits]}
 
     def top_investments_for_company(self, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -157,7 +274,8 @@ class SpecialistAgent(BaseAgent):
                 return {"error": f"Company '{label}' not found."}
 
         q = {"terms": {"companies": [company_id]}}
-        inv = self.es_post("/investment/_search", json={"size": size, "query": q})
+        inv = self.es_post("/investment/_search", json={"size": size, "query": q, "_source": [
+            "label", "funded_year", "raised_amount", "raised_currency_code"]})
         hits = inv.get("hits", {}).get("hits", []) or []
         out = []
         for h in hits:
@@ -197,9 +315,8 @@ class SpecialistAgent(BaseAgent):
             return {"summary": f"Aucun investisseur commun entre {a} et {b}.", "common_investors": []}
 
         # Résoudre les labels d’investors
-        res = self.es_post("/investor/_search", json={"size": len(common), "query": {"terms": {"id": common}}})
-        out = [{"investor_id": h.get("_source", {}).get("id"),
-                "investor_label": h.get("_source", {}).get("label")} for h in res.get("hits", {}).get("hits", [])]
+        labels = self._fetch_investor_labels(common)
+        out = [{"investor_id": iid, "investor_label": labels[iid]} for iid in common if iid in labels]
         return {"summary": f"{len(common)} investisseurs communs.", "company_a": a, "company_b": b, "common_investors": out}
 
     def co_invested_companies_for_company(self, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -220,7 +337,7 @@ class SpecialistAgent(BaseAgent):
 
         # Investissements où investors ∈ inv_ids → récupérer les companies
         q = {"terms": {"investors": inv_ids}}
-        res = self.es_post("/investment/_search", json={"size": 500, "query": q})
+        res = self.es_post("/investment/_search", json={"size": 500, "_source": ["companies"], "query": q})
         freq: Dict[str, int] = {}
         for h in res.get("hits", {}).get("hits", []) or []:
             for c in h.get("_source", {}).get("companies", []) or []:
@@ -233,9 +350,7 @@ class SpecialistAgent(BaseAgent):
             return {"summary": "Aucune entreprise co-investie trouvée.", "companies": []}
 
         ids = [c for c, _ in ranked]
-        res2 = self.es_post("/company/_search", json={"size": len(ids), "query": {"terms": {"id": ids}}})
-        labels = {h.get("_source", {}).get("id"): h.get("_source", {}).get("label")
-                  for h in res2.get("hits", {}).get("hits", [])}
+        labels = self._fetch_company_labels(ids)
         out = [{"company_id": cid, "company_label": labels.get(cid), "co_invest_count": count} for cid, count in ranked]
         return {"summary": f"{len(out)} co-investies avec {company_id}.", "companies": out}
 
@@ -249,7 +364,8 @@ class SpecialistAgent(BaseAgent):
         size = int(params.get("size", 10))
 
         q = {"bool": {"filter": [{"geo_distance": {"distance": f"{dist}km", "location": {"lat": lat, "lon": lon}}}]}}
-        res = self.es_post("/company/_search", json={"size": size, "query": q})
+        res = self.es_post("/company/_search",
+                           json={"size": size, "_source": ["id", "label", "city", "countrycode"], "query": q})
         out = [{"company_id": h.get("_source", {}).get("id"),
                 "company_label": h.get("_source", {}).get("label"),
                 "city": h.get("_source", {}).get("city"),
@@ -271,7 +387,7 @@ class SpecialistAgent(BaseAgent):
 
         def fetch_dates(cid: str) -> List[str]:
             q = {"terms": {"companies": [cid]}}
-            res = self.es_post("/investment/_search", json={"size": 200, "query": q})
+            res = self.es_post("/investment/_search", json={"size": 200, "_source": ["funded_date"], "query": q})
             out = []
             for h in res.get("hits", {}).get("hits", []) or []:
                 fd = h.get("_source", {}).get("funded_date")
@@ -288,8 +404,160 @@ class SpecialistAgent(BaseAgent):
         return {"summary": f"{len(matches)} paires d’événements dans ±{window} jours.",
                 "company_a": a, "company_b": b, "pairs": matches[:50]}
     
+    def top_companies_by_raised(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        size = int(params.get("size", 10))
+        currency = str(params.get("currency_code", "USD"))
+        # Les résumés sont tous-temps et par devise : fenêtre de dates ou montant minimum imposent l'agrégation
+        if params.get("use_summaries", True) and not any(k in params for k in ("year_min", "year_max", "min_amount")):
+            docs = self._top_summaries(COMPANY_SUMMARY_INDEX, f"total_raised.{currency}", size)
+            if docs:
+                out = [{"company_id": d.get("id"), "company_label": d.get("label"),
+                        "total_raised": (d.get("total_raised") or {}).get(currency),
+                        "deal_count": d.get("deal_count")} for d in docs]
+                return {"summary": f"Top {len(out)} entreprises par montant levé en {currency} (résumé matérialisé).",
+                        "currency_code": currency, "companies": out}
+        agg_params = {k: params[k] for k in ("year_min", "year_max", "min_amount") if k in params}
+        res = AggregateAgent(self.es_get, self.es_post).run("top_terms", {
+            **agg_params, "index": "investment", "field": "companies", "currency_code": currency, "size": size,
+            "metrics": [{"op": "sum", "field": "raised_amount", "name": "total_raised"}], "sort_by": "total_raised"})
+        if "error" in res:
+            return res
+        out = [{"company_id": b.get("key"), "company_label": b.get("label"),
+                "total_raised": b.get("metrics", {}).get("total_raised"), "deal_count": b.get("doc_count")}
+               for b in res.get("buckets", [])]
+        return {"summary": f"Top {len(out)} entreprises par montant levé en {currency} (agrégation).",
+                "currency_code": currency, "filters": params, "companies": out}
+
+    def most_active_investors(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        size = int(params.get("size", 10))
+        # deal_count des résumés compte tous les tours : tout filtre impose l'agrégation
+        filtered = any(k in params for k in ("year_min", "year_max", "currency_code", "min_amount"))
+        if params.get("use_summaries", True) and not filtered:
+            docs = self._top_summaries(INVESTOR_SUMMARY_INDEX, "deal_count", size)
+            if docs:
+                out = [{"investor_id": d.get("id"), "investor_label": d.get("label"),
+                        "deal_count": d.get("deal_count"), "company_count": d.get("company_count"),
+                        "first_funded_date": d.get("first_funded_date"),
+                        "last_funded_date": d.get("last_funded_date")} for d in docs]
+                return {"summary": f"Top {len(out)} investisseurs par nombre de tours (résumé matérialisé).",
+                        "investors": out}
+        agg_params = {k: params[k] for k in ("year_min", "year_max", "currency_code", "min_amount") if k in params}
+        res = AggregateAgent(self.es_get, self.es_post).run("top_terms", {
+            **agg_params, "index": "investment", "field": "investors", "size": size})
+        if "error" in res:
+            return res
+        out = [{"investor_id": b.get("key"), "investor_label": b.get("label"), "deal_count": b.get("doc_count")}
+               for b in res.get("buckets", [])]
+        return {"summary": f"Top {len(out)} investisseurs par nombre de tours (agrégation).",
+                "filters": params, "investors": out}
+
+    def similar_companies(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        # Entrée: company_id / company_label (entreprise indexée) ou attributs libres (label, city, category_code, investors)
+        k = int(params.get("k", params.get("size", 10)))
+        index = get_index()
+        if index is None:
+            return {"error": "similarity index not built (POST /graph/similarity/build)"}
+
+        company_id = params.get("company_id")
+        if not company_id and params.get("company_label"):
+            company_id = self._find_company_id_by_label(params["company_label"])
+            if not company_id:
+                return {"error": f"Company '{params['company_label']}' not found."}
+
+        row = index.row_of.get(company_id) if company_id else None
+        if row is not None:
+            query = index.vectors[row]
+        elif company_id:
+            src = self._fetch_company_docs([company_id]).get(company_id, {})
+            query = index.embed(company_tokens(src, self._investors_for_company_id(company_id)))
+        elif any(params.get(f) for f in ("label", "city", "category_code", "investors")):
+            query = index.embed(company_tokens(params, params.get("investors") or []))
+        else:
+            return {"error": "similar_companies needs company_id, company_label or attributes"}
+
+        hits = index.search(query, k=k, n_probe=int(params.get("n_probe", 4)), exclude=[row])[0]
+        out = [{"company_id": index.ids[r], "company_label": index.labels[r], "score": round(sc, 4)}
+               for r, sc in hits]
+        target = company_id or params.get("label")
+        return {"summary": f"{len(out)} entreprises similaires à {target}.", "company_id": company_id,
+                "companies": out}
+
+    # tasks batch
+    def company_investors_batch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        size = int(params.get("size", 5))
+        ids, missing = self._company_ids_from_params(params)
+        if not ids:
+            return {"error": "company_investors_batch needs company_ids or company_labels", "not_found": missing}
+        sets = self._investor_sets(ids)
+        # Rang par nombre de tours avec l'entreprise (doc_count), puis id pour la stabilité
+        tops = {cid: sorted(invs.items(), key=lambda kv: (-kv[1], kv[0]))[:size] for cid, invs in sets.items()}
+        labels = self._fetch_investor_labels(sorted({i for t in tops.values() for i, _ in t}))
+        clabels = self._fetch_company_labels(ids)
+        out = [{"company_id": cid, "company_label": clabels.get(cid), "investor_count": len(sets[cid]),
+                "investors": [{"investor_id": i, "investor_label": labels.get(i), "deal_count": n}
+                              for i, n in tops[cid]]} for cid in ids]
+        return {"summary": f"Investisseurs de {len(ids)} entreprises "
+                           f"({len(set().union(*sets.values()))} distincts).",
+                "companies": out, "not_found": missing}
+
+    def top_investments_for_companies(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        size = int(params.get("size", 5))
+        ids, missing = self._company_ids_from_params(params)
+        if not ids:
+            return {"error": "top_investments_for_companies needs company_ids or company_labels", "not_found": missing}
+        fields = ["label", "funded_year", "funded_date", "raised_amount", "raised_currency_code"]
+        q = {"terms": {"companies": ids}}
+        aggs = {"by_company": {"terms": {"field": "companies", "include": ids, "size": len(ids)},
+                               "aggs": {"top": {"top_hits": {"size": size, "_source": fields,
+                                                             "sort": [{"raised_amount": {"order": "desc",
+                                                                                         "unmapped_type": "double"}}]}}}}}
+        res = self.es_post("/investment/_search", json={"size": 0, "query": q, "aggs": aggs})
+        by_company = {b.get("key"): b for b in res.get("aggregations", {}).get("by_company", {}).get("buckets", []) or []}
+        clabels = self._fetch_company_labels(ids)
+        out = []
+        for cid in ids:
+            b = by_company.get(cid, {})
+            hits = b.get("top", {}).get("hits", {}).get("hits", []) or []
+            out.append({"company_id": cid, "company_label": clabels.get(cid), "investment_count": b.get("doc_count", 0),
+                        "investments": [h.get("_source", {}) for h in hits]})
+        total = sum(c["investment_count"] for c in out)
+        return {"summary": f"{total} investissements pour {len(ids)} entreprises (top {size} chacune).",
+                "companies": out, "not_found": missing}
+
+    def common_investors_across_companies(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        # Toutes les paires via index inversé investisseur -> entreprises : coût ~ taille des ensembles
+        size = int(params.get("size", 20))
+        ids, missing = self._company_ids_from_params(params)
+        if len(ids) < 2:
+            return {"error": "needs at least 2 companies (company_ids / company_labels)", "not_found": missing}
+        sets = self._investor_sets(ids)
+        by_investor: Dict[str, List[str]] = {}
+        for cid in ids:
+            for iid in sets.get(cid, ()):
+                by_investor.setdefault(iid, []).append(cid)
+        pairs: Dict[tuple, List[str]] = {}
+        for iid, cids in by_investor.items():
+            for i in range(len(cids)):
+                for j in range(i + 1, len(cids)):
+                    pairs.setdefault((cids[i], cids[j]), []).append(iid)
+        ranked = sorted(pairs.items(), key=lambda kv: len(kv[1]), reverse=True)[:size]
+        shared = sorted(((iid, len(cids)) for iid, cids in by_investor.items() if len(cids) > 1),
+                        key=lambda kv: kv[1], reverse=True)[:size]
+        labels = self._fetch_investor_labels(sorted({i for _, invs in ranked for i in invs} | {i for i, _ in shared}))
+        clabels = self._fetch_company_labels(ids)
+        out = [{"company_a": a, "company_a_label": clabels.get(a), "company_b": b, "company_b_label": clabels.get(b),
+                "common_count": len(invs),
+                "common_investors": [{"investor_id": i, "investor_label": labels.get(i)} for i in sorted(invs)]}
+               for (a, b), invs in ranked]
+        return {"summary": f"{len(pairs)} paires avec investisseurs communs parmi {len(ids)} entreprises.",
+                "pairs": out,
+                "most_shared_investors": [{"investor_id": i, "investor_label": labels.get(i), "company_count": n}
+                                          for i, n in shared],
+                "not_found": missing}
+
     def run(self, task: str, params: Dict[str, Any]) -> Dict[str, Any]:
         if task not in self.SUPPORTED_TASKS:
             return {"error": f"unsupported task '{task}'",
                     "supported": list(self.SUPPORTED_TASKS.keys())}
-        return getattr(self, task)(params or {})
+        with span(f"specialist.{task}", params=params or {}):
+            return getattr(self, task)(params or {})
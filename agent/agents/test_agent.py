@@ -1,11 +1,36 @@
 from typing import Any, Dict
 from ..core.base_agent import BaseAgent
+from ..core.anomaly import COHERENCE_KINDS, PATTERN_KINDS, InvestmentFrame, attach_labels, scan_investments
+from ..core.filters import investment_query
+
 
 class TestAgent(BaseAgent):
     """
     Test Agent: Coherence and Diagnostics (Steps 9, 12, 15).
-    Responsible for checking consistency and diagnosing issues in the investigation.
+    Contrôles vectorisés (NumPy) sur un ensemble d'investissements chargé en colonnes :
+    seuls les constats classés remontent, jamais les documents.
     """
+    SUPPORTED = {"coherence_checks", "anomaly_scan"}
+    MAX_DOCS = 50_000
+
     def run(self, task: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        # Logic to test coherence
-        return {"status": "Tests passed", "issues_found": []}
+        if task not in self.SUPPORTED:
+            return {"error": f"unsupported task '{task}'", "supported": sorted(self.SUPPORTED)}
+        params = params or {}
+        size = int(params.get("size", 20))
+        limit = min(int(params.get("limit", self.MAX_DOCS)), self.MAX_DOCS)
+        kinds = COHERENCE_KINDS if task == "coherence_checks" else COHERENCE_KINDS | PATTERN_KINDS
+        try:
+            frame = InvestmentFrame.load(self.es_post, investment_query(params), limit)
+            findings = scan_investments(frame, params, kinds)
+        except (ValueError, TypeError) as e:
+            return {"error": str(e)}
+        counts: Dict[str, int] = {}
+        for x in findings:
+            counts[x["kind"]] = counts.get(x["kind"], 0) + 1
+        out = {"summary": f"{len(findings)} constats sur {frame.n} investissements (top {min(size, len(findings))}).",
+               "scanned": frame.n, "counts": counts,
+               "findings": attach_labels(self.es_post, findings[:size])}
+        if frame.truncated:
+            out["note"] = f"analyse limitée aux {frame.n} premiers investissements (limit)"
+        return out
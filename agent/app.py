@@ -1,8 +1,13 @@
 ﻿# agent/app.py
 # FastAPI + endpoints bas niveau + /chat orchestré par LLM + délégation au SpecialistAgent.
-import os, json, logging, requests
+import os, json, itertools, logging, threading, time, requests, inspect
+from contextlib import asynccontextmanager
+from requests.adapters import HTTPAdapter
 from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi import Query as Q
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.routing import APIRoute
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 try:
@@ -19,6 +24,20 @@ except Exception:
     pass
 
 from .agents.specialist import SpecialistAgent
+from .agents.aggregate import AggregateAgent
+from .agents.test_agent import TestAgent
+from .agents.hypothesis import HypothesisAgent
+from .core.singleflight import SingleFlight
+from .core.summaries import SummaryMaterializer
+from .core.scan import scan_hits, set_pit_closer
+from .core.export import MEDIA_TYPES, PARQUET_AVAILABLE, WRITERS, export_types
+from .core.similarity import build_company_index
+from .core.schema_cache import SchemaCache
+from .core.cache import label_cache, make_cache, preload_labels
+from .core.join_planner import join_planner
+from .core.resilience import CircuitOpenError, ResilientCaller, query_shape
+from .core import fastjson
+from .core.profiling import in_profiled_thread, profile_request, profiled_iter, profiled_thread, profiles, record_es, span
 
 ES = os.getenv("ES_URL", "http://localhost:9200")
 AUTH = (os.getenv("ES_USER", "sirenadmin"), os.getenv("ES_PASS", "password"))
@@ -26,11 +45,86 @@ API_TOKEN = os.getenv("GRAPH_AGENT_TOKEN", "devtoken")
 VERIFY_TLS = os.getenv("ES_VERIFY", "false").lower() == "true"
 CHAT_MODE = os.getenv("CHAT_MODE", "llm").lower()
 MAX_STEPS = int(os.getenv("LLM_MAX_STEPS", "12"))
+ES_SINGLEFLIGHT = os.getenv("ES_SINGLEFLIGHT", "true").lower() == "true"
+ES_POOL_SIZE = int(os.getenv("ES_POOL_SIZE", "20"))
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+# Préchargement des labels : opt-in (chaque worker charge sa copie), borné par index
+WARMUP_LABELS = os.getenv("WARMUP_LABELS", "false").lower() == "true"
+WARMUP_LABELS_LIMIT = int(os.getenv("WARMUP_LABELS_LIMIT", "20000"))
+SCHEMA_INDICES = [i.strip() for i in os.getenv("SCHEMA_INDICES", "company,investment,investor").split(",") if i.strip()]
+SCHEMA_REFRESH_S = float(os.getenv("SCHEMA_REFRESH_S", "300"))
+ES_RETRIES = int(os.getenv("ES_RETRIES", "2"))
+ES_HEDGE = os.getenv("ES_HEDGE", "true").lower() == "true"
+ES_BREAKER_THRESHOLD = int(os.getenv("ES_BREAKER_THRESHOLD", "5"))
+ES_BREAKER_COOLDOWN_S = float(os.getenv("ES_BREAKER_COOLDOWN_S", "30"))
+ES_LEAN = os.getenv("ES_LEAN", "true").lower() == "true"
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+# Réponses _search réduites à ce que lisent les agents (sans _shards, _index, _score...)
+LEAN_FILTER_PATH = "took,timed_out,hits.total,hits.hits._id,hits.hits._source,hits.hits.sort,hits.hits.matched_queries,aggregations,pit_id"
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
+def warmup():
+    # Connexions poolées, schéma (indices + mappings condensés) puis labels ; ES indisponible = non bloquant
+    try:
+        es_get("/", timeout=5)
+        schema_cache.refresh()
+        logger.info("Warm-up: schema cached for %s", SCHEMA_INDICES)
+        if WARMUP_LABELS:
+            logger.info("Warm-up: %s labels preloaded", preload_labels(es_post, limit=WARMUP_LABELS_LIMIT))
+    except Exception as e:
+        logger.warning("Warm-up incomplete: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP:
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    schema_cache.start()
+    yield
+    schema_cache.stop()
+
+class FastJSONResponse(JSONResponse):
+    # Sérialisation via orjson quand disponible
+    def render(self, content) -> bytes:
+        return fastjson.dumps(content)
+
+class ProfiledRoute(APIRoute):
+    # Endpoints sync : le thread du pool qui les exécute est échantillonné dès le début de la requête
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = in_profiled_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+app.router.route_class = ProfiledRoute
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    # Opt-in : header X-Profile: 1 ou ?profile=1, pour les appelants authentifiés seulement ;
+    # dump consultable via X-Profile-Id. Le profil reste ouvert jusqu'à la fin du corps (réponses streamées).
+    flag = request.headers.get("x-profile") or request.query_params.get("profile")
+    if not (PROFILING and flag and flag.lower() in ("1", "true", "yes")
+            and request.headers.get("authorization") == f"Bearer {API_TOKEN}"):
+        return await call_next(request)
+    profile = profile_request(f"{request.method} {request.url.path}")
+    prof = profile.__enter__()
+    try:
+        response = await call_next(request)
+    except BaseException:
+        profile.__exit__(None, None, None)
+        raise
+    response.headers["X-Profile-Id"] = prof.id
+    body = response.body_iterator
+    async def closing_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            profile.__exit__(None, None, None)
+    response.body_iterator = closing_body()
+    return response
 
 class Query(BaseModel):
     op: str
@@ -40,6 +134,12 @@ class Query(BaseModel):
     es_query: dict | None = None
     size: int | None = 50
     join_type: str | None = None
+    lean: bool = True
+    fields: list[str] | None = None
+
+class ExportQuery(Query):
+    format: str = "ndjson"
+    page_size: int = 1000
 
 def guard(h: str | None):
     if h != f"Bearer {API_TOKEN}":
@@ -89,23 +189,122 @@ def normalize_index(name: str | None) -> str | None:
     }
     return mapping.get(name, name)
 
+# Session HTTP partagée : keep-alive + pool de connexions vers ES.
+# verify passé à chaque requête : au niveau session, REQUESTS_CA_BUNDLE / CURL_CA_BUNDLE (trust_env) l'emportent
+_session = requests.Session()
+_session.auth = AUTH
+_adapter = HTTPAdapter(pool_connections=ES_POOL_SIZE, pool_maxsize=ES_POOL_SIZE)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# Coalescing des requêtes ES identiques en vol (même méthode, path, body canonique).
+# Seules les lectures sont fusionnées ; les écritures passent toujours.
+_inflight = SingleFlight()
+_READ_SUFFIXES = ("/_search", "/_count", "/_msearch")
+
+# Résilience : timeouts adaptatifs, hedging et retries sur les lectures, circuit breaker + réponses périmées
+_resilient = ResilientCaller(retries=ES_RETRIES, hedge=ES_HEDGE, breaker_threshold=ES_BREAKER_THRESHOLD,
+                             breaker_cooldown_s=ES_BREAKER_COOLDOWN_S, pool_size=ES_POOL_SIZE,
+                             stale_cache=make_cache("es_stale", maxsize=500, ttl=3600))
+
+def _is_read(method: str, path: str) -> bool:
+    return method == "GET" or path.split("?", 1)[0].endswith(_READ_SUFFIXES)
+
+def _flight_key(method: str, path: str, body=None):
+    return (method, path, fastjson.canonical(body))
+
+def _coalesce(key, read: bool, fn):
+    if not ES_SINGLEFLIGHT or not read:
+        return fn()
+    return _inflight.do(key, fn)
+
+def _es_call(method: str, path: str, key_body, send, timeout: float, shape: str | None = None,
+             adaptive: bool = True):
+    read = _is_read(method, path)
+    key = _flight_key(method, path, key_body)
+    # Pages PIT : jamais resservies depuis le cache périmé
+    stale_key = key if read and not (isinstance(key_body, dict) and "pit" in key_body) else None
+    # Latences apprises par path et forme de requête ; les écritures gardent le timeout demandé
+    endpoint = f"{method} {path.split('?', 1)[0]}" + (f" [{shape}]" if shape else "")
+    def _do():
+        t0 = time.perf_counter()
+        res = error = None
+        # Échecs et timeouts compris : span et journal agent.slow dans tous les cas
+        with profiled_thread():
+            try:
+                res = _resilient.call(endpoint, send, timeout, idempotent=read, stale_key=stale_key,
+                                      adaptive=adaptive and read)
+            except CircuitOpenError as e:
+                error = e
+                raise HTTPException(503, f"ES {method} {path} failed fast: {e}")
+            except requests.RequestException as e:
+                error = e
+                raise HTTPException(502, f"ES {method} {path} failed: {e}")
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                record_es(method, path, key_body, time.perf_counter() - t0, res, error=error)
+        return res
+    return _coalesce(key, read, _do)
+
+def _lean_path(path: str, lean: bool) -> str:
+    if not (lean and ES_LEAN) or "filter_path=" in path or not path.split("?", 1)[0].endswith("/_search"):
+        return path
+    return f"{path}{'&' if '?' in path else '?'}filter_path={LEAN_FILTER_PATH}"
+
 def es_get(path: str, **kwargs):
-    try:
-        r = requests.get(f"{ES}{path}", auth=AUTH, verify=VERIFY_TLS,
-                         timeout=kwargs.pop("timeout", 30), **kwargs)
+    timeout = kwargs.pop("timeout", 30)
+    adaptive = kwargs.pop("adaptive", True)
+    def send(t: float):
+        r = _session.get(f"{ES}{path}", timeout=t, verify=VERIFY_TLS, **kwargs)
         r.raise_for_status()
-        return r.json()
-    except requests.RequestException as e:
-        raise HTTPException(502, f"ES GET {path} failed: {e}")
+        return fastjson.loads(r.content)
+    return _es_call("GET", path, kwargs or None, send, timeout, adaptive=adaptive)
 
 def es_post(path: str, json=None, **kwargs):
-    try:
-        r = requests.post(f"{ES}{path}", auth=AUTH, json=json, verify=VERIFY_TLS,
-                          timeout=kwargs.pop("timeout", 60), **kwargs)
+    timeout = kwargs.pop("timeout", 60)
+    adaptive = kwargs.pop("adaptive", True)
+    path = _lean_path(path, kwargs.pop("lean", True))
+    body = json
+    def send(t: float):
+        if body is None:
+            r = _session.post(f"{ES}{path}", timeout=t, verify=VERIFY_TLS, **kwargs)
+        else:
+            r = _session.post(f"{ES}{path}", data=fastjson.dumps(body), timeout=t, verify=VERIFY_TLS,
+                              headers={"Content-Type": "application/json"}, **kwargs)
+        r.raise_for_status()
+        return fastjson.loads(r.content)
+    return _es_call("POST", path, {"body": body, **kwargs} if kwargs else body, send, timeout,
+                    shape=query_shape(body), adaptive=adaptive)
+
+def es_put(path: str, json=None, **kwargs):
+    timeout = kwargs.pop("timeout", 60)
+    body = json
+    def send(t: float):
+        r = _session.put(f"{ES}{path}", data=fastjson.dumps(body), timeout=t, verify=VERIFY_TLS,
+                         headers={"Content-Type": "application/json"}, **kwargs)
+        r.raise_for_status()
+        return fastjson.loads(r.content)
+    return _es_call("PUT", path, body, send, timeout)
+
+def es_delete(path: str, json=None, **kwargs):
+    timeout = kwargs.pop("timeout", 10)
+    body = json
+    def send(t: float):
+        if body is None:
+            r = _session.delete(f"{ES}{path}", timeout=t, verify=VERIFY_TLS, **kwargs)
+        else:
+            r = _session.delete(f"{ES}{path}", data=fastjson.dumps(body), timeout=t, verify=VERIFY_TLS,
+                                headers={"Content-Type": "application/json"}, **kwargs)
         r.raise_for_status()
-        return r.json()
-    except requests.RequestException as e:
-        raise HTTPException(502, f"ES POST {path} failed: {e}")
+        return fastjson.loads(r.content)
+    return _es_call("DELETE", path, body, send, timeout)
+
+# Les scans (export, résumés, préchargements, agents) ferment leur PIT en sortie
+set_pit_closer(lambda pit: es_delete("/_pit", json={"id": pit}))
+
+schema_cache = SchemaCache(es_get, SCHEMA_INDICES, refresh_s=SCHEMA_REFRESH_S)
 
 @app.get("/health")
 def health(authorization: str = Header(None)):
@@ -115,12 +314,15 @@ def health(authorization: str = Header(None)):
     except HTTPException as e:
         info = {"error": e.detail}
     return {"mode": CHAT_MODE, "es_url": ES, "verify_tls": VERIFY_TLS,
-            "es": info, "openai_available": OPENAI_AVAILABLE}
+            "es": info, "openai_available": OPENAI_AVAILABLE,
+            "es_singleflight": _inflight.stats(),
+            "schema_cache": schema_cache.stats(), "label_cache": label_cache.stats(),
+            "join_planner": join_planner.stats(), "es_resilience": _resilient.stats()}
 
 @app.get("/graph/indices")
 def list_indices(authorization: str = Header(None)):
     guard(authorization)
-    return es_get("/_cat/indices?format=json", timeout=15)
+    return schema_cache.cat_indices()
 
 @app.get("/graph/mapping")
 def get_mapping(index: str = Q(..., min_length=1), authorization: str = Header(None)):
@@ -135,18 +337,92 @@ def graph_query(body: Query, authorization: str = Header(None)):
     if body.op == "lookup":
         if not body.parent_index:
             raise HTTPException(400, "lookup needs parent_index")
-        return es_post(f"/{body.parent_index}/_search",
-                       json={"size": body.size or 50, "query": body.es_query or {"match_all": {}}}, timeout=30)
+        req = {"size": body.size or 50, "query": body.es_query or {"match_all": {}}}
+        if body.fields: req["_source"] = body.fields
+        return es_post(f"/{body.parent_index}/_search", json=req, timeout=30, lean=body.lean)
     if body.op == "join":
         if not (body.parent_index and body.child_index and body.on and len(body.on) == 2):
             raise HTTPException(400, "join needs parent_index, child_index, on=[child_key,parent_key]")
         join = {"indices": [body.child_index], "on": body.on}
         if body.join_type: join["type"] = body.join_type
         if body.es_query:  join["request"] = {"query": body.es_query}
-        return es_post(f"/siren/{body.parent_index}/_search",
-                       json={"size": body.size or 50, "query": {"join": join}}, timeout=60)
+        req = {"size": body.size or 50, "query": {"join": join}}
+        if body.fields: req["_source"] = body.fields
+        return es_post(f"/siren/{body.parent_index}/_search", json=req, timeout=60, lean=body.lean)
     raise HTTPException(400, f"unsupported op {body.op}")
 
+@app.post("/graph/export")
+def graph_export(body: ExportQuery, authorization: str = Header(None)):
+    """
+    Export streamé de tous les documents d'un lookup/join (NDJSON, CSV ou Parquet).
+    Pagination PIT/search_after : une seule page en mémoire quelle que soit la taille du résultat.
+    """
+    guard(authorization)
+    body.parent_index = normalize_index(body.parent_index)
+    body.child_index = normalize_index(body.child_index)
+    fmt = (body.format or "ndjson").lower()
+    if fmt not in WRITERS:
+        raise HTTPException(400, f"unsupported format {fmt} (supported: {sorted(WRITERS)})")
+    if fmt == "parquet" and not PARQUET_AVAILABLE:
+        raise HTTPException(503, "pyarrow not installed. pip install pyarrow")
+    if not body.parent_index:
+        raise HTTPException(400, "export needs parent_index")
+    if body.op == "lookup":
+        query, search_path = body.es_query or {"match_all": {}}, "/_search"
+    elif body.op == "join":
+        if not (body.child_index and body.on and len(body.on) == 2):
+            raise HTTPException(400, "join needs parent_index, child_index, on=[child_key,parent_key]")
+        join = {"indices": [body.child_index], "on": body.on}
+        if body.join_type: join["type"] = body.join_type
+        if body.es_query:  join["request"] = {"query": body.es_query}
+        query, search_path = {"join": join}, "/siren/_search"
+    else:
+        raise HTTPException(400, f"unsupported op {body.op}")
+
+    # Colonnes et types tirés du mapping : schéma stable sur tout le flux (Parquet, en-tête CSV)
+    types = export_types(schema_cache.mapping(body.parent_index)) if fmt != "ndjson" else None
+    page_size = max(1, min(body.page_size or 1000, 10000))
+    hits = scan_hits(es_post, body.parent_index, query=query, source=body.fields,
+                     page_size=page_size, search_path=search_path)
+    # PIT + première page avant la réponse : une erreur ES donne un 4xx/502, pas un flux tronqué
+    first = next(hits, None)
+    docs = (h.get("_source", {}) for h in itertools.chain([first] if first else [], hits))
+    return StreamingResponse(profiled_iter(WRITERS[fmt](docs, body.fields, types)), media_type=MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{body.parent_index}.{fmt}"'})
+
+@app.post("/graph/summaries/refresh")
+def refresh_summaries(full: bool = Q(False), authorization: str = Header(None)):
+    guard(authorization)
+    return SummaryMaterializer(es_get, es_post).refresh(full=full)
+
+@app.post("/graph/summaries/setup")
+def setup_summaries(authorization: str = Header(None)):
+    # Pipeline d'horodatage d'ingestion sur investment (une fois, puis refresh full)
+    guard(authorization)
+    return SummaryMaterializer(es_get, es_post, es_put=es_put).setup_ingest()
+
+@app.post("/graph/similarity/build")
+def build_similarity(dim: int = Q(1024, ge=64, le=16384), n_lists: int = Q(0, ge=0),
+                     authorization: str = Header(None)):
+    guard(authorization)
+    index = build_company_index(es_post, dim=dim, n_lists=n_lists)
+    return {"summary": f"{len(index.ids)} entreprises indexées (dim={index.dim}, listes IVF={n_lists}).",
+            "companies": len(index.ids), "dim": index.dim, "n_lists": n_lists}
+
+@app.get("/debug/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = Q("json"), authorization: str = Header(None)):
+    """
+    Dump d'une requête profilée : spans, temps par fonction, piles « collapsed » (format=collapsed
+    pour flamegraph.pl / speedscope).
+    """
+    guard(authorization)
+    dump = profiles.get(profile_id)
+    if dump is None:
+        raise HTTPException(404, f"profile {profile_id} not found (expired?)")
+    if format == "collapsed":
+        return PlainTextResponse(dump["collapsed"])
+    return dump
+
 def local_plan_summary() -> str:
     # Mini-plan par défaut (utile quand CHAT_MODE=local)
     try:
@@ -154,7 +430,7 @@ def local_plan_summary() -> str:
     except HTTPException:
         return "Elasticsearch hors service."
     res = es_post("/siren/company/_search",
-                  json={"size": 10, "query": {"join": {
+                  json={"size": 10, "_source": ["id", "label"], "query": {"join": {
                       "indices": ["investment"], "on": ["companies", "id"], "request": {"query": {"match_all": {}}}
                   }}}, timeout=60)
     hits = res.get("hits", {}).get("hits", []) or []
@@ -226,11 +502,11 @@ async def chat(request: Request, authorization: str = Header(None)):
 
     TOOLS = [
       {"type":"function","function":{
-        "name":"graph_indices","description":"Lister les indices",
+        "name":"graph_indices","description":"Lister les indices (nom + nb docs)",
         "parameters":{"type":"object","properties":{}}
       }},
       {"type":"function","function":{
-        "name":"graph_mapping","description":"Mapping d'un index",
+        "name":"graph_mapping","description":"Mapping condensé d'un index (champ: type)",
         "parameters":{"type":"object","properties":{"index":{"type":"string"}},"required":["index"]}
       }},
       {"type":"function","function":{
@@ -241,7 +517,8 @@ async def chat(request: Request, authorization: str = Header(None)):
           "child_index":{"type":"string"},
           "on":{"type":"array","items":{"type":"string"}},
           "es_query":{"type":"object"},
-          "size":{"type":"integer"}
+          "size":{"type":"integer"},
+          "fields":{"type":"array","items":{"type":"string"},"description":"projection _source"}
         },"required":["op","parent_index","es_query"]}
       }},
       {"type":"function","function":{
@@ -250,28 +527,76 @@ async def chat(request: Request, authorization: str = Header(None)):
           "task":{"type":"string","enum":[
             "company_investors","investments_by_amount","top_investments_for_company","investments_in_period_currency",
             "common_investors_between_companies","co_invested_companies_for_company",
-            "geo_near_companies","temporal_overlap_for_companies"
+            "geo_near_companies","temporal_overlap_for_companies",
+            "top_companies_by_raised","most_active_investors","similar_companies",
+            "company_investors_batch","top_investments_for_companies","common_investors_across_companies"
           ]},
           "params":{"type":"object"}
         },"required":["task"]}
+      }},
+      {"type":"function","function":{
+        "name":"aggregate","description":"Agrégations ES (size=0) : group_by exact (composite), top_terms, histogram, stats. "
+                                         "metrics=[{op:sum|avg|min|max|value_count|cardinality|stats, field}]",
+        "parameters":{"type":"object","properties":{
+          "task":{"type":"string","enum":["group_by","top_terms","histogram","stats"]},
+          "params":{"type":"object","properties":{
+            "index":{"type":"string"},
+            "es_query":{"type":"object"},
+            "group_by":{"type":"array","items":{"type":"string"}},
+            "field":{"type":"string"},
+            "metrics":{"type":"array","items":{"type":"object"}},
+            "sort_by":{"type":"string"},
+            "order":{"type":"string","enum":["asc","desc"]},
+            "interval":{"type":"number"},
+            "calendar_interval":{"type":"string"},
+            "size":{"type":"integer"}
+          }}
+        },"required":["task","params"]}
+      }},
+      {"type":"function","function":{
+        "name":"analyze_investments","description":"Contrôles vectorisés sur jusqu'à 50 000 investissements filtrés : "
+                                                   "coherence_checks (dates, montants, devises, doublons), anomaly_scan "
+                                                   "(+ tours aberrants, rafales, co-investisseurs récurrents, participations "
+                                                   "croisées), generate_hypotheses (motifs -> hypothèses). Constats classés uniquement.",
+        "parameters":{"type":"object","properties":{
+          "task":{"type":"string","enum":["coherence_checks","anomaly_scan","generate_hypotheses"]},
+          "params":{"type":"object","properties":{
+            "es_query":{"type":"object"},
+            "company_ids":{"type":"array","items":{"type":"string"}},
+            "investor_ids":{"type":"array","items":{"type":"string"}},
+            "min_amount":{"type":"number"},
+            "currency_code":{"type":"string"},
+            "year_min":{"type":"integer"},
+            "year_max":{"type":"integer"},
+            "window_days":{"type":"integer"},
+            "size":{"type":"integer"}
+          }}
+        },"required":["task"]}
       }}
     ]
 
     SYSTEM = (
       "Tu planifies façon HTN. Utilise lookup(size<=50) et join quand la paire est claire (on=['companies','id'] "
       "ou ['investors','id']). Pour des requêtes multi-étapes (co-invest, géo, temporalité), appelle call_specialist "
-      "avec le task adapté. OBLIGATION: appelle au moins un outil (graph_* ou call_specialist) avant de répondre. "
+      "avec le task adapté (variantes *_batch / *_for_companies / *_across_companies pour plusieurs entreprises "
+      "en un seul appel). Pour sommes/comptages/classements/histogrammes, utilise aggregate "
+      "(jamais de calcul sur des hits). Pour vérifier la cohérence ou chercher des anomalies/hypothèses sur un "
+      "ensemble d'investissements, utilise analyze_investments. OBLIGATION: appelle au moins un outil (graph_* ou call_specialist) avant de répondre. "
       "Si aucune donnée n’est trouvée, dis-le. Rends un résumé clair (#résultats, éléments saillants) + pistes d’affinage."
     )
+    schema_text = schema_cache.prompt_text()
+    if schema_text:
+        SYSTEM += "\n" + schema_text
 
     messages = [{"role":"system","content": SYSTEM},
                 {"role":"user","content": prompt}]
 
     try:
         for step in range(MAX_STEPS):
-            resp = client.chat.completions.create(
-                model=model, messages=messages, tools=TOOLS, tool_choice="required", temperature=0.2
-            )
+            with span("chat.llm", step=step):
+                resp = client.chat.completions.create(
+                    model=model, messages=messages, tools=TOOLS, tool_choice="required", temperature=0.2
+                )
             msg = resp.choices[0].message
             if not getattr(msg, "tool_calls", None):
                 # Si aucune tool_call n'est proposée, on force l'erreur pour éviter les hallucinations.
@@ -293,45 +618,60 @@ async def chat(request: Request, authorization: str = Header(None)):
                 except Exception:
                     args = {}
 
-                if name == "graph_indices":
-                    result = es_get("/_cat/indices?format=json", timeout=15)
-
-                elif name == "graph_mapping":
-                    idx = args.get("index")
-                    idx = normalize_index(idx)
-                    result = es_get(f"/{idx}/_mapping?pretty", timeout=30) if idx else {"error":"index is required"}
-
-                elif name == "graph_query":
-                    op = args.get("op")
-                    parent_index = normalize_index(args.get("parent_index"))
-                    child_index  = normalize_index(args.get("child_index"))
-                    on           = args.get("on")
-                    es_q         = args.get("es_query") or {"match_all":{}}
-                    size         = int(args.get("size", 50))
-                    if op == "lookup":
-                        result = es_post(f"/{parent_index}/_search",
-                                         json={"size": size, "query": es_q}, timeout=30)
-                    elif op == "join":
-                        if not (parent_index and child_index and on and len(on)==2):
-                            result = {"error":"join needs parent_index, child_index, on=[child_key,parent_key]"}
+                with span(f"chat.tool.{name}", args=args):
+                    if name == "graph_indices":
+                        result = schema_cache.indices()
+
+                    elif name == "graph_mapping":
+                        idx = args.get("index")
+                        idx = normalize_index(idx)
+                        result = schema_cache.mapping(idx) if idx else {"error":"index is required"}
+
+                    elif name == "graph_query":
+                        op = args.get("op")
+                        parent_index = normalize_index(args.get("parent_index"))
+                        child_index  = normalize_index(args.get("child_index"))
+                        on           = args.get("on")
+                        es_q         = args.get("es_query") or {"match_all":{}}
+                        size         = int(args.get("size", 50))
+                        fields       = args.get("fields")
+                        if op == "lookup":
+                            req = {"size": size, "query": es_q}
+                            if fields: req["_source"] = fields
+                            result = es_post(f"/{parent_index}/_search", json=req, timeout=30)
+                        elif op == "join":
+                            if not (parent_index and child_index and on and len(on)==2):
+                                result = {"error":"join needs parent_index, child_index, on=[child_key,parent_key]"}
+                            else:
+                                join = {"indices":[child_index], "on": on, "request":{"query": es_q}}
+                                req = {"size": size, "query":{"join":join}}
+                                if fields: req["_source"] = fields
+                                result = es_post(f"/siren/{parent_index}/_search", json=req, timeout=60)
                         else:
-                            join = {"indices":[child_index], "on": on, "request":{"query": es_q}}
-                            result = es_post(f"/siren/{parent_index}/_search",
-                                             json={"size": size, "query":{"join":join}}, timeout=60)
-                    else:
-                        result = {"error": f"unsupported op {op}"}
+                            result = {"error": f"unsupported op {op}"}
+
+                    elif name == "call_specialist":
+                        task   = args.get("task")
+                        params = args.get("params") or {}
+                        specialist = SpecialistAgent(es_get, es_post)
+                        result = specialist.run(task, params)
 
-                elif name == "call_specialist":
-                    task   = args.get("task")
-                    params = args.get("params") or {}
-                    specialist = SpecialistAgent(es_get, es_post)
-                    result = specialist.run(task, params)
+                    elif name == "aggregate":
+                        params = dict(args.get("params") or {})
+                        params["index"] = normalize_index(params.get("index"))
+                        result = AggregateAgent(es_get, es_post).run(args.get("task"), params)
 
-                else:
-                    result = {"error": f"unknown tool {name}"}
+                    elif name == "analyze_investments":
+                        task = args.get("task")
+                        agent_cls = HypothesisAgent if task in HypothesisAgent.SUPPORTED else TestAgent
+                        result = agent_cls(es_get, es_post).run(task, args.get("params") or {})
+
+                    else:
+                        result = {"error": f"unknown tool {name}"}
 
-                messages.append({"role":"tool","tool_call_id": tc.id,
-                                 "name": name, "content": json.dumps(result)[:15000]})
+                with span("chat.serialize", tool=name):
+                    content = fastjson.dumps_str(result)[:15000]
+                messages.append({"role":"tool","tool_call_id": tc.id, "name": name, "content": content})
                 logger.info("Tool result %s: %s", name, str(result)[:2000])
 
         raise HTTPException(500, f"LLM did not produce a final answer in {MAX_STEPS} steps.")
@@ -0,0 +1,308 @@
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from .cache import cached_labels
+from .scan import scan_hits
+
+INVESTMENT_FIELDS = ["id", "raised_amount", "raised_currency_code", "funded_date", "funded_year",
+                     "companies", "investors"]
+
+# Contrôles de cohérence (TestAgent) vs motifs suspects (HypothesisAgent)
+COHERENCE_KINDS = {"invalid_date", "future_date", "implausible_date", "year_mismatch", "non_positive_amount",
+                   "missing_currency", "no_company", "duplicate_round", "self_investment"}
+PATTERN_KINDS = {"outlier_round", "company_burst", "investor_burst", "shared_investors", "circular_investment"}
+
+_NO_DAY = np.iinfo(np.int64).min
+
+
+def _as_list(v: Any) -> List[Any]:
+    if v is None:
+        return []
+    return list(v) if isinstance(v, (list, tuple)) else [v]
+
+
+def _to_days(raw: List[Any]) -> np.ndarray:
+    # Dates ISO -> jours depuis l'epoch (int64) ; _NO_DAY si absente ou illisible
+    text = np.array([str(s)[:10] if s else "NaT" for s in raw])
+    try:
+        days = text.astype("datetime64[D]")
+    except ValueError:
+        days = np.empty(len(text), dtype="datetime64[D]")
+        for i, s in enumerate(text):
+            try:
+                days[i] = np.datetime64(s, "D")
+            except ValueError:
+                days[i] = np.datetime64("NaT")
+    out = days.astype(np.int64)
+    out[np.isnat(days)] = _NO_DAY
+    return out
+
+
+class InvestmentFrame:
+    """
+    Investissements en colonnes NumPy. Les listes companies / investors sont stockées à plat
+    (codes entiers + index de la ligne d'investissement), comme une matrice creuse COO.
+    """
+
+    def __init__(self, sources: List[Dict[str, Any]]):
+        n = len(sources)
+        self.n = n
+        self.truncated = False
+        self.ids = np.array([s.get("id") for s in sources], dtype=object)
+        self.amount = np.array([s.get("raised_amount") if isinstance(s.get("raised_amount"), (int, float))
+                                else np.nan for s in sources], dtype=np.float64)
+        self.currency_names, self.currency = np.unique(
+            np.array([str(s.get("raised_currency_code") or "") for s in sources], dtype=str), return_inverse=True)
+        raw_dates = [s.get("funded_date") for s in sources]
+        self.has_date = np.array([bool(d) for d in raw_dates], dtype=bool)
+        self.day = _to_days(raw_dates)
+        self.year = np.array([s.get("funded_year") if isinstance(s.get("funded_year"), (int, float)) else np.nan
+                              for s in sources], dtype=np.float64)
+
+        companies = [_as_list(s.get("companies")) for s in sources]
+        investors = [_as_list(s.get("investors")) for s in sources]
+        self.company_row = np.repeat(np.arange(n), [len(c) for c in companies])
+        self.investor_row = np.repeat(np.arange(n), [len(v) for v in investors])
+        # Vocabulaire commun companies + investors : détecte les entités des deux côtés (boucles)
+        flat_c = [str(c) for cs in companies for c in cs]
+        flat_v = [str(v) for vs in investors for v in vs]
+        self.entity_names, codes = np.unique(np.array(flat_c + flat_v, dtype=str), return_inverse=True)
+        self.company_code = codes[:len(flat_c)]
+        self.investor_code = codes[len(flat_c):]
+
+    @classmethod
+    def load(cls, es_post: Callable, query: Dict[str, Any], limit: int = 50_000) -> "InvestmentFrame":
+        sources: List[Dict[str, Any]] = []
+        for h in scan_hits(es_post, "investment", query=query, source=INVESTMENT_FIELDS):
+            sources.append(h.get("_source", {}))
+            if len(sources) >= limit:
+                break
+        frame = cls(sources)
+        frame.truncated = len(sources) >= limit
+        return frame
+
+    def company_investor_pairs(self) -> tuple:
+        """
+        Couples (entreprise, investisseur) distincts, triés par entreprise, via leur ligne d'investissement commune.
+        """
+        n_ent = len(self.entity_names)
+        order = np.argsort(self.company_row, kind="stable")
+        c_rows, c_codes = self.company_row[order], self.company_code[order]
+        lo = np.searchsorted(c_rows, self.investor_row, side="left")
+        counts = np.searchsorted(c_rows, self.investor_row, side="right") - lo
+        rep = np.repeat(np.arange(len(self.investor_row)), counts)
+        pos = lo[rep] + np.arange(len(rep)) - np.repeat(np.cumsum(counts) - counts, counts)
+        pairs = np.unique(c_codes[pos].astype(np.int64) * n_ent + self.investor_code[rep])
+        return pairs // n_ent, pairs % n_ent
+
+
+def _day_str(day: int) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+
+def _investment_findings(f: InvestmentFrame, kind: str, mask: np.ndarray, score: float,
+                         detail: Callable[[int], Dict[str, Any]] | None = None) -> List[Dict[str, Any]]:
+    return [{"kind": kind, "score": score, "investment_id": f.ids[i], **(detail(i) if detail else {})}
+            for i in np.flatnonzero(mask)]
+
+
+def _coherence(f: InvestmentFrame, today: int) -> List[Dict[str, Any]]:
+    valid = f.day != _NO_DAY
+    out = _investment_findings(f, "invalid_date", f.has_date & ~valid, 1.0)
+    out += _investment_findings(f, "future_date", valid & (f.day > today), 1.5,
+                                lambda i: {"funded_date": _day_str(f.day[i])})
+    out += _investment_findings(f, "implausible_date", valid & (f.day < np.datetime64("1900-01-01").astype(np.int64)),
+                                1.5, lambda i: {"funded_date": _day_str(f.day[i])})
+    date_year = np.where(valid, f.day.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970, -1)
+    mismatch = valid & ~np.isnan(f.year) & (f.year != date_year)
+    out += _investment_findings(f, "year_mismatch", mismatch, 1.0,
+                                lambda i: {"funded_date": _day_str(f.day[i]), "funded_year": int(f.year[i])})
+    out += _investment_findings(f, "non_positive_amount", f.amount <= 0, 1.0,
+                                lambda i: {"raised_amount": float(f.amount[i])})
+    no_currency = f.currency_names[f.currency] == ""
+    out += _investment_findings(f, "missing_currency", (f.amount > 0) & no_currency, 1.0,
+                                lambda i: {"raised_amount": float(f.amount[i])})
+    has_company = np.bincount(f.company_row, minlength=f.n) > 0
+    out += _investment_findings(f, "no_company", ~has_company, 1.0)
+
+    # Doublons : même entreprise, même jour, même montant, même devise
+    rows = f.company_row
+    ok = valid[rows] & ~np.isnan(f.amount[rows])
+    if ok.any():
+        r, c = rows[ok], f.company_code[ok]
+        keys = np.stack([c, f.day[r], np.round(f.amount[r]).astype(np.int64), f.currency[r]], axis=1)
+        _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        groups: Dict[int, List[int]] = {}
+        for p in np.flatnonzero(counts[inverse] > 1):
+            groups.setdefault(int(inverse[p]), []).append(int(p))
+        for members in groups.values():
+            i = r[members[0]]
+            out.append({"kind": "duplicate_round", "score": 1.0 + 0.5 * (len(members) - 1),
+                        "company_id": f.entity_names[c[members[0]]],
+                        "investment_ids": [f.ids[r[m]] for m in members],
+                        "funded_date": _day_str(f.day[i]), "raised_amount": float(f.amount[i])})
+
+    # Auto-investissement : l'investisseur est aussi l'entreprise financée
+    inv_key = f.investor_row.astype(np.int64) * len(f.entity_names) + f.investor_code
+    com_key = f.company_row.astype(np.int64) * len(f.entity_names) + f.company_code
+    self_inv = np.isin(inv_key, com_key)
+    for row, code in zip(f.investor_row[self_inv], f.investor_code[self_inv]):
+        out.append({"kind": "self_investment", "score": 2.0, "investment_id": f.ids[row],
+                    "company_id": f.entity_names[code]})
+    return out
+
+
+def _outliers(f: InvestmentFrame, z_threshold: float, min_samples: int) -> List[Dict[str, Any]]:
+    # z-score robuste (médiane / MAD) du log10 du montant, par devise
+    out: List[Dict[str, Any]] = []
+    positive = f.amount > 0
+    logs = np.log10(np.where(positive, f.amount, 1.0))
+    for c in np.unique(f.currency[positive]):
+        idx = np.flatnonzero(positive & (f.currency == c))
+        if len(idx) < min_samples:
+            continue
+        x = logs[idx]
+        med = np.median(x)
+        mad = np.median(np.abs(x - med))
+        if mad == 0:
+            continue
+        z = 0.6745 * (x - med) / mad
+        for i, zi in zip(idx[np.abs(z) >= z_threshold], z[np.abs(z) >= z_threshold]):
+            out.append({"kind": "outlier_round", "score": round(abs(float(zi)) / z_threshold, 3),
+                        "investment_id": f.ids[i], "raised_amount": float(f.amount[i]),
+                        "currency": f.currency_names[c], "robust_z": round(float(zi), 2),
+                        "currency_median": round(float(10 ** med), 2)})
+    return out
+
+
+def _bursts(f: InvestmentFrame, kind: str, codes: np.ndarray, rows: np.ndarray, window_days: int,
+            min_count: int, ratio: float) -> List[Dict[str, Any]]:
+    """
+    Pour chaque entité, nombre maximal d'investissements dans une fenêtre glissante de `window_days`,
+    comparé à son rythme habituel (total x fenêtre / durée d'activité, au moins un an).
+    """
+    days = f.day[rows]
+    ok = days != _NO_DAY
+    codes, days = codes[ok], days[ok]
+    if not len(codes):
+        return []
+    order = np.lexsort((days, codes))
+    codes, days = codes[order], days[order]
+    span = int(days.max() - days.min()) + window_days + 1
+    key = codes.astype(np.int64) * span + (days - days.min())
+    in_window = np.searchsorted(key, key + window_days, side="right") - np.arange(len(key))
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    total = ends - starts
+    active = np.maximum(days[ends - 1] - days[starts], 365)
+    threshold = np.maximum(min_count, ratio * total * window_days / active)
+    peak = np.maximum.reduceat(in_window, starts)
+    # Début de la fenêtre la plus dense : premier élément de chaque groupe trié par compte décroissant
+    group = np.repeat(np.arange(len(starts)), total)
+    best = np.lexsort((-in_window, group))[starts]
+    flagged = np.flatnonzero(peak >= threshold)
+    field = "company_id" if kind == "company_burst" else "investor_id"
+    return [{"kind": kind, "score": round(float(peak[g] / threshold[g]), 3),
+             field: f.entity_names[codes[starts[g]]], "count": int(peak[g]), "window_days": window_days,
+             "window_start": _day_str(days[best[g]]), "total_investments": int(total[g])}
+            for g in flagged]
+
+
+def _shared_investors(f: InvestmentFrame, min_shared: int, max_group: int) -> List[Dict[str, Any]]:
+    # Paires d'investisseurs présentes ensemble dans >= min_shared entreprises distinctes
+    n_ent = len(f.entity_names)
+    comp, inv = f.company_investor_pairs()
+    if not len(comp):
+        return []
+    starts = np.flatnonzero(np.r_[True, comp[1:] != comp[:-1]])
+    sizes = np.diff(np.r_[starts, len(comp)])
+    # Les entreprises à très nombreux investisseurs n'informent pas (et coûtent g²)
+    keep = np.repeat(sizes <= max_group, sizes)
+    comp, inv = comp[keep], inv[keep]
+    if not len(comp):
+        return []
+    starts = np.flatnonzero(np.r_[True, comp[1:] != comp[:-1]])
+    sizes = np.diff(np.r_[starts, len(comp)])
+    local = np.arange(len(comp)) - np.repeat(starts, sizes)
+    partners = np.repeat(sizes, sizes) - local - 1
+    a_idx = np.repeat(np.arange(len(comp)), partners)
+    b_idx = a_idx + 1 + np.arange(len(a_idx)) - np.repeat(np.cumsum(partners) - partners, partners)
+    pair_keys, shared = np.unique(inv[a_idx] * n_ent + inv[b_idx], return_counts=True)
+
+    out = []
+    for k, cnt in zip(pair_keys[shared >= min_shared], shared[shared >= min_shared]):
+        a, b = divmod(int(k), n_ent)
+        common = np.intersect1d(comp[inv == a], comp[inv == b])
+        out.append({"kind": "shared_investors", "score": round(float(cnt) / min_shared, 3),
+                    "investor_ids": [f.entity_names[a], f.entity_names[b]], "shared_companies": int(cnt),
+                    "company_ids": [f.entity_names[c] for c in common[:10]]})
+    return out
+
+
+def _circular(f: InvestmentFrame) -> List[Dict[str, Any]]:
+    # A investit dans B et B investit dans A (investisseur et entreprise partagent le même id)
+    n_ent = len(f.entity_names)
+    dst, src = f.company_investor_pairs()
+    edges = np.unique(src * n_ent + dst)
+    src, dst = edges // n_ent, edges % n_ent
+    mutual = (src < dst) & np.isin(dst * n_ent + src, edges)
+    return [{"kind": "circular_investment", "score": 2.0,
+             "entity_ids": [f.entity_names[a], f.entity_names[b]]}
+            for a, b in zip(src[mutual], dst[mutual])]
+
+
+def scan_investments(f: InvestmentFrame, params: Dict[str, Any] | None = None,
+                     kinds: set | None = None) -> List[Dict[str, Any]]:
+    """
+    Tous les contrôles en une passe sur le frame ; retourne les constats triés par score décroissant
+    (score >= 1 pour tout constat, d'autant plus haut que le seuil du contrôle est dépassé).
+    """
+    params = params or {}
+    kinds = COHERENCE_KINDS | PATTERN_KINDS if kinds is None else kinds
+    window = int(params.get("window_days", 30))
+    findings: List[Dict[str, Any]] = []
+    if kinds & COHERENCE_KINDS:
+        today = np.datetime64("today", "D").astype(np.int64)
+        findings += [x for x in _coherence(f, today) if x["kind"] in kinds]
+    if "outlier_round" in kinds:
+        findings += _outliers(f, float(params.get("z_threshold", 3.5)), int(params.get("min_samples", 20)))
+    if "company_burst" in kinds:
+        findings += _bursts(f, "company_burst", f.company_code, f.company_row, window,
+                            int(params.get("burst_min", 3)), float(params.get("burst_ratio", 3)))
+    if "investor_burst" in kinds:
+        findings += _bursts(f, "investor_burst", f.investor_code, f.investor_row, window,
+                            int(params.get("investor_burst_min", 5)), float(params.get("burst_ratio", 3)))
+    if "shared_investors" in kinds:
+        findings += _shared_investors(f, int(params.get("min_shared", 3)), int(params.get("max_group", 100)))
+    if "circular_investment" in kinds:
+        findings += _circular(f)
+    findings.sort(key=lambda x: x["score"], reverse=True)
+    return findings
+
+
+def attach_labels(es_post: Callable, findings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Labels résolus pour les seuls constats retournés (cache partagé)
+    companies = {x["company_id"] for x in findings if x.get("company_id")}
+    companies |= {c for x in findings for c in x.get("company_ids", [])}
+    investors = {x["investor_id"] for x in findings if x.get("investor_id")}
+    investors |= {v for x in findings for v in x.get("investor_ids", [])}
+    entities = {e for x in findings for e in x.get("entity_ids", [])}
+    companies |= entities
+    investors |= entities
+    c_labels = cached_labels(es_post, "company", list(companies))
+    v_labels = cached_labels(es_post, "investor", list(investors))
+    for x in findings:
+        if x.get("company_id"):
+            x["company_label"] = c_labels.get(x["company_id"])
+        if x.get("company_ids"):
+            x["company_labels"] = [c_labels.get(c) for c in x["company_ids"]]
+        if x.get("investor_id"):
+            x["investor_label"] = v_labels.get(x["investor_id"])
+        if x.get("investor_ids"):
+            x["investor_labels"] = [v_labels.get(v) for v in x["investor_ids"]]
+        if x.get("entity_ids"):
+            x["entity_labels"] = [c_labels.get(e) or v_labels.get(e) for e in x["entity_ids"]]
+    return findings
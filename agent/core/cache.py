@@ -0,0 +1,341 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List
+
+from . import fastjson
+from .scan import scan_hits
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_PATH = os.getenv("CACHE_PATH", ".cache/agent_cache.sqlite3")
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Cache mémoire LRU + TTL, thread-safe. Interface commune aux caches des agents
+    (get / set / get_many / set_many).
+    """
+
+    def __init__(self, maxsize: int = 100_000, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        out = {}
+        for k in keys:
+            v = self.get(k, _MISSING)
+            if v is not _MISSING:
+                out[k] = v
+        return out
+
+    def set_many(self, items: Dict[Hashable, Any], ttl: float | None = None):
+        for k, v in items.items():
+            self.set(k, v, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self._hits, "misses": self._misses}
+
+
+_MISSING = object()
+
+
+class SQLiteCache:
+    """
+    Cache partagé entre workers d'un même hôte, adossé à un fichier SQLite (WAL).
+    Même interface que TTLCache. Valeurs sérialisées en JSON (orjson si dispo), compressées au-delà de 1 Ko ;
+    chaque écriture est une transaction ; éviction TTL à la lecture et LRU (colonne accessed) au-delà de maxsize.
+    Plusieurs caches partagent le fichier via `namespace`.
+    Le cache est sur le chemin des requêtes : une erreur SQLite (verrou, disque) est journalisée et traitée
+    comme un miss / une écriture perdue. Les mises à jour LRU sont différées et groupées : une entrée n'est
+    re-touchée qu'après TOUCH_EVERY_S, dans la transaction d'écriture suivante.
+    """
+    COMPRESS_MIN = 1024
+    EVICT_EVERY = 500
+    TOUCH_EVERY_S = 60
+    TOUCH_FLUSH = 1000
+
+    def __init__(self, path: str = CACHE_PATH, namespace: str = "default", maxsize: int = 100_000,
+                 ttl: float = 3600, timeout: float = 1):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._errors = 0
+        self.timeout = timeout
+        self._touched: Dict[str, float] = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS cache (ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB, "
+                      "zipped INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (ns, key))")
+            c.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (ns, accessed)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Une connexion par thread ; WAL pour des lectures concurrentes entre processus
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return fastjson.canonical(key)
+
+    def _encode(self, value: Any) -> tuple:
+        data = fastjson.dumps(value)
+        if len(data) >= self.COMPRESS_MIN:
+            return zlib.compress(data, 1), 1
+        return data, 0
+
+    @staticmethod
+    def _decode(data: bytes, zipped: int) -> Any:
+        return fastjson.loads(zlib.decompress(data) if zipped else data)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        v = self.get_many([key]).get(key, _MISSING)
+        return default if v is _MISSING else v
+
+    def _failed(self, op: str, e: Exception):
+        self._count("_errors")
+        logger.warning("sqlite cache %s/%s %s failed: %s", self.path, self.namespace, op, e)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        by_skey = {self._key(k): k for k in keys}
+        if not by_skey:
+            return {}
+        now = time.time()
+        out: Dict[Hashable, Any] = {}
+        stale: List[str] = []
+        skeys = list(by_skey)
+        try:
+            conn = self._conn()
+            for i in range(0, len(skeys), 500):
+                chunk = skeys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT key, value, zipped, accessed FROM cache "
+                                    f"WHERE ns = ? AND expires > ? AND key IN ({marks})",
+                                    [self.namespace, now, *chunk]).fetchall()
+                for skey, data, zipped, accessed in rows:
+                    out[by_skey[skey]] = self._decode(data, zipped)
+                    if accessed < now - self.TOUCH_EVERY_S:
+                        stale.append(skey)
+        except sqlite3.Error as e:
+            self._failed("get", e)
+        self._count("_hits", len(out))
+        self._count("_misses", len(by_skey) - len(out))
+        if stale:
+            with self._lock:
+                self._touched.update(dict.fromkeys(stale, now))
+                flush = len(self._touched) >= self.TOUCH_FLUSH
+            if flush:
+                self._write([], "touch")
+        return out
+
+    def _write(self, rows: List[tuple], op: str, evict: bool = False) -> bool:
+        # Une transaction : entrées à écrire, accès LRU en attente, éviction éventuelle
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        conn = None
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            if rows:
+                conn.executemany("INSERT OR REPLACE INTO cache (ns, key, value, zipped, expires, accessed) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if touched:
+                conn.executemany("UPDATE cache SET accessed = MAX(accessed, ?) WHERE ns = ? AND key = ?",
+                                 [(t, self.namespace, k) for k, t in touched.items()])
+            if evict:
+                conn.execute("DELETE FROM cache WHERE ns = ? AND expires <= ?", (self.namespace, time.time()))
+                conn.execute("DELETE FROM cache WHERE ns = ? AND key IN (SELECT key FROM cache WHERE ns = ? "
+                             "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                             (self.namespace, self.namespace, self.maxsize))
+            conn.execute("COMMIT")
+            return True
+        except sqlite3.Error as e:
+            if conn is not None and conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            self._failed(op, e)
+            return False
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: Dict[Hashable, Any], ttl: float | None = None):
+        if not items:
+            return
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        rows = [(self.namespace, self._key(k), *self._encode(v), expires, now) for k, v in items.items()]
+        with self._lock:
+            before = self._writes
+            self._writes += len(rows)
+            evict = before // self.EVICT_EVERY != self._writes // self.EVICT_EVERY
+        self._write(rows, "set", evict=evict)
+
+    def evict(self):
+        self._write([], "evict", evict=True)
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+        try:
+            self._conn().execute("DELETE FROM cache WHERE ns = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = self._conn().execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()[0]
+        except sqlite3.Error as e:
+            self._failed("stats", e)
+            size = None
+        with self._lock:
+            return {"backend": "sqlite", "size": size, "hits": self._hits, "misses": self._misses,
+                    "errors": self._errors}
+
+
+class TieredCache:
+    """
+    L1 mémoire (court TTL, propre au processus) devant un L2 partagé (SQLiteCache). Même interface.
+    """
+
+    def __init__(self, l1: TTLCache, l2: SQLiteCache):
+        self.l1 = l1
+        self.l2 = l2
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        v = self.get_many([key]).get(key, _MISSING)
+        return default if v is _MISSING else v
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        keys = list(keys)
+        out = self.l1.get_many(keys)
+        missing = [k for k in keys if k not in out]
+        if missing:
+            found = self.l2.get_many(missing)
+            self.l1.set_many(found)
+            out.update(found)
+        return out
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: Dict[Hashable, Any], ttl: float | None = None):
+        self.l2.set_many(items, ttl)
+        self.l1.set_many(items, min(ttl, self.l1.ttl) if ttl is not None else None)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"l1": self.l1.stats(), "l2": self.l2.stats()}
+
+
+def make_cache(namespace: str, maxsize: int, ttl: float, l1_ttl: float = 60):
+    """
+    Cache selon CACHE_BACKEND : `memory` (TTLCache par processus) ou `sqlite` (L1 mémoire + L2 partagé
+    entre workers dans CACHE_PATH).
+    """
+    if CACHE_BACKEND == "sqlite":
+        return TieredCache(TTLCache(maxsize=min(maxsize, 10_000), ttl=min(ttl, l1_ttl)),
+                           SQLiteCache(CACHE_PATH, namespace=namespace, maxsize=maxsize, ttl=ttl))
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+# Labels id -> label par index (company / investor), partagés par tous les agents du processus
+label_cache = make_cache("labels", maxsize=int(os.getenv("LABEL_CACHE_SIZE", "200000")),
+                         ttl=float(os.getenv("LABEL_CACHE_TTL", "21600")))
+
+
+def cached_labels(es_post: Callable, index: str, ids: List[str]) -> Dict[str, Any]:
+    """
+    Résout id -> label via le cache, en ne requêtant ES que pour les ids manquants.
+    """
+    if not ids:
+        return {}
+    found = {k[1]: v for k, v in label_cache.get_many((index, i) for i in ids).items()}
+    missing = [i for i in dict.fromkeys(ids) if i not in found]
+    if missing:
+        res = es_post(f"/{index}/_search", json={"size": len(missing), "_source": ["id", "label"],
+                                                 "query": {"terms": {"id": missing}}})
+        fetched = {h.get("_source", {}).get("id"): h.get("_source", {}).get("label")
+                   for h in res.get("hits", {}).get("hits", []) or []}
+        label_cache.set_many({(index, i): lab for i, lab in fetched.items()})
+        found.update(fetched)
+    return found
+
+
+PRELOAD_PAGE = 1000
+
+
+def preload_labels(es_post: Callable, indices: Iterable[str] = ("company", "investor"), limit: int = 200_000) -> int:
+    # Warm-up : charge les labels par scan PIT, borné par `limit` par index
+    loaded = 0
+    for index in indices:
+        n = 0
+        page: Dict[Hashable, Any] = {}
+        for h in scan_hits(es_post, index, source=["id", "label"], page_size=PRELOAD_PAGE):
+            s = h.get("_source", {})
+            if s.get("id") is not None:
+                page[(index, s["id"])] = s.get("label")
+                n += 1
+            # Une écriture (transaction) par page scannée
+            if len(page) >= PRELOAD_PAGE or n >= limit:
+                label_cache.set_many(page)
+                page = {}
+            if n >= limit:
+                break
+        label_cache.set_many(page)
+        loaded += n
+    return loaded
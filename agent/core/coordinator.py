@@ -1,5 +1,6 @@
 from typing import Any, Dict, List
 from .base_agent import BaseAgent
+from .profiling import span
 
 
 class Coordinator(BaseAgent):
@@ -27,6 +28,7 @@ class Coordinator(BaseAgent):
     def run(self, task: str, params: Dict[str, Any]) -> Dict[str, Any]:
         for name, agent in self.agents.items():
             if self._agent_supports(agent, task):
-                return agent.run(task, params)
+                with span(f"coordinator.{name}.{task}", params=params or {}):
+                    return agent.run(task, params)
         return {"error": f"no agent registered for task '{task}'",
                 "known_agents": list(self.agents.keys())}
@@ -0,0 +1,197 @@
+import csv
+import io
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+PARQUET_AVAILABLE = False
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except Exception:
+    pass
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _pages(docs: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    page: List[Dict[str, Any]] = []
+    for d in docs:
+        page.append(d)
+        if len(page) >= size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def iter_ndjson(docs: Iterable[Dict[str, Any]], fields: List[str] | None = None,
+                types: Dict[str, str] | None = None) -> Iterator[bytes]:
+    for d in docs:
+        yield (json.dumps(d, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def iter_csv(docs: Iterable[Dict[str, Any]], fields: List[str] | None = None,
+             types: Dict[str, str] | None = None) -> Iterator[bytes]:
+    # Colonnes : `fields`, sinon celles du mapping (`types`), sinon du premier document. Listes/objets en JSON.
+    buf = io.StringIO()
+    writer = None
+    for d in docs:
+        if writer is None:
+            writer = csv.writer(buf)
+            fields = fields or list(types or d.keys())
+            writer.writerow(fields)
+        writer.writerow(["" if d.get(f) is None else
+                         json.dumps(d.get(f), ensure_ascii=False) if isinstance(d.get(f), (list, dict)) else d.get(f)
+                         for f in fields])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+
+
+class _Drain(io.RawIOBase):
+    # Sink écrit par ParquetWriter et vidé après chaque row group
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self.chunks)
+        self.chunks.clear()
+        return out
+
+
+# Types de colonnes Parquet : mapping ES -> type d'export
+ES_TYPES = {
+    "keyword": "string", "text": "string", "match_only_text": "string", "wildcard": "string",
+    "constant_keyword": "string", "ip": "string", "date": "string", "date_nanos": "string",
+    "long": "int64", "integer": "int64", "short": "int64", "byte": "int64", "unsigned_long": "double",
+    "double": "double", "float": "double", "half_float": "double", "scaled_float": "double",
+    "boolean": "bool",
+}
+
+
+def export_types(mapping: Dict[str, str]) -> Dict[str, str]:
+    """
+    Types des champs de premier niveau d'un mapping condensé ({champ: type_es}) ; objets -> json.
+    Les sous-champs multi-fields (label.raw) n'existent pas dans _source et sont ignorés.
+    """
+    out: Dict[str, str] = {}
+    for path, es_type in mapping.items():
+        top = path.split(".", 1)[0]
+        if path == top:
+            out[top] = "json" if es_type in ("object", "nested", "geo_point", "geo_shape", "flattened") \
+                else ES_TYPES.get(es_type, "string")
+        elif top not in mapping:
+            out[top] = "json"
+    return out
+
+
+def _to_string(v: Any) -> Any:
+    if v is None or isinstance(v, str):
+        return v
+    return json.dumps(v, ensure_ascii=False, default=str) if isinstance(v, (list, dict)) else str(v)
+
+
+def _to_double(v: Any) -> Any:
+    if isinstance(v, list) and len(v) == 1:
+        v = v[0]
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        raise ValueError(v)
+
+
+def _to_int(v: Any) -> Any:
+    f = _to_double(v)
+    if not f.is_integer():
+        raise ValueError(v)
+    return int(f)
+
+
+def _to_bool(v: Any) -> Any:
+    if isinstance(v, list) and len(v) == 1:
+        v = v[0]
+    if isinstance(v, bool):
+        return v
+    if str(v).lower() in ("true", "false"):
+        return str(v).lower() == "true"
+    raise ValueError(v)
+
+
+COERCE: Dict[str, Callable[[Any], Any]] = {"string": _to_string, "json": _to_string, "double": _to_double,
+                                          "int64": _to_int, "bool": _to_bool}
+
+
+def _infer(values: List[Any]) -> str:
+    # Type d'une colonne sans type explicite, vu sur la première page ; prudent : double, jamais int64
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, bool) for v in present):
+        return "bool"
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return "double"
+    return "string"
+
+
+def iter_parquet(docs: Iterable[Dict[str, Any]], fields: List[str] | None = None,
+                 types: Dict[str, str] | None = None, row_group_size: int = 5000) -> Iterator[bytes]:
+    """
+    Un row group par page. Le schéma est fixé au premier row group : colonnes = `fields`, sinon `types`
+    (mapping ES, cf. export_types), sinon clés de la première page ; type explicite sinon inféré.
+    Chaque valeur est convertie au type de sa colonne ; une valeur inconvertible devient null (comptée).
+    """
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("pyarrow not installed. pip install pyarrow")
+    types = types or {}
+    arrow = {"string": pa.string(), "json": pa.string(), "double": pa.float64(),
+             "int64": pa.int64(), "bool": pa.bool_()}
+    sink = _Drain()
+    writer = None
+    columns: List[str] = []
+    kinds: List[str] = []
+    rejected = 0
+    for page in _pages(docs, row_group_size):
+        if writer is None:
+            columns = list(fields or types or dict.fromkeys(k for d in page for k in d))
+            kinds = [types.get(c) if types.get(c) in COERCE else _infer([d.get(c) for d in page]) for c in columns]
+            schema = pa.schema([pa.field(c, arrow[k]) for c, k in zip(columns, kinds)])
+            writer = pq.ParquetWriter(sink, schema)
+        data = {}
+        for c, k in zip(columns, kinds):
+            coerce, col = COERCE[k], []
+            for d in page:
+                v = d.get(c)
+                try:
+                    col.append(None if v is None else coerce(v))
+                except ValueError:
+                    col.append(None)
+                    rejected += 1
+            data[c] = col
+        writer.write_table(pa.Table.from_pydict(data, schema=schema))
+        yield sink.drain()
+    if rejected:
+        logger.warning("parquet export: %s valeurs inconvertibles écrites null", rejected)
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+WRITERS = {"ndjson": iter_ndjson, "csv": iter_csv, "parquet": iter_parquet}
@@ -0,0 +1,32 @@
+import json
+from typing import Any
+
+ORJSON_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    pass
+
+
+def dumps(obj: Any) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+def canonical(obj: Any) -> str:
+    # Clés triées : deux corps équivalents donnent la même chaîne (clés de cache / coalescing)
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS).decode("utf-8")
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def loads(data: bytes | str) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,34 @@
+from typing import Any, Dict, List
+
+
+def investment_filters(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Filtres communs sur `investment` : min_amount, currency_code, year_min / year_max (funded_year).
+    """
+    filters: List[Dict[str, Any]] = []
+    if "min_amount" in params:
+        filters.append({"range": {"raised_amount": {"gte": float(params["min_amount"])}}})
+    if "currency_code" in params:
+        filters.append({"term": {"raised_currency_code": str(params["currency_code"])}})
+    if "year_min" in params or "year_max" in params:
+        yr: Dict[str, Any] = {}
+        if "year_min" in params: yr["gte"] = int(params["year_min"])
+        if "year_max" in params: yr["lte"] = int(params["year_max"])
+        filters.append({"range": {"funded_year": yr}})
+    return filters
+
+
+def filter_query(filters: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"bool": {"filter": filters}} if filters else {"match_all": {}}
+
+
+def investment_query(params: Dict[str, Any]) -> Dict[str, Any]:
+    # es_query brute prioritaire ; sinon filtres communs + restriction éventuelle aux entreprises / investisseurs
+    if params.get("es_query"):
+        return params["es_query"]
+    filters = investment_filters(params)
+    if params.get("company_ids"):
+        filters.append({"terms": {"companies": list(params["company_ids"])}})
+    if params.get("investor_ids"):
+        filters.append({"terms": {"investors": list(params["investor_ids"])}})
+    return filter_query(filters)
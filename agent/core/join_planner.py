@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def query_shape(q: Any) -> Any:
+    """
+    Forme d'une requête ES sans ses valeurs : {"terms": {"companies": ["c1"]}} -> {"terms": {"companies": ["?"]}}.
+    """
+    if isinstance(q, dict):
+        return {k: query_shape(v) for k, v in sorted(q.items())}
+    if isinstance(q, list):
+        return [query_shape(q[0])] if q else []
+    return "?"
+
+
+class JoinPlanner:
+    """
+    Planificateur de jointures adaptatif. Pour chaque (parent_index, child_index, on, forme du filtre),
+    mesure latence, nombre de hits et taux de résultats vides de chaque stratégie (join Federate,
+    lookup deux phases en terms, index local...), puis choisit d'emblée celle au coût attendu le plus bas :
+    latence + taux_vide x latence de la meilleure alternative. Les stratégies peu mesurées sont
+    essayées dans l'ordre par défaut ; une exploration périodique garde les stats à jour.
+    Seules des stratégies au même ensemble de résultats sont mises en concurrence : les variantes
+    tronquées (lookup borné en terms...) passent en `fallbacks`, jamais classées, tentées seulement
+    si toutes les stratégies planifiées ont échoué ou sont revenues vides.
+    """
+    MIN_SAMPLES = 3
+    EXPLORE_EVERY = 20
+    ALPHA = 0.2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple, Dict[str, Dict[str, float]]] = {}
+        self._calls: Dict[Tuple, int] = {}
+
+    @staticmethod
+    def key(parent_index: str, child_index: str, on: List[str], es_query: Any) -> Tuple:
+        return (parent_index, child_index, tuple(on or []), json.dumps(query_shape(es_query), sort_keys=True))
+
+    def record(self, key: Tuple, strategy: str, latency_s: float, hits: int):
+        with self._lock:
+            st = self._stats.setdefault(key, {}).setdefault(strategy, {"n": 0, "latency": latency_s,
+                                                                        "hits": float(hits), "empty_rate": 0.0})
+            a = self.ALPHA if st["n"] else 1.0
+            st["n"] += 1
+            st["latency"] += a * (latency_s - st["latency"])
+            st["hits"] += a * (hits - st["hits"])
+            st["empty_rate"] += a * ((1.0 if hits == 0 else 0.0) - st["empty_rate"])
+
+    def order(self, key: Tuple, strategies: List[str]) -> List[str]:
+        with self._lock:
+            n_call = self._calls[key] = self._calls.get(key, 0) + 1
+            stats = {s: dict(v) for s, v in self._stats.get(key, {}).items() if s in strategies}
+        # Exploration : stratégie jamais/peu mesurée, ou rotation périodique
+        under = [s for s in strategies if stats.get(s, {}).get("n", 0) < self.MIN_SAMPLES]
+        if under:
+            return under[:1] + [s for s in strategies if s != under[0]]
+        if n_call % self.EXPLORE_EVERY == 0:
+            least = min(strategies, key=lambda s: stats[s]["n"])
+            return [least] + [s for s in strategies if s != least]
+
+        def expected_cost(s: str) -> float:
+            others = [stats[o]["latency"] for o in strategies if o != s]
+            return stats[s]["latency"] + stats[s]["empty_rate"] * (min(others) if others else 0.0)
+
+        first = min(strategies, key=expected_cost)
+        return [first] + [s for s in strategies if s != first]
+
+    def execute(self, key: Tuple, strategies: List[Tuple[str, Callable[[], Tuple[Any, int]]]],
+                fallbacks: List[Tuple[str, Callable[[], Tuple[Any, int]]]] = ()) -> Dict[str, Any]:
+        """
+        Exécute les stratégies (nom, fn -> (résultat, nb_hits)) dans l'ordre planifié puis les `fallbacks`
+        dans l'ordre donné, jusqu'à un résultat non vide.
+        Retourne {"result", "strategy", "tried"} ; `result` est celui de la dernière stratégie ayant abouti.
+        """
+        fns = {**dict(strategies), **dict(fallbacks)}
+        tried: List[str] = []
+        result: Any = None
+        used = None
+        error: Exception | None = None
+        planned = self.order(key, [s for s, _ in strategies]) if strategies else []
+        for name in planned + [s for s, _ in fallbacks]:
+            t0 = time.perf_counter()
+            tried.append(name)
+            try:
+                res, hits = fns[name]()
+            except Exception as e:
+                # Une stratégie en échec compte comme vide ; on passe à la suivante
+                self.record(key, name, time.perf_counter() - t0, 0)
+                error = e
+                continue
+            self.record(key, name, time.perf_counter() - t0, hits)
+            result, used = res, name
+            if hits > 0:
+                break
+        if used is None and error is not None:
+            raise error
+        return {"result": result, "strategy": used, "tried": tried}
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"parent_index": k[0], "child_index": k[1], "on": list(k[2]), "filter_shape": k[3],
+                     "strategies": {s: {m: round(v, 4) for m, v in st.items()} for s, st in by_s.items()}}
+                    for k, by_s in self._stats.items()]
+
+
+join_planner = JoinPlanner()
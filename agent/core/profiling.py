@@ -0,0 +1,234 @@
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List
+
+from . import fastjson
+from .cache import make_cache
+
+SLOW_ES_MS = float(os.getenv("SLOW_ES_MS", "1000"))
+SLOW_TASK_MS = float(os.getenv("SLOW_TASK_MS", "2000"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Garde-fou : un échantillonneur jamais arrêté (flux abandonné sans fermeture) s'arrête seul
+PROFILE_MAX_S = float(os.getenv("PROFILE_MAX_S", "300"))
+SLOW_LOG_MAX_BODY = 4000
+
+# Journal des opérations lentes (corps ES, took, paramètres de tâche), séparable via la config logging
+slow_logger = logging.getLogger("agent.slow")
+
+# Dumps consultables après coup (GET /debug/profiles/{id}), partagés entre workers si CACHE_BACKEND=sqlite
+profiles = make_cache("profiles", maxsize=100, ttl=1800)
+
+_current: ContextVar["RequestProfile | None"] = ContextVar("request_profile", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """
+    Échantillonne la pile Python des threads enregistrés toutes les `interval_s` secondes (sys._current_frames).
+    Les piles sont agrégées au format « collapsed » (a;b;c N) lu par flamegraph.pl / speedscope.
+    Les temps par fonction utilisent l'intervalle réellement écoulé entre deux échantillons (GIL).
+    """
+
+    def __init__(self, interval_s: float = 0.005, max_depth: int = 128, max_s: float = PROFILE_MAX_S):
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self.max_s = max_s
+        self.stacks: Counter = Counter()
+        self.stack_time: Counter = Counter()
+        self.samples = 0
+        self._threads: set = set()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add_thread(self, ident: int) -> bool:
+        # True si le thread n'était pas déjà suivi (à retirer par l'appelant)
+        if ident in self._threads:
+            return False
+        self._threads = self._threads | {ident}
+        return True
+
+    def remove_thread(self, ident: int):
+        self._threads = self._threads - {ident}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        start = last = time.perf_counter()
+        while not self._stop.wait(self.interval_s):
+            now = time.perf_counter()
+            if now - start > self.max_s:
+                return
+            dt, last = now - last, now
+            frames = sys._current_frames()
+            for ident in self._threads:
+                frame = frames.get(ident)
+                stack: List[str] = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    self.stacks[key] += 1
+                    self.stack_time[key] += dt
+                    self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common())
+
+    def functions(self, limit: int | None = 30) -> List[Dict[str, Any]]:
+        # Temps propre (haut de pile) et cumulé (présent dans la pile) par fonction
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, t in self.stack_time.items():
+            names = stack.split(";")
+            own[names[-1]] += t
+            for name in set(names):
+                total[name] += t
+        return [{"function": f, "total_ms": round(t * 1000, 1), "self_ms": round(own[f] * 1000, 1)}
+                for f, t in total.most_common(limit)]
+
+
+class RequestProfile:
+    """
+    Profil d'une requête : échantillonneur de pile + spans chronométrés (tâches, outils, appels ES).
+    """
+    MAX_SPANS = 500
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+        self.spans: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+
+    def add_span(self, name: str, elapsed_s: float, **attrs):
+        if len(self.spans) < self.MAX_SPANS:
+            start = time.perf_counter() - elapsed_s - self._t0
+            self.spans.append({"name": name, "start_ms": round(start * 1000, 1),
+                               "ms": round(elapsed_s * 1000, 1), **attrs})
+
+    def dump(self) -> Dict[str, Any]:
+        return {"id": self.id, "request": self.name,
+                "duration_ms": round((time.perf_counter() - self._t0) * 1000, 1),
+                "interval_ms": PROFILE_INTERVAL_MS, "samples": self.sampler.samples,
+                "spans": self.spans, "functions": self.sampler.functions(),
+                "collapsed": self.sampler.collapsed()}
+
+
+@contextmanager
+def profile_request(name: str):
+    """
+    Active le profilage pour le contexte courant (requête) ; le dump est stocké dans `profiles` en sortie.
+    """
+    prof = RequestProfile(name)
+    prof.sampler.add_thread(threading.get_ident())
+    token = _current.set(prof)
+    prof.sampler.start()
+    try:
+        yield prof
+    finally:
+        prof.sampler.stop()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Fermé depuis un autre contexte (fin d'un corps streamé)
+            _current.set(None)
+        profiles.set(prof.id, prof.dump())
+
+
+@contextmanager
+def profiled_thread():
+    """
+    Fait échantillonner le thread courant par le profil de la requête le temps du bloc
+    (threads du pool des endpoints sync, itération des corps streamés) ; sans profil, ne fait rien.
+    """
+    prof = _current.get()
+    ident = threading.get_ident()
+    added = prof is not None and prof.sampler.add_thread(ident)
+    try:
+        yield prof
+    finally:
+        if added:
+            prof.sampler.remove_thread(ident)
+
+
+def in_profiled_thread(fn: Callable) -> Callable:
+    # Endpoint sync exécuté dans le threadpool : thread enregistré dès le début de la requête
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profiled_thread():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def profiled_iter(it: Iterator) -> Iterator:
+    # Chaque pas d'un itérateur de corps streamé (exécuté dans le threadpool) est échantillonné
+    it = iter(it)
+    while True:
+        with profiled_thread():
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def _truncate(obj: Any) -> str:
+    text = obj if isinstance(obj, str) else fastjson.dumps_str(obj)
+    return text if len(text) <= SLOW_LOG_MAX_BODY else text[:SLOW_LOG_MAX_BODY] + "..."
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Chronomètre une tâche / un appel d'outil : span dans le profil courant et journal si > SLOW_TASK_MS.
+    """
+    t0 = time.perf_counter()
+    try:
+        with profiled_thread():
+            yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        prof = _current.get()
+        if prof is not None:
+            prof.add_span(name, elapsed, **{k: _truncate(v) for k, v in attrs.items()})
+        if elapsed * 1000 >= SLOW_TASK_MS:
+            slow_logger.warning("slow task %s %.0fms %s", name, elapsed * 1000,
+                                " ".join(f"{k}={_truncate(v)}" for k, v in attrs.items()))
+
+
+def record_es(method: str, path: str, body: Any, elapsed_s: float, res: Any, error: Any = None):
+    """
+    Appel ES terminé, réussi ou non : span dans le profil courant ; journal si l'appel a échoué
+    ou si la latence ou le `took` dépasse SLOW_ES_MS.
+    """
+    took = res.get("took") if isinstance(res, dict) else None
+    prof = _current.get()
+    if prof is not None:
+        attrs = {"took": took} if error is None else {"took": took, "error": _truncate(str(error))}
+        prof.add_span(f"es {method} {path.split('?', 1)[0]}", elapsed_s, **attrs)
+    if error is not None:
+        slow_logger.warning("failed ES %s %s %.0fms error=%s body=%s", method, path, elapsed_s * 1000,
+                            _truncate(str(error)), _truncate(body) if body is not None else "-")
+    elif elapsed_s * 1000 >= SLOW_ES_MS or (took or 0) >= SLOW_ES_MS:
+        slow_logger.warning("slow ES %s %s %.0fms took=%s body=%s", method, path, elapsed_s * 1000, took,
+                            _truncate(body) if body is not None else "-")
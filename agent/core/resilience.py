@@ -0,0 +1,274 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable
+
+import requests
+
+from .cache import TTLCache
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def query_shape(body: Any) -> str | None:
+    """
+    Forme d'une requête _search pour les clés de latence : les agrégations et les grosses pages
+    n'apprennent pas leurs timeouts des lectures légères sur le même path.
+    """
+    if not isinstance(body, dict):
+        return None
+    if body.get("aggs") or body.get("aggregations"):
+        return "aggs"
+    size = body.get("size", 10)
+    if size == 0:
+        return "count"
+    return "hits" if isinstance(size, int) and size <= 100 else "page"
+
+
+class LatencyTracker:
+    """
+    Latences récentes par endpoint, fenêtre glissante : succès, et timeouts comptés à leur durée
+    (borne basse de la vraie latence) pour ne pas biaiser les percentiles vers le bas.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, latency_s: float):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(latency_s)
+
+    def percentile(self, endpoint: str, p: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            endpoints = list(self._samples)
+        out = {}
+        for ep in endpoints:
+            p50, p95, p99 = (self.percentile(ep, p) for p in (50, 95, 99))
+            if p50 is not None:
+                out[ep] = {"p50": round(p50, 4), "p95": round(p95, 4), "p99": round(p99, 4)}
+        return out
+
+
+class CircuitBreaker:
+    """
+    closed -> open après `threshold` échecs consécutifs ; open -> half_open après `cooldown_s` ;
+    en half_open un seul appel d'essai passe, son résultat referme ou rouvre le circuit.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown_s: float = 30):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown_s:
+                self.state = "half_open"
+                self._trial = False
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return False
+
+
+class ResilientCaller:
+    """
+    Couche de résilience des appels ES :
+    - timeouts adaptatifs par endpoint (p99 x facteur, bornés par le timeout demandé), désactivables par appel ;
+    - requêtes dupliquées (hedging) pour les lectures quand la p95 de l'endpoint est dépassée : la première
+      tentative n'utilise le pool que si un créneau de hedge est libre (au plus pool_size // 2 en vol),
+      sinon elle s'exécute dans le thread appelant sans hedge ;
+    - retries bornés avec backoff exponentiel + jitter (lectures, erreurs réseau/5xx/429) ; un seul hedge par
+      appel (première tentative), dont l'envoi compte dans le budget de 1 + retries envois ; un timeout dû au
+      plafond adaptatif n'est repris qu'une fois, au timeout demandé et sans hedge ;
+    - circuit breaker : échec immédiat quand ES est en panne, en servant si possible la dernière réponse connue.
+    """
+
+    def __init__(self, retries: int = 2, hedge: bool = True, breaker_threshold: int = 5,
+                 breaker_cooldown_s: float = 30, min_timeout_s: float = 2, timeout_factor: float = 3,
+                 backoff_s: float = 0.2, pool_size: int = 8, stale_size: int = 500, stale_ttl: float = 3600,
+                 stale_cache: Any = None, stale_refresh_s: float = 60):
+        self.retries = retries
+        self.hedge = hedge
+        self.min_timeout_s = min_timeout_s
+        self.timeout_factor = timeout_factor
+        self.backoff_s = backoff_s
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown_s)
+        # `stale_cache` : cache partagé entre workers (make_cache), sinon mémoire locale
+        self.stale = stale_cache if stale_cache is not None else TTLCache(maxsize=stale_size, ttl=stale_ttl)
+        # Clés écrites récemment dans `stale` : au plus une écriture par clé et par `stale_refresh_s`
+        # (le cache partagé est une écriture SQLite, pas à refaire à chaque lecture)
+        self._stale_fresh = TTLCache(maxsize=stale_size, ttl=stale_refresh_s)
+        # Chaque appel hedgé occupe au plus deux workers : un créneau libre garantit un départ sans file d'attente
+        self._pool = ThreadPoolExecutor(max_workers=2 * max(1, pool_size // 2), thread_name_prefix="es-hedge")
+        self._hedge_slots = threading.BoundedSemaphore(max(1, pool_size // 2))
+        self._lock = threading.Lock()
+        self._counters = {"retries": 0, "hedged": 0, "hedge_wins": 0, "hedge_skipped": 0, "stale_served": 0,
+                          "fast_failed": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def timeout_for(self, endpoint: str, requested: float) -> float:
+        p99 = self.latency.percentile(endpoint, 99)
+        if p99 is None:
+            return requested
+        return min(requested, max(self.min_timeout_s, p99 * self.timeout_factor))
+
+    def _timed(self, endpoint: str, send: Callable[[float], Any], timeout: float) -> Any:
+        t0 = time.perf_counter()
+        try:
+            res = send(timeout)
+        except requests.Timeout:
+            self.latency.add(endpoint, time.perf_counter() - t0)
+            raise
+        self.latency.add(endpoint, time.perf_counter() - t0)
+        return res
+
+    def _release_after(self, futures: list):
+        # Le créneau reste pris tant qu'une tentative (même perdante) occupe un worker
+        left = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                left[0] -= 1
+                last = left[0] == 0
+            if last:
+                self._hedge_slots.release()
+        for f in futures:
+            f.add_done_callback(done)
+
+    def _attempt(self, endpoint: str, send: Callable[[float], Any], timeout: float, hedge: bool,
+                 spent: list) -> Any:
+        # `spent[0]` : envois HTTP de l'appel, hedge compris
+        delay = self.latency.percentile(endpoint, 95) if hedge and self.hedge else None
+        spent[0] += 1
+        if delay is None:
+            return self._timed(endpoint, send, timeout)
+        if not self._hedge_slots.acquire(blocking=False):
+            self._count("hedge_skipped")
+            return self._timed(endpoint, send, timeout)
+        first = self._pool.submit(self._timed, endpoint, send, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            self._release_after([first])
+            return first.result()
+        self._count("hedged")
+        spent[0] += 1
+        second = self._pool.submit(self._timed, endpoint, send, timeout)
+        self._release_after([first, second])
+        pending = {first, second}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is second:
+                        self._count("hedge_wins")
+                    # Le perdant n'est pas attendu ; une requête HTTP partie ne peut pas être interrompue
+                    for loser in pending:
+                        loser.cancel()
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def call(self, endpoint: str, send: Callable[[float], Any], timeout: float,
+             idempotent: bool = True, stale_key: Hashable | None = None, adaptive: bool = True) -> Any:
+        """
+        `send(timeout)` effectue la requête HTTP et lève une exception requests en cas d'échec.
+        `adaptive=False` : timeout demandé tel quel (requêtes lourdes ou atypiques pour leur endpoint).
+        Les écritures (idempotent=False) gardent aussi le timeout demandé : sans retry, un plafond ne ferait
+        que transformer une écriture lente en erreur.
+        """
+        if not self.breaker.allow():
+            self._count("fast_failed")
+            return self._serve_stale(stale_key, CircuitOpenError(f"circuit open for ES ({endpoint})"))
+
+        budget = 1 + (self.retries if idempotent else 0)
+        capped = adaptive and idempotent
+        spent = [0]
+        last: Exception | None = None
+        i = 0
+        while spent[0] < budget:
+            # Le timeout adaptatif double à chaque retry, sans dépasser le timeout demandé
+            t = min(timeout, self.timeout_for(endpoint, timeout) * 2 ** i) if capped else timeout
+            try:
+                res = self._attempt(endpoint, send, t, idempotent and i == 0, spent)
+            except Exception as e:
+                last = e
+                if not _retryable(e):
+                    # Erreur client (4xx...) : ES répond, le circuit reste fermé
+                    self.breaker.success()
+                    raise
+                if isinstance(e, requests.Timeout) and t < timeout:
+                    # Coupée par le plafond appris, la requête est peut-être seulement lente : une dernière
+                    # tentative au timeout demandé plutôt que des retries (et hedges) plafonnés
+                    capped = False
+                    budget = spent[0] + 1
+                if spent[0] < budget:
+                    self._count("retries")
+                    time.sleep(random.uniform(0, self.backoff_s * (2 ** i)))
+                i += 1
+                continue
+            self.breaker.success()
+            if stale_key is not None and self._stale_fresh.get(stale_key) is None:
+                self.stale.set(stale_key, res)
+                self._stale_fresh.set(stale_key, True)
+            return res
+        self.breaker.failure()
+        return self._serve_stale(stale_key, last)
+
+    def _serve_stale(self, stale_key: Hashable | None, error: Exception) -> Any:
+        res = self.stale.get(stale_key) if stale_key is not None else None
+        if res is None:
+            raise error
+        self._count("stale_served")
+        return {**res, "_stale": True} if isinstance(res, dict) else res
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {**counters, "breaker": self.breaker.state, "latency": self.latency.summary()}
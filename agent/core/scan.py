@@ -0,0 +1,60 @@
+import logging
+from typing import Any, Callable, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+# Fermeture des PIT (DELETE /_pit), enregistrée par l'application : es_post ne sait pas faire de DELETE
+_pit_closer: Callable[[str], Any] | None = None
+
+
+def set_pit_closer(close: Callable[[str], Any] | None):
+    global _pit_closer
+    _pit_closer = close
+
+
+def _close_pit(pit: str | None, close: Callable[[str], Any] | None):
+    close = close or _pit_closer
+    if not pit or close is None:
+        return
+    try:
+        close(pit)
+    except Exception as e:
+        # Le PIT expirera seul (keep_alive) : un échec de fermeture ne doit pas masquer le résultat
+        logger.warning("closing PIT failed: %s", getattr(e, "detail", e))
+
+
+def scan_hits(es_post: Callable, index: str, query: Dict[str, Any] | None = None,
+              source: List[str] | bool | None = None, page_size: int = 1000,
+              keep_alive: str = "2m", search_path: str = "/_search",
+              close_pit: Callable[[str], Any] | None = None) -> Iterator[Dict[str, Any]]:
+    """
+    Parcourt tous les documents d'un index via PIT + search_after, page par page.
+    Mémoire constante : une seule page est tenue à la fois.
+    search_path="/siren/_search" permet de paginer une requête join Federate sur l'index parent.
+    Le PIT est fermé en sortie, y compris sur arrêt anticipé du consommateur (break, limite, client
+    déconnecté : fermeture du générateur) par `close_pit`, sinon par la fonction de set_pit_closer ;
+    sans l'une ni l'autre il expire seul (keep_alive).
+    """
+    pit = es_post(f"/{index}/_pit?keep_alive={keep_alive}").get("id")
+    body: Dict[str, Any] = {
+        "size": page_size,
+        "query": query or {"match_all": {}},
+        "pit": {"id": pit, "keep_alive": keep_alive},
+        "sort": [{"_shard_doc": "asc"}],
+        "track_total_hits": False,
+    }
+    if source is not None:
+        body["_source"] = source
+    try:
+        while True:
+            res = es_post(search_path, json=body)
+            body["pit"]["id"] = res.get("pit_id") or body["pit"]["id"]
+            hits = res.get("hits", {}).get("hits", []) or []
+            if not hits:
+                return
+            yield from hits
+            if len(hits) < page_size:
+                return
+            body["search_after"] = hits[-1].get("sort")
+    finally:
+        _close_pit(body["pit"]["id"], close_pit)
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def condense_mapping(mapping: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Aplati un mapping ES en {champ: type}, sous-champs inclus (ex: label.raw: keyword).
+    """
+    out: Dict[str, str] = {}
+
+    def walk(props: Dict[str, Any], prefix: str):
+        for name, spec in (props or {}).items():
+            path = f"{prefix}{name}"
+            if "properties" in spec:
+                walk(spec["properties"], f"{path}.")
+                continue
+            out[path] = spec.get("type", "object")
+            for sub, sspec in (spec.get("fields") or {}).items():
+                out[f"{path}.{sub}"] = sspec.get("type", "object")
+
+    for idx_body in mapping.values():
+        walk((idx_body.get("mappings") or {}).get("properties") or {}, "")
+    return out
+
+
+class SchemaCache:
+    """
+    Cache des indices (/_cat/indices) et des mappings condensés, rafraîchi périodiquement
+    en tâche de fond. Sert les outils graph_indices / graph_mapping et le prompt SYSTEM.
+    """
+
+    def __init__(self, es_get: Callable, indices: List[str], refresh_s: float = 300):
+        self.es_get = es_get
+        self.prompt_indices = indices
+        self.refresh_s = refresh_s
+        self._cat: List[Dict[str, Any]] | None = None
+        self._mappings: Dict[str, Dict[str, str]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def refresh(self):
+        cat = self.es_get("/_cat/indices?format=json", timeout=15)
+        mappings = {}
+        for idx in self.prompt_indices:
+            try:
+                mappings[idx] = condense_mapping(self.es_get(f"/{idx}/_mapping", timeout=30))
+            except Exception as e:
+                logger.warning("mapping %s unavailable: %s", idx, e)
+        with self._lock:
+            self._cat = cat
+            self._mappings.update(mappings)
+            self._loaded_at = time.time()
+
+    def cat_indices(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            cat = self._cat
+        if cat is None:
+            cat = self.es_get("/_cat/indices?format=json", timeout=15)
+            with self._lock:
+                self._cat = cat
+        return cat
+
+    def indices(self) -> List[Dict[str, Any]]:
+        # Vue condensée pour le LLM : indices utilisateur + nombre de documents
+        return [{"index": i.get("index"), "docs": i.get("docs.count")}
+                for i in self.cat_indices() if not str(i.get("index", "")).startswith(".")]
+
+    def mapping(self, index: str) -> Dict[str, str]:
+        with self._lock:
+            m = self._mappings.get(index)
+        if m is None:
+            m = condense_mapping(self.es_get(f"/{index}/_mapping", timeout=30))
+            with self._lock:
+                self._mappings[index] = m
+        return m
+
+    def prompt_text(self) -> str:
+        with self._lock:
+            mappings = {i: self._mappings[i] for i in self.prompt_indices if i in self._mappings}
+        if not mappings:
+            return ""
+        lines = [f"- {idx}: " + ", ".join(f"{f}({t})" for f, t in fields.items())
+                 for idx, fields in mappings.items()]
+        return "Schéma (inutile d'appeler graph_indices/graph_mapping pour ces indices) :\n" + "\n".join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"loaded_at": self._loaded_at, "mappings": sorted(self._mappings)}
+
+    # ---------- rafraîchissement périodique ----------
+    def _loop(self):
+        while not self._stop.wait(self.refresh_s):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("schema refresh failed: %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="schema-cache", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
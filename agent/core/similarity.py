@@ -0,0 +1,251 @@
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from .scan import scan_hits
+
+SIMILARITY_DIR = os.getenv("SIMILARITY_INDEX_DIR", ".similarity_index")
+
+
+def _hash(token: str, dim: int) -> int:
+    # crc32 : stable entre processus (contrairement à hash())
+    return zlib.crc32(token.encode("utf-8")) % dim
+
+
+def company_tokens(doc: Dict[str, Any], investors: Iterable[str] = ()) -> List[Tuple[str, float]]:
+    """
+    Features pondérées d'une entreprise : n-grammes de caractères du label, ville, pays,
+    catégorie et ensemble des investisseurs.
+    """
+    out: List[Tuple[str, float]] = []
+    label = f" {(doc.get('label') or '').lower().strip()} "
+    for i in range(len(label) - 2):
+        out.append((f"lbl:{label[i:i + 3]}", 1.0))
+    if doc.get("city"):
+        out.append((f"city:{str(doc['city']).lower()}", 2.0))
+    if doc.get("countrycode"):
+        out.append((f"cc:{str(doc['countrycode']).lower()}", 1.0))
+    if doc.get("category_code"):
+        out.append((f"cat:{str(doc['category_code']).lower()}", 3.0))
+    for iid in investors:
+        out.append((f"inv:{iid}", 2.0))
+    return out
+
+
+class SimilarityIndex:
+    """
+    Index local de similarité (OP5) : vecteurs TF-IDF hachés L2-normalisés dans une matrice NumPy
+    (mémoire mappée au chargement), top-k cosinus par produits matriciels, partition IVF optionnelle
+    (k-means sphérique) pour ne scorer que les listes les plus proches.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], labels: List[str | None], idf: np.ndarray,
+                 centroids: np.ndarray | None = None, assign: np.ndarray | None = None):
+        self.vectors = vectors
+        self.ids = ids
+        self.labels = labels
+        self.idf = idf
+        self.centroids = centroids
+        self.assign = assign
+        self.row_of = {cid: i for i, cid in enumerate(ids)}
+        self._lists = None
+        if centroids is not None and assign is not None:
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(centroids))]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    # ---------- construction ----------
+    @staticmethod
+    def _normalize(m: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return m / norms
+
+    @classmethod
+    def from_tokens(cls, ids: List[str], labels: List[str | None], tokens: List[List[Tuple[str, float]]],
+                    dim: int = 1024, n_lists: int = 0, seed: int = 0,
+                    chunk_rows: int = 4096) -> "SimilarityIndex":
+        # Triplets (ligne, colonne, poids) compacts ; seule la matrice finale est dense (pas de tf ni de copies)
+        n = len(ids)
+        rows, cols, vals = array("q"), array("q"), array("f")
+        for r, toks in enumerate(tokens):
+            for tok, w in toks:
+                rows.append(r); cols.append(_hash(tok, dim)); vals.append(w)
+        rows, cols = np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64)
+        vals = np.frombuffer(vals, dtype=np.float32)
+        # df : couples (ligne, colonne) distincts par colonne
+        df = np.bincount(np.unique(rows * dim + cols) % dim, minlength=dim)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        vectors = np.zeros((n, dim), dtype=np.float32)
+        # Lignes remplies, pondérées et normalisées par blocs (rows est croissant)
+        bounds = np.searchsorted(rows, np.arange(0, n + chunk_rows, chunk_rows))
+        for c, start in enumerate(range(0, n, chunk_rows)):
+            lo, hi = bounds[c], bounds[c + 1]
+            block = vectors[start:start + chunk_rows]
+            np.add.at(block, (rows[lo:hi] - start, cols[lo:hi]), vals[lo:hi])
+            block *= idf
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            block /= norms
+        centroids = assign = None
+        if n_lists and n > n_lists:
+            centroids, assign = cls._kmeans(vectors, n_lists, seed)
+        return cls(vectors, ids, labels, idf, centroids, assign)
+
+    @classmethod
+    def _kmeans(cls, x: np.ndarray, k: int, seed: int, iters: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(seed)
+        centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+        assign = np.zeros(len(x), dtype=np.int32)
+        for _ in range(iters):
+            assign = np.argmax(x @ centroids.T, axis=1).astype(np.int32)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, x)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = cls._normalize(sums)
+        return centroids.astype(np.float32), assign
+
+    def embed(self, tokens: List[Tuple[str, float]]) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for tok, w in tokens:
+            v[_hash(tok, self.dim)] += w
+        v *= self.idf
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    # ---------- requêtes ----------
+    def search(self, queries: np.ndarray, k: int = 10, n_probe: int = 4,
+               exclude: List[int | None] | None = None) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k cosinus pour un lot de requêtes (m x dim). `exclude[i]` : ligne à ignorer pour la requête i.
+        """
+        queries = np.atleast_2d(queries).astype(np.float32)
+        out: List[List[Tuple[int, float]]] = []
+        if self._lists is not None:
+            probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+        for start in range(0, len(queries), 256):
+            block = queries[start:start + 256]
+            # Index plat : un seul produit matriciel par bloc de requêtes
+            flat = block @ self.vectors.T if self._lists is None else None
+            for j, q in enumerate(block):
+                i = start + j
+                if flat is not None:
+                    cand, scores = None, flat[j]
+                else:
+                    cand = np.concatenate([self._lists[c] for c in probes[i]])
+                    scores = self.vectors[cand] @ q
+                if exclude and exclude[i] is not None:
+                    mask = (cand == exclude[i]) if cand is not None else (np.arange(len(scores)) == exclude[i])
+                    scores = np.where(mask, -np.inf, scores)
+                kk = min(k, len(scores))
+                if kk == 0:
+                    out.append([])
+                    continue
+                top = np.argpartition(-scores, kk - 1)[:kk]
+                top = top[np.argsort(-scores[top])]
+                rows = cand[top] if cand is not None else top
+                out.append([(int(r), float(scores[t])) for r, t in zip(rows, top) if np.isfinite(scores[t])])
+        return out
+
+    # ---------- persistance ----------
+    def save(self, path: str = SIMILARITY_DIR):
+        """
+        Écrit une nouvelle version dans un répertoire à part puis bascule le pointeur CURRENT (os.replace) :
+        les workers qui ont mappé l'ancienne version la gardent intacte, aucun ne voit un mélange des deux.
+        """
+        os.makedirs(path, exist_ok=True)
+        version = f"v-{time.time_ns()}-{os.getpid()}"
+        tmp = os.path.join(path, f".{version}.tmp")
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "vectors.npy"), self.vectors)
+        np.save(os.path.join(tmp, "idf.npy"), self.idf)
+        if self.centroids is not None and self.assign is not None:
+            np.save(os.path.join(tmp, "centroids.npy"), self.centroids)
+            np.save(os.path.join(tmp, "assign.npy"), self.assign)
+        with open(os.path.join(tmp, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "labels": self.labels}, f)
+        os.replace(tmp, os.path.join(path, version))
+        pointer = os.path.join(path, f".CURRENT.{version}")
+        with open(pointer, "w", encoding="utf-8") as f:
+            f.write(version)
+        previous = _current_dir(path)
+        os.replace(pointer, os.path.join(path, "CURRENT"))
+        # On garde la version précédente (un worker peut être en train de la charger), on purge les autres
+        keep = {version, os.path.basename(previous) if previous else None}
+        for name in os.listdir(path):
+            if name.startswith("v-") and name not in keep:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str = SIMILARITY_DIR) -> "SimilarityIndex":
+        path = _current_dir(path) or path
+        with open(os.path.join(path, "ids.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        centroids = assign = None
+        if os.path.exists(os.path.join(path, "centroids.npy")):
+            centroids = np.load(os.path.join(path, "centroids.npy"))
+            assign = np.load(os.path.join(path, "assign.npy"))
+        return cls(np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"), meta["ids"], meta["labels"],
+                   np.load(os.path.join(path, "idf.npy")), centroids, assign)
+
+
+def _current_dir(path: str) -> str | None:
+    # Version courante désignée par CURRENT ; à défaut, ancien format (fichiers directement dans path)
+    try:
+        with open(os.path.join(path, "CURRENT"), encoding="utf-8") as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return path if os.path.exists(os.path.join(path, "ids.json")) else None
+
+
+def build_company_index(es_post: Callable, dim: int = 1024, n_lists: int = 0,
+                        path: str = SIMILARITY_DIR) -> SimilarityIndex:
+    # Ensembles d'investisseurs par entreprise (scan investment), puis une passe sur company
+    investors: Dict[str, set] = {}
+    for h in scan_hits(es_post, "investment", source=["companies", "investors"]):
+        s = h.get("_source", {})
+        for cid in s.get("companies") or []:
+            investors.setdefault(cid, set()).update(s.get("investors") or [])
+    ids, labels, tokens = [], [], []
+    for h in scan_hits(es_post, "company", source=["id", "label", "city", "countrycode", "category_code"]):
+        s = h.get("_source", {})
+        cid = s.get("id")
+        if not cid:
+            continue
+        ids.append(cid)
+        labels.append(s.get("label"))
+        tokens.append(company_tokens(s, sorted(investors.get(cid, ()))))
+    index = SimilarityIndex.from_tokens(ids, labels, tokens, dim=dim, n_lists=n_lists)
+    index.save(path)
+    _loaded.pop(path, None)
+    return index
+
+
+_loaded: Dict[str, Tuple[Tuple[str, float], SimilarityIndex]] = {}
+_load_lock = threading.Lock()
+
+
+def get_index(path: str = SIMILARITY_DIR) -> SimilarityIndex | None:
+    # Chargé une fois par processus, rechargé quand CURRENT désigne une nouvelle version
+    current = _current_dir(path)
+    if current is None:
+        return None
+    version = (current, os.path.getmtime(os.path.join(current, "ids.json")))
+    with _load_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != version:
+            cached = (version, SimilarityIndex.load(current))
+            _loaded[path] = cached
+        return cached[1]
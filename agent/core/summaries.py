@@ -0,0 +1,281 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List
+
+from dateutil import parser as dateparser
+
+from .scan import scan_hits
+
+COMPANY_SUMMARY_INDEX = "company_summary"
+INVESTOR_SUMMARY_INDEX = "investor_summary"
+SUMMARY_STATE_INDEX = "summary_state"
+# Entités référencées par chaque investissement lors du dernier passage (_id = id de l'investissement)
+SUMMARY_REFS_INDEX = "summary_refs"
+INGEST_PIPELINE = "summary_ingested_at"
+MARK_FIELD = os.getenv("SUMMARY_MARK_FIELD", "ingested_at")
+# Marge sous l'horloge ES : les documents pas encore visibles (refresh) restent pour le passage suivant
+MARK_LAG_S = float(os.getenv("SUMMARY_MARK_LAG_S", "60"))
+
+
+def _ts(v: Any) -> datetime | None:
+    # Horodatages ES (nanosecondes possibles) comparés en datetime, pas en chaînes
+    if not v:
+        return None
+    d = dateparser.isoparse(str(v))
+    return d if d.tzinfo else d.replace(tzinfo=timezone.utc)
+
+
+class SummaryMaterializer:
+    """
+    Matérialise des résumés dénormalisés par entreprise et par investisseur à partir de `investment` :
+    montants cumulés par devise, nombre de tours, premier/dernier funded_date, entités liées distinctes.
+    Pour un investisseur, les montants sont ceux des tours auxquels il a participé.
+
+    Rafraîchissement incrémental sur un horodatage d'ingestion (MARK_FIELD, posé par le pipeline
+    INGEST_PIPELINE, cf. setup_ingest) et non sur funded_date : les tours rétro-datés sont vus.
+    Chaque passage couvre ]mark, maintenant_ES - MARK_LAG_S] : les entités touchées par les investissements
+    nouveaux ou ré-indexés (anciennes références lues dans SUMMARY_REFS_INDEX comprises) sont recalculées
+    entièrement depuis `investment`. Un passage rejoué (écritures bulk en échec, mark non avancé) est donc
+    idempotent et une correction ne recompte rien. `full=True` reconstruit tout, documents sans horodatage
+    compris, en agrégeant par entité au fil du scan.
+    """
+    SOURCE = ["id", "companies", "investors", "raised_amount", "raised_currency_code", "funded_date", MARK_FIELD]
+    # index résumé -> (champ entité dans investment, champ lié, compteur du champ lié, champ montant, index des labels)
+    TARGETS = {
+        COMPANY_SUMMARY_INDEX: ("companies", "investors", "investor_count", "total_raised", "company"),
+        INVESTOR_SUMMARY_INDEX: ("investors", "companies", "company_count", "total_invested", "investor"),
+    }
+
+    def __init__(self, es_get: Callable, es_post: Callable, bulk_size: int = 500, es_put: Callable | None = None):
+        self.es_get = es_get
+        self.es_post = es_post
+        self.es_put = es_put
+        self.bulk_size = bulk_size
+        self._errors = 0
+
+    # ---------- ingestion ----------
+    @staticmethod
+    def pipeline_body() -> Dict[str, Any]:
+        return {"description": "horodatage d'ingestion pour les résumés incrémentaux",
+                "processors": [{"set": {"field": MARK_FIELD, "value": "{{{_ingest.timestamp}}}"}}]}
+
+    def setup_ingest(self) -> Dict[str, Any]:
+        """
+        Installe le pipeline d'horodatage comme final_pipeline de `investment` : il s'exécute après le
+        default_pipeline ou le pipeline de la requête, qui restent intacts. Un final_pipeline déjà posé
+        n'est jamais remplacé. Les documents déjà indexés n'ont pas d'horodatage : lancer ensuite un refresh full.
+        """
+        if self.es_put is None:
+            return {"error": "setup_ingest needs es_put"}
+        res = self.es_get("/investment/_settings/index.final_pipeline")
+        current = {(idx.get("settings", {}).get("index", {}) or {}).get("final_pipeline")
+                   for idx in (res or {}).values() if isinstance(idx, dict)} - {None, "_none"}
+        if current - {INGEST_PIPELINE}:
+            return {"error": f"investment already has final_pipeline {sorted(current)}; add a set processor "
+                             f"for {MARK_FIELD} ({{{{_ingest.timestamp}}}}) to it instead"}
+        self.es_put(f"/_ingest/pipeline/{INGEST_PIPELINE}", json=self.pipeline_body())
+        self.es_put("/investment/_settings", json={"index": {"final_pipeline": INGEST_PIPELINE}})
+        return {"summary": f"pipeline {INGEST_PIPELINE} installé en final_pipeline sur investment ({MARK_FIELD})."}
+
+    def _es_now(self) -> datetime:
+        # Horloge ES (celle qui horodate l'ingestion), via une simulation du pipeline
+        res = self.es_post("/_ingest/pipeline/_simulate",
+                           json={"pipeline": self.pipeline_body(), "docs": [{"_source": {}}]})
+        return _ts(res["docs"][0]["doc"]["_source"][MARK_FIELD])
+
+    # ---------- état ----------
+    def _load_hwm(self) -> str | None:
+        res = self.es_post(f"/{SUMMARY_STATE_INDEX}/_search?ignore_unavailable=true",
+                           json={"size": 1, "query": {"ids": {"values": ["investment"]}}})
+        hits = res.get("hits", {}).get("hits", []) or []
+        return hits[0].get("_source", {}).get("high_water_mark") if hits else None
+
+    def _save_hwm(self, hwm: str | None, stats: Dict[str, Any]):
+        doc = {"high_water_mark": hwm, "updated_at": datetime.now(timezone.utc).isoformat(), **stats}
+        self._bulk([({"index": {"_index": SUMMARY_STATE_INDEX, "_id": "investment"}}, doc)])
+
+    # ---------- I/O ----------
+    def _bulk(self, actions: Iterable[tuple]) -> int:
+        errors = 0
+        batch: List[str] = []
+
+        def flush():
+            nonlocal errors
+            if not batch:
+                return
+            res = self.es_post("/_bulk", data="\n".join(batch) + "\n",
+                               headers={"Content-Type": "application/x-ndjson"})
+            if res.get("errors"):
+                errors += sum(1 for it in res.get("items", []) or []
+                              if next(iter(it.values()), {}).get("error"))
+            batch.clear()
+
+        for meta, doc in actions:
+            batch.append(json.dumps(meta))
+            if doc is not None:
+                # doc None : action sans corps (delete)
+                batch.append(json.dumps(doc, default=str))
+            if len(batch) >= 2 * self.bulk_size:
+                flush()
+        flush()
+        return errors
+
+    def _fetch_by_ids(self, index: str, ids: List[str], source: List[str] | None = None,
+                      doc_ids: bool = False) -> Dict[str, Dict[str, Any]]:
+        # doc_ids=True : les résumés sont indexés avec _id = id de l'entité
+        out: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(ids), 1000):
+            chunk = ids[i:i + 1000]
+            q = {"ids": {"values": chunk}} if doc_ids else {"terms": {"id": chunk}}
+            body: Dict[str, Any] = {"size": len(chunk), "query": q}
+            if source is not None:
+                body["_source"] = source
+            res = self.es_post(f"/{index}/_search?ignore_unavailable=true", json=body)
+            for h in res.get("hits", {}).get("hits", []) or []:
+                s = h.get("_source", {})
+                out[s.get("id")] = s
+        return out
+
+    # ---------- agrégation ----------
+    @staticmethod
+    def _accumulate(acc: Dict[str, Dict[str, Any]], key: str, linked: List[str],
+                    amount: Any, currency: Any, date: Any):
+        d = acc.setdefault(key, {"raised": {}, "deal_count": 0, "first": None, "last": None, "linked": set()})
+        d["deal_count"] += 1
+        if amount is not None and currency:
+            d["raised"][currency] = d["raised"].get(currency, 0.0) + float(amount)
+        if date:
+            d["first"] = date if d["first"] is None or date < d["first"] else d["first"]
+            d["last"] = date if d["last"] is None or date > d["last"] else d["last"]
+        d["linked"].update(linked)
+
+    @staticmethod
+    def _merge(existing: Dict[str, Any] | None, delta: Dict[str, Any], linked_field: str, count_field: str,
+               total_field: str) -> Dict[str, Any]:
+        existing = existing or {}
+        totals = dict(existing.get(total_field) or {})
+        for cur, amt in delta["raised"].items():
+            totals[cur] = totals.get(cur, 0.0) + amt
+        linked = set(existing.get(linked_field) or []) | delta["linked"]
+        firsts = [d for d in (existing.get("first_funded_date"), delta["first"]) if d]
+        lasts = [d for d in (existing.get("last_funded_date"), delta["last"]) if d]
+        return {
+            total_field: totals,
+            "deal_count": int(existing.get("deal_count") or 0) + delta["deal_count"],
+            "first_funded_date": min(firsts) if firsts else None,
+            "last_funded_date": max(lasts) if lasts else None,
+            linked_field: sorted(linked),
+            count_field: len(linked),
+        }
+
+    def _entity_docs(self, acc: Dict[str, Dict[str, Any]], ids: Iterable[str], index: str,
+                     now: str) -> Iterable[tuple]:
+        # Résumés remplacés en entier ; entité sans plus aucun investissement -> résumé supprimé
+        _, linked_field, count_field, total_field, label_index = self.TARGETS[index]
+        ids = list(ids)
+        labels = self._fetch_by_ids(label_index, ids, source=["id", "label"])
+        for eid in ids:
+            if eid not in acc:
+                yield {"delete": {"_index": index, "_id": eid}}, None
+                continue
+            doc = self._merge(None, acc[eid], linked_field, count_field, total_field)
+            doc.update({"id": eid, "label": (labels.get(eid) or {}).get("label"), "updated_at": now})
+            yield {"index": {"_index": index, "_id": eid}}, doc
+
+    def _scan(self, query: Dict[str, Any], accs: Dict[str, Dict[str, Dict[str, Any]]] | None,
+              only: Dict[str, set] | None = None, refs: Dict[str, Dict[str, Any]] | None = None,
+              stats: Dict[str, int] | None = None) -> Iterable[tuple]:
+        """
+        Scanne `investment` et agrège par entité au fil de l'eau (mémoire ~ nombre d'entités) si `accs`.
+        `only` restreint l'agrégation aux entités listées ; `refs` reçoit les références des documents vus.
+        Produit les actions bulk du registre SUMMARY_REFS_INDEX.
+        """
+        for h in scan_hits(self.es_post, "investment", query=query, source=self.SOURCE):
+            s = h.get("_source", {})
+            if stats is not None:
+                stats["scanned"] += 1
+            companies = s.get("companies") or []
+            investors = s.get("investors") or []
+            amount, currency, date = s.get("raised_amount"), s.get("raised_currency_code"), s.get("funded_date")
+            linked = {COMPANY_SUMMARY_INDEX: (companies, investors), INVESTOR_SUMMARY_INDEX: (investors, companies)}
+            for index, (entities, other) in linked.items() if accs is not None else ():
+                for eid in entities:
+                    if only is None or eid in only[index]:
+                        self._accumulate(accs[index], eid, other, amount, currency, date)
+            iid = s.get("id") or h.get("_id")
+            if not iid:
+                continue
+            ref = {"id": iid, "companies": companies, "investors": investors}
+            if refs is not None:
+                refs[iid] = ref
+            yield {"index": {"_index": SUMMARY_REFS_INDEX, "_id": iid}}, ref
+
+    def _recompute(self, affected: Dict[str, set], now: str) -> Dict[str, int]:
+        # Recalcul complet des entités touchées, par paquets de 1000 ids
+        written = {}
+        for index, ids in affected.items():
+            entity_field = self.TARGETS[index][0]
+            ids = sorted(ids)
+            written[index] = 0
+            for i in range(0, len(ids), 1000):
+                chunk = ids[i:i + 1000]
+                accs: Dict[str, Dict[str, Dict[str, Any]]] = {idx: {} for idx in self.TARGETS}
+                only = {idx: set() for idx in self.TARGETS}
+                only[index] = set(chunk)
+                for _ in self._scan({"terms": {entity_field: chunk}}, accs, only=only):
+                    pass
+                self._errors += self._bulk(self._entity_docs(accs[index], chunk, index, now))
+                written[index] += len(chunk)
+        return written
+
+    def refresh(self, full: bool = False) -> Dict[str, Any]:
+        hwm = None if full else self._load_hwm()
+        full = full or hwm is None
+        upper = self._es_now() - timedelta(seconds=MARK_LAG_S)
+        new_hwm = upper.isoformat().replace("+00:00", "Z")
+        now = datetime.now(timezone.utc).isoformat()
+        stats: Dict[str, Any] = {"scanned": 0, "full": full}
+        self._errors = 0
+
+        if full:
+            # Un seul scan : registre écrit au fil de l'eau, agrégats par entité, puis résumés
+            accs: Dict[str, Dict[str, Dict[str, Any]]] = {idx: {} for idx in self.TARGETS}
+            self._errors += self._bulk(self._scan({"match_all": {}}, accs, stats=stats))
+            for index in self.TARGETS:
+                self._errors += self._bulk(self._entity_docs(accs[index], list(accs[index]), index, now))
+                stats[index] = len(accs[index])
+        else:
+            # Investissements nouveaux ou ré-indexés : entités référencées avant (registre) et maintenant
+            refs: Dict[str, Dict[str, Any]] = {}
+            ledger = list(self._scan({"range": {MARK_FIELD: {"gt": hwm, "lte": new_hwm}}}, None,
+                                     refs=refs, stats=stats))
+            previous = self._fetch_by_ids(SUMMARY_REFS_INDEX, list(refs), doc_ids=True)
+            affected: Dict[str, set] = {idx: set() for idx in self.TARGETS}
+            for refs_of in (previous, refs):
+                for r in refs_of.values():
+                    for index, (entity_field, *_rest) in self.TARGETS.items():
+                        affected[index].update(r.get(entity_field) or [])
+            stats.update(self._recompute(affected, now))
+            # Registre mis à jour seulement après les résumés : un rejeu retrouve les anciennes références
+            if not self._errors:
+                self._errors += self._bulk(ledger)
+            # Documents sans horodatage (indexés hors pipeline) : invisibles en incrémental
+            res = self.es_post("/investment/_count",
+                               json={"query": {"bool": {"must_not": [{"exists": {"field": MARK_FIELD}}]}}})
+            stats["unmarked"] = res.get("count", 0)
+
+        errors = self._errors
+        stats["bulk_errors"] = errors
+        self.es_post(f"/{COMPANY_SUMMARY_INDEX},{INVESTOR_SUMMARY_INDEX}/_refresh?ignore_unavailable=true")
+        out = {"summary": f"{stats['scanned']} investissements scannés ; "
+                          f"{stats[COMPANY_SUMMARY_INDEX]} entreprises, {stats[INVESTOR_SUMMARY_INDEX]} investisseurs mis à jour.",
+               **stats}
+        if errors:
+            # Mark inchangé : le prochain passage recalcule les mêmes entités (idempotent)
+            out["note"] = f"{errors} écritures en échec, high-water mark non avancé"
+            out["high_water_mark"] = hwm
+            return out
+        self._save_hwm(new_hwm, stats)
+        out["high_water_mark"] = new_hwm
+        return out
@@ -0,0 +1,73 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.agents.aggregate import AggregateAgent
+
+    # group_by : pagination composite via after_key jusqu'à la page vide
+    pages = [
+        {"buckets": [{"key": {"funded_year": 2010}, "doc_count": 3, "total": {"value": 30.0}}],
+         "after_key": {"funded_year": 2010}},
+        {"buckets": [{"key": {"funded_year": 2011}, "doc_count": 5, "total": {"value": 10.0}}],
+         "after_key": {"funded_year": 2011}},
+        {"buckets": []},
+    ]
+    bodies = []
+    def paged_post(path, json=None, **kw):
+        bodies.append({**json, "aggs": {"groups": {**json["aggs"]["groups"],
+                                                   "composite": dict(json["aggs"]["groups"]["composite"])}}})
+        return {"aggregations": {"groups": pages[len(bodies) - 1]}}
+    res = AggregateAgent(None, paged_post).run("group_by", {
+        "group_by": ["funded_year"], "metrics": [{"op": "sum", "field": "raised_amount", "name": "total"}],
+        "sort_by": "total"})
+    assert len(bodies) == 3, bodies
+    assert "after" not in bodies[0]["aggs"]["groups"]["composite"]
+    assert bodies[1]["aggs"]["groups"]["composite"]["after"] == {"funded_year": 2010}
+    assert bodies[2]["aggs"]["groups"]["composite"]["after"] == {"funded_year": 2011}
+    assert [g["key"]["funded_year"] for g in res["groups"]] == [2010, 2011], res
+
+    # top_terms : terms ordonnée côté ES, size=0, labels résolus
+    seen = []
+    def terms_post(path, json=None, **kw):
+        seen.append((path, json))
+        if path == "/investment/_search":
+            return {"aggregations": {"top": {"buckets": [{"key": "i1", "doc_count": 4, "total": {"value": 9.0}}]}}}
+        return {"hits": {"hits": [{"_source": {"id": "i1", "label": "Investor One"}}]}}
+    res = AggregateAgent(None, terms_post).run("top_terms", {
+        "field": "investors", "size": 5, "sort_by": "total",
+        "metrics": [{"op": "sum", "field": "raised_amount", "name": "total"}]})
+    body = seen[0][1]
+    assert body["size"] == 0 and body["aggs"]["top"]["terms"]["order"] == {"total": "desc"}, body
+    assert body["aggs"]["top"]["terms"]["size"] == 5 and body["aggs"]["top"]["aggs"]["total"] == {"sum": {"field": "raised_amount"}}
+    assert res["buckets"][0]["label"] == "Investor One", res
+
+    # sort_by sur une métrique stats refusé ; erreur ES renvoyée comme {"error"} au lieu de lever
+    res = AggregateAgent(None, terms_post).run("top_terms", {
+        "field": "investors", "sort_by": "s", "metrics": [{"op": "stats", "field": "raised_amount", "name": "s"}]})
+    assert "error" in res, res
+    class FakeHTTPException(Exception):
+        detail = "illegal_argument_exception: Fielddata is disabled on text fields"
+    def failing_post(path, json=None, **kw):
+        raise FakeHTTPException()
+    res = AggregateAgent(None, failing_post).run("top_terms", {"field": "label"})
+    assert "Fielddata" in res.get("error", ""), res
+
+    # Filtres investment partagés (AggregateAgent, ForagingAgent, SpecialistAgent, Test/HypothesisAgent)
+    from agent.agents.foraging import ForagingAgent
+    from agent.core.filters import investment_query
+    params = {"min_amount": "1000", "currency_code": "USD", "year_min": 2010}
+    expected = {"bool": {"filter": [{"range": {"raised_amount": {"gte": 1000.0}}},
+                                    {"term": {"raised_currency_code": "USD"}},
+                                    {"range": {"funded_year": {"gte": 2010}}}]}}
+    assert AggregateAgent(None, None)._build_query(params) == expected
+    assert ForagingAgent(None, None)._build_investment_query(params) == expected
+    assert investment_query(params) == expected
+    assert investment_query({**params, "company_ids": ["c1"]})["bool"]["filter"][-1] == {"terms": {"companies": ["c1"]}}
+    assert investment_query({}) == {"match_all": {}} and investment_query({"es_query": {"term": {"id": "x"}}}) == {"term": {"id": "x"}}
+
+    print("AGGREGATE SUCCESSFUL")
+
+except Exception as e:
+    print(f"AGGREGATE ERROR: {e}")
+    sys.exit(1)
@@ -0,0 +1,62 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.anomaly import InvestmentFrame, scan_investments
+    from agent.agents.hypothesis import HypothesisAgent
+
+    docs = [{"id": f"n{i}", "raised_amount": 1_000_000 * (1 + i % 5), "raised_currency_code": "USD",
+             "funded_date": f"20{10 + i % 10}-0{1 + i % 9}-15", "funded_year": 2010 + i % 10,
+             "companies": [f"c{i}"], "investors": [f"v{i}"]} for i in range(40)]
+    docs += [
+        {"id": "big", "raised_amount": 9e10, "raised_currency_code": "USD", "funded_date": "2012-01-01",
+         "funded_year": 2012, "companies": ["c0"], "investors": ["v1"]},
+        {"id": "y", "raised_amount": 1e6, "raised_currency_code": "USD", "funded_date": "2013-05-01",
+         "funded_year": 2011, "companies": ["c1"], "investors": []},
+        {"id": "bad", "raised_amount": -5, "raised_currency_code": "", "funded_date": "not a date",
+         "companies": [], "investors": ["v2"]},
+        # Rafale : 3 tours en 10 jours pour cX, co-investis par a/b
+        *[{"id": f"b{k}", "raised_amount": 2e6, "raised_currency_code": "USD", "funded_date": f"2015-03-0{k + 1}",
+           "funded_year": 2015, "companies": ["cX"], "investors": ["a", "b"]} for k in range(3)],
+        *[{"id": f"s{k}", "raised_amount": 2e6, "raised_currency_code": "USD", "funded_date": "2016-01-01",
+           "funded_year": 2016, "companies": [f"cs{k}"], "investors": ["a", "b"]} for k in range(2)],
+        # Doublon exact + participations croisées (a investit dans cs0, cs0 investit dans a)
+        {"id": "d1", "raised_amount": 2e6, "raised_currency_code": "USD", "funded_date": "2016-01-01",
+         "funded_year": 2016, "companies": ["cs0"], "investors": ["zz"]},
+        {"id": "x", "raised_amount": 1e6, "raised_currency_code": "USD", "funded_date": "2017-01-01",
+         "funded_year": 2017, "companies": ["a"], "investors": ["cs0"]},
+    ]
+    frame = InvestmentFrame(docs)
+    findings = scan_investments(frame)
+    by_kind = {}
+    for x in findings:
+        by_kind.setdefault(x["kind"], []).append(x)
+    assert by_kind["outlier_round"][0]["investment_id"] == "big", by_kind.get("outlier_round")
+    assert {x["investment_id"] for x in by_kind["year_mismatch"]} == {"y"}
+    for kind in ("invalid_date", "non_positive_amount", "no_company"):
+        assert [x["investment_id"] for x in by_kind[kind]] == ["bad"], (kind, by_kind.get(kind))
+    assert by_kind["company_burst"][0]["company_id"] == "cX" and by_kind["company_burst"][0]["count"] == 3
+    assert by_kind["shared_investors"][0]["investor_ids"] == ["a", "b"]
+    assert by_kind["shared_investors"][0]["shared_companies"] == 3
+    assert set(by_kind["duplicate_round"][0]["investment_ids"]) == {"s0", "d1"}
+    assert by_kind["circular_investment"][0]["entity_ids"] == ["a", "cs0"]
+    assert all(findings[i]["score"] >= findings[i + 1]["score"] for i in range(len(findings) - 1))
+    print(f"Anomaly kinds: { {k: len(v) for k, v in by_kind.items()} }")
+
+    # Agent : PIT + une page, labels résolus via le cache
+    def fake_post(path, json=None, **kw):
+        if "_pit" in path:
+            return {"id": "pit"}
+        if path == "/_search":
+            return {"hits": {"hits": [{"_source": d} for d in docs]}}
+        return {"hits": {"hits": [{"_source": {"id": i, "label": i.upper()}} for i in json["query"]["terms"]["id"]]}}
+    res = HypothesisAgent(None, fake_post).run("generate_hypotheses", {"size": 3})
+    assert res["scanned"] == len(docs) and len(res["hypotheses"]) == 3, res
+    assert all("hypothesis" in h for h in res["hypotheses"])
+
+    print("ANOMALY SUCCESSFUL")
+
+except Exception as e:
+    print(f"ANOMALY ERROR: {e}")
+    sys.exit(1)
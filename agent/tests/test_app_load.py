@@ -16,6 +16,25 @@ try:
     # guard checks authorization header.
     # But correct import is the main thing here.
     
+    # verify passé à chaque requête (REQUESTS_CA_BUNDLE ne doit pas changer le comportement TLS)
+    from agent import app as app_module
+    seen = {}
+    class FakeResponse:
+        content = b"{}"
+        def raise_for_status(self):
+            pass
+    def fake_get(url, **kw):
+        seen.update(kw)
+        return FakeResponse()
+    saved = app_module._session.get
+    app_module._session.get = fake_get
+    try:
+        app_module.es_get("/verify-check")
+    finally:
+        app_module._session.get = saved
+    assert seen.get("verify") is app_module.VERIFY_TLS, seen
+    assert not app_module.WARMUP_LABELS or os.getenv("WARMUP_LABELS"), "label preload must be opt-in"
+
     print("APP LOAD SUCCESSFUL")
 
 except ImportError as e:
@@ -0,0 +1,68 @@
+import sys
+import os
+import io
+import csv
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.export import PARQUET_AVAILABLE, export_types, iter_csv, iter_parquet
+
+    docs = [{"id": "i1", "raised_amount": 1.5e6, "investors": ["v1", "v2"]},
+            {"id": "i2", "raised_amount": None, "funded_date": "2010-01-01"}]
+    rows = list(csv.reader(io.StringIO(b"".join(iter_csv(docs)).decode("utf-8"))))
+    assert rows[0] == ["id", "raised_amount", "investors"], rows
+    assert rows[1] == ["i1", "1500000.0", '["v1", "v2"]'] and rows[2] == ["i2", "", ""], rows
+    # Colonnes du mapping : funded_date (absent du premier document) n'est pas perdu
+    types = export_types({"id": "keyword", "raised_amount": "double", "investors": "keyword",
+                          "funded_date": "date", "label": "text", "label.raw": "keyword", "geo.lat": "float"})
+    assert types == {"id": "string", "raised_amount": "double", "investors": "string", "funded_date": "string",
+                     "label": "string", "geo": "json"}, types
+    rows = list(csv.reader(io.StringIO(b"".join(iter_csv(docs, None, types)).decode("utf-8"))))
+    assert "funded_date" in rows[0] and rows[2][rows[0].index("funded_date")] == "2010-01-01", rows
+
+    if PARQUET_AVAILABLE:
+        import pyarrow.parquet as pq
+        # Colonne nulle sur tout le premier row group puis un nombre : plus d'ArrowTypeError en plein flux
+        many = [{"id": f"i{i}", "raised_amount": None} for i in range(5000)]
+        many += [{"id": "late", "raised_amount": 1.5e6, "funded_date": "2012-01-01", "investors": ["v1"]}]
+        table = pq.read_table(io.BytesIO(b"".join(iter_parquet(many, types=types))))
+        assert table.num_rows == 5001 and table.schema.field("raised_amount").type == "double", table.schema
+        last = table.slice(5000).to_pylist()[0]
+        assert last["raised_amount"] == 1.5e6 and last["funded_date"] == "2012-01-01", last
+        assert last["investors"] == '["v1"]', last
+        # Sans types : inférence prudente, valeurs inconvertibles -> null au lieu d'une exception
+        mixed = [{"a": 1}, {"a": 2.5}] + [{"a": "n/a"}, {"a": 3}]
+        table = pq.read_table(io.BytesIO(b"".join(iter_parquet(mixed, row_group_size=2))))
+        assert table.column("a").to_pylist() == [1.0, 2.5, None, 3.0], table.column("a")
+    else:
+        print("pyarrow absent : tests Parquet ignorés")
+
+    # PIT fermé (dernier pit_id) à la fin du scan et sur arrêt anticipé du consommateur
+    from agent.core.scan import scan_hits
+    closed = []
+    def paged(path, json=None, **kw):
+        if "_pit" in path:
+            return {"id": "pit-0"}
+        after = (json.get("search_after") or [0])[0]
+        return {"pit_id": f"pit-{after + 1}",
+                "hits": {"hits": [{"_source": {"n": i}, "sort": [i + 1]} for i in range(after, min(after + 2, 5))]}}
+    assert len(list(scan_hits(paged, "company", page_size=2, close_pit=closed.append))) == 5
+    assert closed == ["pit-5"], closed
+    closed.clear()
+    for h in scan_hits(paged, "company", page_size=2, close_pit=closed.append):
+        if h["_source"]["n"] == 2:
+            break
+    assert closed == ["pit-3"], closed
+
+    # Erreur ES avant le début du flux : code d'erreur, pas de 200 tronqué
+    from fastapi.testclient import TestClient
+    from agent.app import app, API_TOKEN
+    r = TestClient(app).post("/graph/export", headers={"Authorization": f"Bearer {API_TOKEN}"},
+                             json={"op": "lookup", "parent_index": "missing_index"})
+    assert r.status_code in (502, 503), r.status_code
+
+    print("EXPORT SUCCESSFUL")
+
+except Exception as e:
+    print(f"EXPORT ERROR: {e}")
+    sys.exit(1)
@@ -38,6 +38,9 @@ try:
 
     from agent.agents.presentation import PresentationAgent
     print("PresentationAgent imported")
+
+    from agent.agents.aggregate import AggregateAgent
+    print("AggregateAgent imported")
     
     print("ALL IMPORTS SUCCESSFUL")
 
@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.join_planner import JoinPlanner, query_shape
+
+    assert query_shape({"terms": {"companies": ["c1", "c2"]}}) == {"terms": {"companies": ["?"]}}
+
+    planner = JoinPlanner()
+    key = planner.key("investor", "investment", ["investors", "id"], {"terms": {"companies": ["c1"]}})
+    calls = []
+
+    def summary():
+        calls.append("summary")
+        return {"items": []}, 0
+
+    def federate():
+        calls.append("federate")
+        return {"items": [{"id": "i1"}]}, 1
+
+    def terms():
+        calls.append("terms")
+        return {"items": [{"id": "i1"}], "truncated": True}, 1
+
+    for _ in range(10):
+        plan = planner.execute(key, [("summary", summary), ("federate", federate)], fallbacks=[("terms", terms)])
+        assert plan["strategy"] == "federate", plan
+
+    # Après la phase de mesure, la stratégie toujours vide n'est plus tentée en premier
+    assert calls[-3:] == ["federate", "federate", "federate"], calls
+    assert calls.count("summary") == planner.MIN_SAMPLES, calls
+    # Le lookup tronqué n'est jamais choisi tant qu'une stratégie complète répond
+    assert "terms" not in calls, calls
+
+    # Fallback tenté sur exception ou résultat vide des stratégies planifiées
+    def broken():
+        raise RuntimeError("ES down")
+    other = planner.key("company", "investment", ["companies", "id"], {"match_all": {}})
+    plan = planner.execute(other, [("federate", broken)], fallbacks=[("terms", terms)])
+    assert plan["tried"] == ["federate", "terms"] and plan["result"]["truncated"], plan
+    empty = planner.key("company", "investment", ["companies", "id"], {"term": {"x": 1}})
+    for _ in range(5):
+        assert planner.execute(empty, [("summary", summary)], fallbacks=[("terms", terms)])["strategy"] == "terms"
+
+    # investments_by_amount : lookup tronqué seulement si le join fédéré échoue, et signalé comme tel
+    from agent.agents.specialist import SpecialistAgent
+
+    def es_post(path, json=None, **kw):
+        if path.startswith("/siren/"):
+            raise RuntimeError("federate indisponible")
+        if path == "/company/_search":
+            return {"hits": {"hits": [{"_source": {"id": i, "label": i.upper()}} for i in json["query"]["terms"]["id"]]}}
+        return {"hits": {"total": {"value": 1234}, "hits": [{"_source": {"companies": ["c1"]}}]}}
+
+    agent = SpecialistAgent(lambda *a, **k: {}, es_post)
+    res = agent.investments_by_amount({"size": 1})
+    assert res["strategy"] == "terms" and res["truncated"] and "sur 1234" in res["summary"], res
+
+    print("JOIN PLANNER SUCCESSFUL")
+
+except Exception as e:
+    print(f"JOIN PLANNER ERROR: {e!r}")
+    sys.exit(1)
@@ -0,0 +1,82 @@
+import sys
+import os
+import logging
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core import profiling
+    from agent.core.profiling import profile_request, profiles, record_es, span
+
+    def busy_loop():
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < 0.15:
+            sum(range(1000))
+
+    with profile_request("test") as prof:
+        with span("specialist.fake", params={"company_id": "c1"}):
+            busy_loop()
+        record_es("POST", "/investment/_search?filter_path=x", {"size": 0}, 0.01, {"took": 7})
+    dump = profiles.get(prof.id)
+    assert dump and dump["samples"] > 0, dump
+    assert [s["name"] for s in dump["spans"]] == ["specialist.fake", "es POST /investment/_search"], dump["spans"]
+    assert dump["spans"][1]["took"] == 7
+    # Le classement de functions() (top 30) varie d'un run à l'autre : on vérifie les piles et la liste complète
+    assert "test_profiling.py:busy_loop" in dump["collapsed"], dump["collapsed"][:500]
+    assert any(f["function"] == "test_profiling.py:busy_loop" for f in prof.sampler.functions(limit=None))
+    print(f"Profile: {dump['samples']} samples, top {dump['functions'][0]}")
+
+    # Hors profil : pas de span, mais journal des opérations lentes au-delà du seuil
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    profiling.slow_logger.addHandler(handler)
+    record_es("POST", "/company/_search", {"query": {"match_all": {}}}, 0.01, {"took": profiling.SLOW_ES_MS + 1})
+    record_es("POST", "/company/_search", {"query": {"match_all": {}}}, 0.01, {"took": 1})
+    assert len(records) == 1 and "match_all" in records[0].getMessage(), [r.getMessage() for r in records]
+    # Appel ES en échec : journalisé même rapide
+    record_es("POST", "/company/_search", {"size": 1}, 0.01, None, error="Read timed out")
+    assert len(records) == 2 and "Read timed out" in records[1].getMessage()
+
+    # Bout en bout : header X-Profile -> X-Profile-Id -> dump collapsed
+    from fastapi.responses import StreamingResponse
+    from fastapi.testclient import TestClient
+    from agent import app as app_module
+    from agent.app import app, API_TOKEN
+    app_module.PROFILING = True
+    client = TestClient(app)
+    auth = {"Authorization": f"Bearer {API_TOKEN}"}
+    r = client.get("/debug/profiles/missing", headers={**auth, "X-Profile": "1"})
+    assert r.status_code == 404 and r.headers.get("X-Profile-Id"), r.headers
+    r = client.get(f"/debug/profiles/{r.headers['X-Profile-Id']}?format=collapsed", headers=auth)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain"), r.status_code
+
+    # Sans jeton valide : pas d'échantillonneur démarré
+    r = client.get("/debug/profiles/missing", headers={"X-Profile": "1"})
+    assert r.status_code == 401 and "X-Profile-Id" not in r.headers, r.headers
+
+    # Endpoint sync (threadpool) sans span, et corps streamé : échantillonnés jusqu'à la fin du flux
+    @app.get("/_test/busy")
+    def busy():
+        busy_loop()
+        return {"ok": True}
+
+    @app.get("/_test/stream")
+    def stream():
+        def body():
+            busy_loop()
+            yield b"done"
+        return StreamingResponse(profiling.profiled_iter(body()))
+
+    for path in ("/_test/busy", "/_test/stream"):
+        r = client.get(path, headers={**auth, "X-Profile": "1"})
+        assert r.status_code == 200, (path, r.status_code)
+        dump = profiles.get(r.headers["X-Profile-Id"])
+        assert "test_profiling.py:busy_loop" in dump["collapsed"], (path, dump["collapsed"][:500])
+        assert dump["duration_ms"] >= 150, (path, dump["duration_ms"])
+
+    print("PROFILING SUCCESSFUL")
+
+except Exception as e:
+    print(f"PROFILING ERROR: {e}")
+    sys.exit(1)
@@ -0,0 +1,127 @@
+import sys
+import os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    import requests
+    import threading
+    from agent.core.resilience import CircuitOpenError, ResilientCaller, query_shape
+
+    rc = ResilientCaller(retries=2, breaker_threshold=2, breaker_cooldown_s=60, backoff_s=0.001)
+
+    # Retries : deux erreurs réseau puis succès
+    attempts = []
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise requests.ConnectionError("reset")
+        return {"hits": {"hits": []}}
+    assert rc.call("POST /x/_search", flaky, 30, stale_key="k") == {"hits": {"hits": []}}
+    assert len(attempts) == 3 and rc.stats()["retries"] == 2
+
+    # Circuit breaker : après 2 appels en échec, échec immédiat en servant la réponse périmée
+    def down(timeout):
+        raise requests.ConnectionError("down")
+    for _ in range(2):
+        assert rc.call("POST /x/_search", down, 30, stale_key="k")["_stale"] is True
+    assert rc.breaker.state == "open"
+    calls = []
+    rc.call("POST /x/_search", lambda t: calls.append(t), 30, stale_key="k")
+    assert not calls, "breaker open should not call ES"
+    try:
+        rc.call("POST /y/_search", down, 30, stale_key="other")
+        raise AssertionError("expected CircuitOpenError")
+    except CircuitOpenError:
+        pass
+
+    # Hedging : la p95 connue est dépassée -> requête dupliquée, la plus rapide gagne
+    rc = ResilientCaller(retries=0)
+    for _ in range(30):
+        rc.latency.add("POST /h/_search", 0.01)
+    n = []
+    def slow_first(timeout):
+        n.append(1)
+        time.sleep(0.5 if len(n) == 1 else 0.01)
+        return len(n)
+    t0 = time.perf_counter()
+    assert rc.call("POST /h/_search", slow_first, 30) == 2
+    assert time.perf_counter() - t0 < 0.4 and rc.stats()["hedge_wins"] == 1
+    print(f"Resilience stats: {rc.stats()['hedged']} hedged")
+
+    # Cache périmé partagé : au plus une écriture par clé et par stale_refresh_s
+    class CountingCache(dict):
+        sets = 0
+        def set(self, k, v):
+            CountingCache.sets += 1
+            self[k] = v
+    rc = ResilientCaller(retries=0, hedge=False, stale_cache=CountingCache())
+    for _ in range(5):
+        rc.call("POST /c/_search", lambda t: {"n": 1}, 30, stale_key="same")
+    assert CountingCache.sets == 1
+
+    # Pool saturé : pas de hedge, la tentative s'exécute dans le thread appelant
+    rc = ResilientCaller(retries=0, pool_size=2)
+    for _ in range(30):
+        rc.latency.add("POST /s/_search", 0.01)
+    release = threading.Event()
+    held = threading.Thread(target=rc.call, args=("POST /s/_search", lambda t: release.wait(5), 30))
+    held.start()
+    time.sleep(0.1)
+    caller = []
+    rc.call("POST /s/_search", lambda t: caller.append(threading.current_thread()), 30)
+    assert caller == [threading.current_thread()] and rc.stats()["hedge_skipped"] == 1
+    release.set()
+    held.join()
+    # Les deux tentatives finies, le créneau est rendu
+    time.sleep(0.05)
+    assert rc._hedge_slots.acquire(blocking=False)
+    rc._hedge_slots.release()
+
+    # Timeouts par forme de requête, opt-out, et timeouts comptés dans les latences
+    assert query_shape({"size": 0, "aggs": {"a": {}}}) == "aggs" and query_shape({"size": 0}) == "count"
+    assert query_shape({"query": {}}) == "hits" and query_shape({"size": 5000}) == "page"
+    rc = ResilientCaller(retries=0, hedge=False)
+    for _ in range(30):
+        rc.latency.add("POST /t/_search [hits]", 0.01)
+    assert rc.timeout_for("POST /t/_search [hits]", 30) == rc.min_timeout_s
+    assert rc.timeout_for("POST /t/_search [aggs]", 30) == 30
+    seen = []
+    rc.call("POST /t/_search [hits]", lambda t: seen.append(t), 30, adaptive=False)
+    assert seen == [30], seen
+    def timeout(t):
+        raise requests.Timeout("slow")
+    for _ in range(5):
+        try:
+            rc.call("POST /t/_search [hits]", timeout, 30)
+        except requests.Timeout:
+            pass
+    # Chaque appel : tentative plafonnée puis reprise unique au timeout demandé
+    assert len(rc.latency._samples["POST /t/_search [hits]"]) == 41
+
+    # Requête légitimement lente (0.5 s) sur un endpoint appris à 10 ms : pas de retries plafonnés en cascade,
+    # hedges et retries dans un seul budget de 1 + retries envois
+    for hedge in (False, True):
+        rc = ResilientCaller(retries=2, hedge=hedge, min_timeout_s=0.1, backoff_s=0.001)
+        for _ in range(30):
+            rc.latency.add("POST /l/_search [hits]", 0.01)
+        sent = []
+        def slow(t):
+            sent.append(t)
+            if t < 0.5:
+                time.sleep(t)
+                raise requests.Timeout("capped")
+            time.sleep(0.5)
+            return {"ok": True}
+        assert rc.call("POST /l/_search [hits]", slow, 5) == {"ok": True}
+        assert sent[-1] == 5 and len(sent) <= 1 + rc.retries, (hedge, sent)
+        assert len(sent) == (3 if hedge else 2), (hedge, sent)
+    # Écritures : jamais plafonnées (pas de retry pour rattraper le plafond)
+    sent.clear()
+    assert rc.call("POST /l/_doc [hits]", slow, 5, idempotent=False) == {"ok": True} and sent == [5], sent
+
+    print("RESILIENCE SUCCESSFUL")
+
+except Exception as e:
+    print(f"RESILIENCE ERROR: {e!r}")
+    sys.exit(1)
@@ -0,0 +1,89 @@
+import sys
+import os
+import subprocess
+import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.cache import SQLiteCache, TieredCache, TTLCache
+
+    path = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+    c = SQLiteCache(path, namespace="labels", maxsize=3, ttl=60)
+    c.set_many({("company", "c1"): "Acme", ("company", "c2"): None, ("company", "big"): "x" * 5000})
+    got = c.get_many([("company", "c1"), ("company", "c2"), ("company", "c3"), ("company", "big")])
+    # None stocké != absent
+    assert got == {("company", "c1"): "Acme", ("company", "c2"): None, ("company", "big"): "x" * 5000}, got
+    c.set("expired", 1, ttl=-1)
+    assert c.get("expired", "miss") == "miss"
+
+    # Un autre processus (worker) voit les mêmes entrées
+    code = ("import sys; sys.path.insert(0, %r); from agent.core.cache import SQLiteCache; "
+            "c = SQLiteCache(%r, namespace='labels'); print(c.get(('company', 'c1')))"
+            % (os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")), path))
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+    assert out == "Acme", out
+
+    # Éviction LRU au-delà de maxsize
+    c.set_many({("company", f"n{i}"): i for i in range(5)})
+    c.evict()
+    assert c.stats()["size"] == 3, c.stats()
+
+    t = TieredCache(TTLCache(maxsize=10, ttl=5), SQLiteCache(path, namespace="other", ttl=60))
+    t.set("k", {"a": 1})
+    t.l1.clear()
+    assert t.get("k") == {"a": 1} and t.l1.get("k") == {"a": 1}
+    print(f"Shared cache stats: {t.stats()}")
+
+    # Base verrouillée par un autre worker : écriture perdue et journalisée, lecture servie, pas d'exception
+    import sqlite3
+    c = SQLiteCache(path, namespace="locked", ttl=60, timeout=0.1)
+    c.set("a", 1)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    c.set("b", 2)
+    assert c.get("a") == 1 and c.get("b", "miss") == "miss"
+    other.execute("ROLLBACK")
+    # Table absente (fichier remplacé, corrompu...) : miss
+    other.execute("ALTER TABLE cache RENAME TO cache_old")
+    assert c.get("a", "miss") == "miss" and c.stats()["errors"] >= 2, c.stats()
+    other.execute("ALTER TABLE cache_old RENAME TO cache")
+
+    # Accès LRU différés : aucune écriture à la lecture, appliqués à l'écriture suivante
+    c = SQLiteCache(path, namespace="lru", ttl=60)
+    c.TOUCH_EVERY_S = 0
+    c.set("x", 1)
+    before = other.execute("SELECT accessed FROM cache WHERE ns = 'lru'").fetchone()[0]
+    c.get("x")
+    assert other.execute("SELECT accessed FROM cache WHERE ns = 'lru'").fetchone()[0] == before
+    c.set("y", 2)
+    assert other.execute("SELECT accessed FROM cache WHERE ns = 'lru' AND key = ?",
+                         (c._key("x"),)).fetchone()[0] > before
+    other.close()
+
+    # Préchargement des labels : une écriture par page scannée
+    from agent.core import cache as cache_mod
+    writes = []
+    class Recorder(TTLCache):
+        def set_many(self, items, ttl=None):
+            writes.append(len(items))
+            super().set_many(items, ttl)
+    saved = cache_mod.label_cache
+    cache_mod.label_cache = Recorder()
+    def scan_post(path, json=None, **kw):
+        if "_pit" in path:
+            return {"id": "p"}
+        after = (json.get("search_after") or [0])[0]
+        hits = [{"_source": {"id": f"c{i}", "label": f"L{i}"}, "sort": [i + 1]}
+                for i in range(after, min(after + json["size"], 2500))]
+        return {"hits": {"hits": hits}}
+    try:
+        assert cache_mod.preload_labels(scan_post, indices=("company",)) == 2500
+        assert writes == [1000, 1000, 500], writes
+    finally:
+        cache_mod.label_cache = saved
+
+    print("SHARED CACHE SUCCESSFUL")
+
+except Exception as e:
+    print(f"SHARED CACHE ERROR: {e}")
+    sys.exit(1)
@@ -0,0 +1,58 @@
+import sys
+import os
+import tempfile
+
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.similarity import SimilarityIndex, company_tokens, get_index
+
+    docs = [
+        {"id": "c1", "label": "Aeropostale", "city": "New York", "category_code": "fashion"},
+        {"id": "c2", "label": "Aeropostale Kids", "city": "New York", "category_code": "fashion"},
+        {"id": "c3", "label": "Quantum Labs", "city": "Boston", "category_code": "biotech"},
+        {"id": "c4", "label": "Fashion Street", "city": "New York", "category_code": "fashion"},
+    ]
+    investors = {"c1": ["i1", "i2"], "c2": ["i1"], "c3": ["i9"], "c4": ["i2"]}
+    tokens = [company_tokens(d, investors[d["id"]]) for d in docs]
+    index = SimilarityIndex.from_tokens([d["id"] for d in docs], [d["label"] for d in docs], tokens, dim=256)
+
+    res = index.search(index.vectors[0], k=2, exclude=[0])[0]
+    ranked = [index.ids[r] for r, _ in res]
+    assert ranked[0] == "c2", ranked
+    assert "c1" not in ranked and "c3" not in ranked, ranked
+    print(f"Similar to Aeropostale: {res}")
+
+    # Persistance + chargement mmap, requête sur attributs libres
+    with tempfile.TemporaryDirectory() as d:
+        index.save(d)
+        loaded = SimilarityIndex.load(d)
+        q = loaded.embed(company_tokens({"label": "Quantum", "city": "Boston"}))
+        assert loaded.ids[loaded.search(q, k=1)[0][0][0]] == "c3"
+        # Reconstruction pendant qu'un worker a l'ancienne version mappée : celle-ci reste intacte
+        before = np.array(loaded.vectors)
+        assert get_index(d).ids == index.ids
+        smaller = SimilarityIndex.from_tokens(["c3"], ["Quantum Labs"], tokens[2:3], dim=256)
+        smaller.save(d)
+        smaller.save(d)
+        assert np.array_equal(np.asarray(loaded.vectors), before)
+        assert get_index(d).ids == ["c3"] and len(get_index(d).vectors) == 1
+        assert len([n for n in os.listdir(d) if n.startswith("v-")]) == 2, os.listdir(d)
+
+    # Construction par blocs identique à la construction dense
+    chunked = SimilarityIndex.from_tokens([d["id"] for d in docs], [d["label"] for d in docs], tokens,
+                                          dim=256, chunk_rows=3)
+    assert np.allclose(chunked.vectors, index.vectors) and np.array_equal(chunked.idf, index.idf)
+
+    # IVF : probe de toutes les listes = recherche exacte
+    ivf = SimilarityIndex.from_tokens([d["id"] for d in docs], [d["label"] for d in docs], tokens,
+                                      dim=256, n_lists=2)
+    assert [r for r, _ in ivf.search(ivf.vectors[0], k=3, n_probe=2, exclude=[0])[0]] == \
+           [r for r, _ in index.search(index.vectors[0], k=3, exclude=[0])[0]]
+
+    print("SIMILARITY SUCCESSFUL")
+
+except Exception as e:
+    print(f"SIMILARITY ERROR: {e!r}")
+    sys.exit(1)
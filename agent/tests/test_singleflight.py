@@ -0,0 +1,44 @@
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.singleflight import SingleFlight
+
+    sf = SingleFlight()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"hits": {"hits": []}}
+
+    threads = [threading.Thread(target=lambda: results.append(sf.do(("POST", "/x/_search", "{}"), slow)))
+               for _ in range(5)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(calls) == 1, f"expected 1 execution, got {len(calls)}"
+    assert len(results) == 5 and all(r is results[0] for r in results)
+    stats = sf.stats()
+    assert stats["executed"] == 1 and stats["merged"] == 4 and stats["in_flight"] == 0, stats
+    print(f"SingleFlight stats: {stats}")
+
+    # Une erreur du leader est propagée, et la clé est libérée
+    def boom():
+        raise ValueError("boom")
+    try:
+        sf.do("k", boom)
+        raise AssertionError("exception not propagated")
+    except ValueError:
+        pass
+    assert sf.do("k", lambda: 42) == 42
+
+    print("SINGLEFLIGHT SUCCESSFUL")
+
+except Exception as e:
+    print(f"SINGLEFLIGHT ERROR: {e}")
+    sys.exit(1)
@@ -0,0 +1,117 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.agents.specialist import SpecialistAgent
+    from agent.app import _lean_path
+
+    COMPANIES = {"c1": "Acme Robotics", "c2": "Beta Labs", "c3": "Gamma"}
+    INVESTORS = {"a1": "Alpha Capital", "z9": "Zeta Partners", "m5": "Mid Ventures"}
+    # Buckets dans l'ordre ES (doc_count décroissant) : z9 a 3 tours avec c1, a1 un seul
+    INVESTOR_BUCKETS = {"c1": [("z9", 3), ("m5", 2), ("a1", 1)], "c2": [("a1", 2), ("z9", 1)], "c3": [("m5", 1)]}
+    calls = []
+
+    def fake_post(path, json=None, **kw):
+        calls.append((path, json))
+        q = json.get("query", {})
+        if path == "/company/_search" and "bool" in q:
+            # Résolution des labels : label.raw exact (sensible à la casse) ou phrase nommée (analysée)
+            raw = next(c["terms"]["label.raw"] for c in q["bool"]["should"] if "terms" in c)
+            hits = []
+            for cid, label in COMPANIES.items():
+                names = [c["match_phrase"]["label"]["_name"] for c in q["bool"]["should"] if "match_phrase" in c
+                         and c["match_phrase"]["label"]["query"].lower() in label.lower()]
+                if label in raw or names:
+                    hits.append({"_source": {"id": cid, "label": label}, "matched_queries": names})
+            return {"hits": {"hits": hits}}
+        if path in ("/company/_search", "/investor/_search"):
+            table = COMPANIES if path.startswith("/company") else INVESTORS
+            return {"hits": {"hits": [{"_source": {"id": i, "label": table[i]}}
+                                      for i in q["terms"]["id"] if i in table]}}
+        if path == "/investment/_search":
+            ids = q["terms"]["companies"]
+            if "pairs" in json["aggs"]:
+                # Composite companies x investors trié par clé, paginé via after ; "x1" : co-entreprise hors demande
+                comp = json["aggs"]["pairs"]["composite"]
+                rows = sorted([((cid, i), n) for cid in ids for i, n in INVESTOR_BUCKETS[cid]] + [(("x1", "a1"), 1)])
+                after = comp.get("after")
+                if after:
+                    rows = [r for r in rows if r[0] > (after["company"], after["investor"])]
+                page = rows[:comp["size"]]
+                buckets = [{"key": {"company": c, "investor": i}, "doc_count": n} for (c, i), n in page]
+                pairs = {"buckets": buckets}
+                if buckets:
+                    pairs["after_key"] = buckets[-1]["key"]
+                return {"aggregations": {"pairs": pairs}}
+            return {"aggregations": {"by_company": {"buckets": [
+                {"key": cid, "doc_count": 2, "top": {"hits": {"hits": [{"_source": {"raised_amount": 10.0}}]}}}
+                for cid in ids]}}}
+        raise AssertionError(f"unexpected {path}")
+
+    def lean_post(path, json=None, **kw):
+        # Comme es_post en production : filter_path de _lean_path appliqué à la réponse
+        built = _lean_path(path, True)
+        keep = built.split("filter_path=", 1)[1].split(",") if "filter_path=" in built else None
+        res = fake_post(path, json, **kw)
+        if keep is not None:
+            for h in res.get("hits", {}).get("hits", []):
+                for k in list(h):
+                    if f"hits.hits.{k}" not in keep:
+                        del h[k]
+        return res
+
+    agent = SpecialistAgent(None, lean_post)
+    agent.COMPOSITE_PAGE = 2
+
+    # Labels multi-mots et casse différente résolus ; label inconnu signalé
+    res = agent.run("company_investors_batch", {"company_labels": ["acme robotics", "Beta Labs", "Nope"], "size": 2})
+    assert [c["company_id"] for c in res["companies"]] == ["c1", "c2"], res
+    assert res["not_found"] == ["Nope"], res
+    # Label partiel : seule la phrase nommée le résout, donc matched_queries doit survivre au filter_path
+    assert agent._find_company_ids_by_labels(["robotics"]) == {"robotics": "c1"}
+    # Rang par nombre de tours et non alphabétique
+    c1 = res["companies"][0]
+    assert [i["investor_id"] for i in c1["investors"]] == ["z9", "m5"], c1
+    assert c1["investors"][0] == {"investor_id": "z9", "investor_label": "Zeta Partners", "deal_count": 3}, c1
+    assert c1["investor_count"] == 3 and c1["company_label"] == "Acme Robotics", c1
+    # Toutes les pages composite lues (6 lignes par 2, puis page vide), sans plafond par entreprise
+    assert sum(1 for p, b in calls if p == "/investment/_search" and "pairs" in b["aggs"]) == 4, calls
+
+    # Une seule agrégation pour toutes les entreprises
+    calls.clear()
+    res = agent.run("top_investments_for_companies", {"company_ids": ["c1", "c2", "c3"], "size": 1})
+    inv_calls = [b for p, b in calls if p == "/investment/_search"]
+    assert len(inv_calls) == 1 and inv_calls[0]["aggs"]["by_company"]["aggs"]["top"]["top_hits"]["size"] == 1
+    assert [c["investment_count"] for c in res["companies"]] == [2, 2, 2], res
+
+    res = agent.run("common_investors_across_companies", {"company_ids": ["c1", "c2", "c3"]})
+    pairs = {(p["company_a"], p["company_b"]): [i["investor_id"] for i in p["common_investors"]] for p in res["pairs"]}
+    assert pairs == {("c1", "c2"): ["a1", "z9"], ("c1", "c3"): ["m5"]}, pairs
+    shared = {s["investor_id"]: (s["company_count"], s["investor_label"]) for s in res["most_shared_investors"]}
+    assert shared == {"z9": (2, "Zeta Partners"), "a1": (2, "Alpha Capital"), "m5": (2, "Mid Ventures")}, shared
+    assert "error" in agent.run("common_investors_across_companies", {"company_ids": ["c1"]})
+
+    # Résumés matérialisés seulement sans filtre : devise / montant minimum passent par l'agrégation
+    paths = []
+    def summary_post(path, json=None, **kw):
+        paths.append(path.split("?")[0])
+        if path.startswith("/investment/_search"):
+            return {"aggregations": {"top": {"buckets": [{"key": "a1", "doc_count": 4}]}}}
+        if path.startswith("/investor_summary/_search"):
+            return {"hits": {"hits": [{"_source": {"id": "z9", "deal_count": 99}}]}}
+        return {"hits": {"hits": []}}
+    summary_agent = SpecialistAgent(None, summary_post)
+    res = summary_agent.run("most_active_investors", {"currency_code": "EUR", "min_amount": 5e6})
+    assert "/investor_summary/_search" not in paths and res["investors"][0]["investor_id"] == "a1", (paths, res)
+    paths.clear()
+    res = summary_agent.run("top_companies_by_raised", {"currency_code": "EUR", "min_amount": 5e6})
+    assert "/company_summary/_search" not in paths, paths
+    res = summary_agent.run("most_active_investors", {})
+    assert res["investors"][0]["investor_id"] == "z9", res
+
+    print("SPECIALIST BATCH SUCCESSFUL")
+
+except Exception as e:
+    print(f"SPECIALIST BATCH ERROR: {e!r}")
+    sys.exit(1)
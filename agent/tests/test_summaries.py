@@ -0,0 +1,152 @@
+import sys
+import os
+import json as _json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+try:
+    from agent.core.summaries import (COMPANY_SUMMARY_INDEX, INGEST_PIPELINE, INVESTOR_SUMMARY_INDEX, MARK_FIELD,
+                                      SUMMARY_REFS_INDEX, SummaryMaterializer, _ts)
+
+    # _accumulate / _merge : compteurs explicites, totaux par devise, bornes de dates
+    acc = {}
+    SummaryMaterializer._accumulate(acc, "v1", ["c1", "c2"], 100, "USD", "2010-01-01")
+    SummaryMaterializer._accumulate(acc, "v1", ["c2"], 50, "USD", "2008-05-01")
+    assert acc["v1"]["deal_count"] == 2 and acc["v1"]["raised"] == {"USD": 150.0}
+    doc = SummaryMaterializer._merge({"total_invested": {"EUR": 5.0}, "companies": ["c9"], "deal_count": 1,
+                                      "first_funded_date": "2009-01-01"},
+                                     acc["v1"], "companies", "company_count", "total_invested")
+    assert doc["company_count"] == 3 and doc["companies"] == ["c1", "c2", "c9"], doc
+    assert doc["total_invested"] == {"EUR": 5.0, "USD": 150.0} and doc["deal_count"] == 3
+    assert doc["first_funded_date"] == "2008-05-01" and doc["last_funded_date"] == "2010-01-01"
+
+    # Faux ES : investment + index résumés + état, bulk avec échecs injectables
+    clock = {"now": "2026-10-19T10:00:00.000000000Z"}
+    investments = [
+        {"id": "i1", "companies": ["c1"], "investors": ["v1", "v2"], "raised_amount": 100,
+         "raised_currency_code": "USD", "funded_date": "2010-01-01", MARK_FIELD: "2026-10-19T09:00:00.123456789Z"},
+        # Indexé avant le pipeline : sans horodatage, vu uniquement en full
+        {"id": "i2", "companies": ["c2"], "investors": ["v1"], "raised_amount": 50,
+         "raised_currency_code": "USD", "funded_date": "2011-01-01"},
+    ]
+    store = {COMPANY_SUMMARY_INDEX: {}, INVESTOR_SUMMARY_INDEX: {}, SUMMARY_REFS_INDEX: {}, "summary_state": {}}
+    fail_ids = set()
+
+    def matches(doc, q):
+        if "match_all" in q:
+            return True
+        if "bool" in q:
+            return not any(matches(doc, n) for n in q["bool"].get("must_not", []))
+        if "exists" in q:
+            return q["exists"]["field"] in doc
+        if "terms" in q:
+            (field, values), = q["terms"].items()
+            return bool(set(doc.get(field) or []) & set(values))
+        r = q["range"][MARK_FIELD]
+        m = _ts(doc.get(MARK_FIELD))
+        return m is not None and ("gt" not in r or m > _ts(r["gt"])) and ("lte" not in r or m <= _ts(r["lte"]))
+
+    scans = []
+    def fake_post(path, json=None, data=None, headers=None, **kw):
+        if path.startswith("/_ingest/pipeline/_simulate"):
+            return {"docs": [{"doc": {"_source": {MARK_FIELD: clock["now"]}}}]}
+        if "/_pit" in path:
+            return {"id": "pit"}
+        if path == "/_search":
+            scans.append(json["query"])
+            return {"hits": {"hits": [{"_source": d} for d in investments if matches(d, json["query"])]}}
+        if path.startswith("/investment/_count"):
+            return {"count": sum(matches(d, json["query"]) for d in investments)}
+        if path == "/_bulk":
+            lines = iter(data.strip().split("\n"))
+            items, errors = [], False
+            for meta in lines:
+                (op, meta), = _json.loads(meta).items()
+                doc = _json.loads(next(lines)) if op == "index" else None
+                if meta["_id"] in fail_ids:
+                    items.append({op: {"error": {"type": "es_rejected_execution_exception"}}})
+                    errors = True
+                elif op == "delete":
+                    store[meta["_index"]].pop(meta["_id"], None)
+                    items.append({op: {"result": "deleted"}})
+                else:
+                    store[meta["_index"]][meta["_id"]] = doc
+                    items.append({op: {"result": "created"}})
+            return {"errors": errors, "items": items}
+        if "_refresh" in path:
+            return {}
+        index = path.split("/")[1].split("?")[0]
+        if index in store:
+            ids = json["query"]["ids"]["values"]
+            return {"hits": {"hits": [{"_source": store[index][i]} for i in ids if i in store[index]]}}
+        return {"hits": {"hits": [{"_source": {"id": i, "label": i.upper()}} for i in json["query"]["terms"]["id"]]}}
+
+    m = SummaryMaterializer(None, fake_post)
+    res = m.refresh()
+    assert res["full"] and res["scanned"] == 2 and res["high_water_mark"].startswith("2026-10-19T09:59:00"), res
+    assert store[INVESTOR_SUMMARY_INDEX]["v1"]["company_count"] == 2
+    assert store[INVESTOR_SUMMARY_INDEX]["v1"]["total_invested"] == {"USD": 150.0}
+    assert store[COMPANY_SUMMARY_INDEX]["c1"]["investor_count"] == 2
+    assert store[SUMMARY_REFS_INDEX]["i1"] == {"id": "i1", "companies": ["c1"], "investors": ["v1", "v2"]}
+    assert len(scans) == 1, scans
+    hwm = res["high_water_mark"]
+
+    # Tour rétro-daté (funded_date ancien) ingéré après le mark ; écriture de c1 en échec
+    investments.append({"id": "i3", "companies": ["c1"], "investors": ["v3"], "raised_amount": 30,
+                        "raised_currency_code": "USD", "funded_date": "2001-06-01",
+                        MARK_FIELD: "2026-10-19T10:30:00.5Z"})
+    clock["now"] = "2026-10-19T11:00:00Z"
+    fail_ids.add("c1")
+    res = m.refresh()
+    assert not res["full"] and res["scanned"] == 1 and res["bulk_errors"] == 1, res
+    assert res["high_water_mark"] == hwm and store["summary_state"]["investment"]["high_water_mark"] == hwm, res
+    assert res["unmarked"] == 1, res
+    assert store[INVESTOR_SUMMARY_INDEX]["v3"]["deal_count"] == 1
+    # Registre non mis à jour tant que les résumés n'ont pas tous été écrits
+    assert "i3" not in store[SUMMARY_REFS_INDEX]
+
+    # Rejeu : c1 rattrapé, v3 (déjà écrit) recalculé à l'identique
+    fail_ids.clear()
+    clock["now"] = "2026-10-19T11:05:00Z"
+    res = m.refresh()
+    assert res["bulk_errors"] == 0 and res["high_water_mark"] > hwm, res
+    c1 = store[COMPANY_SUMMARY_INDEX]["c1"]
+    assert c1["total_raised"] == {"USD": 130.0} and c1["first_funded_date"] == "2001-06-01", c1
+    assert c1["investor_count"] == 3 and c1["deal_count"] == 2
+    assert store[INVESTOR_SUMMARY_INDEX]["v3"]["deal_count"] == 1, store[INVESTOR_SUMMARY_INDEX]["v3"]
+
+    # Ré-indexation corrigée de i1 (montant, investisseurs) : rien n'est recompté, v1 perd le tour
+    investments[0].update({"raised_amount": 200, "investors": ["v2"], MARK_FIELD: "2026-10-19T11:06:00Z"})
+    clock["now"] = "2026-10-19T11:10:00Z"
+    res = m.refresh()
+    assert res["scanned"] == 1 and res["bulk_errors"] == 0, res
+    c1 = store[COMPANY_SUMMARY_INDEX]["c1"]
+    assert c1["total_raised"] == {"USD": 230.0} and c1["deal_count"] == 2 and c1["investors"] == ["v2", "v3"], c1
+    v1 = store[INVESTOR_SUMMARY_INDEX]["v1"]
+    assert v1["deal_count"] == 1 and v1["companies"] == ["c2"] and v1["total_invested"] == {"USD": 50.0}, v1
+    assert store[INVESTOR_SUMMARY_INDEX]["v2"]["total_invested"] == {"USD": 200.0}
+
+    # Investissement détaché de son seul investisseur : résumé supprimé
+    investments[2].update({"investors": [], MARK_FIELD: "2026-10-19T11:11:00Z"})
+    clock["now"] = "2026-10-19T11:20:00Z"
+    res = m.refresh()
+    assert "v3" not in store[INVESTOR_SUMMARY_INDEX] and store[COMPANY_SUMMARY_INDEX]["c1"]["investor_count"] == 1
+
+    # Passage suivant sans nouveauté : rien de réécrit
+    clock["now"] = "2026-10-19T11:30:00Z"
+    res = m.refresh()
+    assert res["scanned"] == 0 and res[COMPANY_SUMMARY_INDEX] == 0, res
+
+    # setup_ingest : final_pipeline d'un autre pipeline jamais remplacé
+    puts = []
+    settings = {"investment": {"settings": {"index": {"final_pipeline": "corp_cleanup"}}}}
+    m = SummaryMaterializer(lambda path, **kw: settings, fake_post, es_put=lambda path, json=None: puts.append(path))
+    assert "error" in m.setup_ingest() and not puts
+    settings = {"investment": {"settings": {}}}
+    assert "error" not in m.setup_ingest()
+    assert puts == [f"/_ingest/pipeline/{INGEST_PIPELINE}", "/investment/_settings"], puts
+
+    print("SUMMARIES SUCCESSFUL")
+
+except Exception as e:
+    print(f"SUMMARIES ERROR: {e}")
+    sys.exit(1)